@@ -12,11 +12,13 @@ index, or the mass and cross-section of a putative dark matter
 particle.
 """
 from __future__ import absolute_import, division, print_function
+import multiprocessing
 import numpy as np
 import scipy
 from scipy import stats
 from scipy.optimize import fmin
 
+from astropy.io import fits
 from astropy.table import Table, Column
 import astropy.units as u
 from gammapy.maps import WcsNDMap, MapAxis
@@ -24,6 +26,7 @@ from fermipy import spectrum
 from fermipy.sourcefind_utils import fit_error_ellipse
 from fermipy.sourcefind_utils import find_peaks
 from fermipy.spectrum import SpectralFunction, SEDFunctor
+from fermipy.utils import LRUCache
 from fermipy.utils import onesided_cl_to_dlnl
 from fermipy.utils import twosided_cl_to_dlnl
 
@@ -142,6 +145,89 @@ class Interpolator(object):
         return y
 
 
+class StackedInterpolator(object):
+    """ Helper class for evaluating a set of 1-D piecewise-linear
+    functions tabulated on separate grids.
+
+    The tabulated values of all functions are stored in a pair of
+    2-D arrays so that all functions can be evaluated with a single
+    vectorized call.  Outside the tabulated range each function is
+    linearly extrapolated using the slope at the endpoint, as in
+    `~fermipy.castro.Interpolator`.
+    """
+
+    def __init__(self, x, y):
+        """ C'tor, take input N x M arrays of x and y values, where N
+        is the number of functions and M the number of tabulated values
+        for each function.  Non-finite y values are ignored.
+        """
+        x = np.array(x, ndmin=2, dtype=float)
+        y = np.array(y, ndmin=2, dtype=float)
+
+        msk = np.isfinite(y)
+        npts = np.sum(msk, axis=1)
+
+        # Move the valid points of each function to the front of
+        # each row and pad the remainder with inf
+        idx = np.argsort(~msk, axis=1, kind='mergesort')
+        rows = np.arange(x.shape[0])[:, None]
+        self._x = np.where(np.sort(~msk, axis=1), np.inf, x[rows, idx])
+        self._y = np.where(np.isfinite(self._x), y[rows, idx], 0.0)
+        self._npts = npts
+
+        # Differences between the inf padding of functions with fewer
+        # valid points are masked when computing the slopes
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dx = self._x[:, 1:] - self._x[:, :-1]
+            dy = self._y[:, 1:] - self._y[:, :-1]
+            self._slope = np.where(np.isfinite(dx), dy / dx, 0.0)
+
+    @property
+    def x(self):
+        """ return the x values of each function, padded with inf
+        """
+        return self._x
+
+    @property
+    def y(self):
+        """ return the y values of each function
+        """
+        return self._y
+
+    def _segment(self, x):
+        """ return the index of the linear segment of each function
+        that is used to evaluate the inputs x
+        """
+        shape = x.shape
+        xx = x.reshape((shape[0], -1))
+        idx = np.sum(self._x[:, None, :] <= xx[:, :, None], axis=2) - 1
+        idx = np.clip(idx, 0, (self._npts - 2)[:, None])
+        return idx.reshape(shape)
+
+    def __call__(self, x):
+        """ Return the interpolated values for an array of inputs
+
+        x : N x ... array of inputs, where the first dimension runs
+            over the functions
+        """
+        x = np.array(x, ndmin=1, dtype=float)
+        idx = self._segment(x)
+        rows = np.arange(x.shape[0]).reshape((-1,) + (1,) * (x.ndim - 1))
+        return self._y[rows, idx] + self._slope[rows, idx] * \
+            (x - self._x[rows, idx])
+
+    def derivative(self, x):
+        """ return the first derivative for an array of inputs
+
+        x : N x ... array of inputs, where the first dimension runs
+            over the functions
+        """
+        x = np.array(x, ndmin=1, dtype=float)
+        idx = self._segment(x)
+        rows = np.arange(x.shape[0]).reshape((-1,) + (1,) * (x.ndim - 1))
+        return self._slope[rows, idx]
+
+
 class LnLFn(object):
     """Helper class for interpolating a 1-D log-likelihood function from a
     set of tabulated values.
@@ -630,6 +716,8 @@ class CastroData_Base(object):
             self._nll_null += self._nll_vals[i][0]
             self._loglikes.append(nllfunc)
 
+        self._interp = StackedInterpolator(self._norm_vals, self._nll_vals)
+
     @property
     def nx(self):
         """ Return the number of profiles """
@@ -669,18 +757,18 @@ class CastroData_Base(object):
         nll_val : `~numpy.ndarray`
            Array of negative log-likelihood values.
         """
-        if len(x.shape) == 1:
-            nll_val = np.zeros((1))
-        else:
-            nll_val = np.zeros((x.shape[1:]))
+        x = np.asarray(x)
         # crude hack to force the fitter away from unphysical values
         if (x < 0).any():
-            return 1000.
-
-        for i, xv in enumerate(x):
-            nll_val += self._loglikes[i].interp(xv)
+            if x.ndim < 2:
+                return 1000.
+            nll_val = np.sum(self._interp(x), axis=0)
+            nll_val[(x < 0).any(axis=0)] = 1000.
+            return nll_val
 
-        return nll_val
+        if x.ndim == 1:
+            return np.array([np.sum(self._interp(x))])
+        return np.sum(self._interp(x), axis=0)
 
     def build_lnl_fn(self, normv, nllv):
         """
@@ -690,17 +778,13 @@ class CastroData_Base(object):
     def norm_derivative(self, spec, norm):
         """
         """
+        spec = np.asarray(spec)
         if isinstance(norm, float):
-            der_val = 0.
-        elif len(norm.shape) == 1:
-            der_val = np.zeros((1))
-        else:
-            der_val = np.zeros((norm.shape[1:]))
+            return np.sum(self._interp.derivative(norm * spec) * spec)
 
-        for i, sv in enumerate(spec):
-            der_val += self._loglikes[
-                i].interp.derivative(norm * sv, der=1) * sv
-        return der_val
+        norm = np.asarray(norm)
+        sv = spec.reshape(spec.shape + (1,) * norm.ndim)
+        return np.sum(self._interp.derivative(norm * sv) * sv, axis=0)
 
     def derivative(self, x, der=1):
         """Return the derivate of the log-like summed over the energy
@@ -724,6 +808,9 @@ class CastroData_Base(object):
         else:
             der_val = np.zeros((x.shape[1:]))
 
+        if der == 1:
+            return der_val + np.sum(self._interp.derivative(x), axis=0)
+
         for i, xv in enumerate(x):
             der_val += self._loglikes[i].interp.derivative(xv, der=der)
         return der_val
@@ -772,15 +859,9 @@ class CastroData_Base(object):
             An array of chi2 values for each energy bin.        
         """
 
-        chi2_vals = np.ndarray((self._nx))
-        for i in range(self._nx):
-
-            mle = self._loglikes[i].mle()
-            nll0 = self._loglikes[i].interp(mle)
-            nll1 = self._loglikes[i].interp(x[i])
-            chi2_vals[i] = 2.0 * np.abs(nll0 - nll1)
-
-        return chi2_vals
+        nll0 = self._interp(self.mles())
+        nll1 = self._interp(np.asarray(x, dtype=float))
+        return 2.0 * np.abs(nll0 - nll1)
 
     def getLimits(self, alpha, upper=True):
         """ Evaluate the limits corresponding to a C.L. of (1-alpha)%.
@@ -972,9 +1053,14 @@ class CastroData_Base(object):
         return tab
 
     @staticmethod
-    def stack_nll(shape, components, ylims, weights=None):
+    def stack_nll(shape, components, ylims, weights=None, chunk_size=256):
         """Combine the log-likelihoods from a number of components.
 
+        The likelihood of every component is resampled onto a common
+        normalization grid in each bin.  Components are processed in
+        chunks of ``chunk_size`` with one vectorized interpolation per
+        chunk.
+
         Parameters
         ----------
         shape    :  tuple
@@ -985,6 +1071,9 @@ class CastroData_Base(object):
 
         weights : array-like
 
+        chunk_size : int
+           Number of components that are resampled together.
+
         Returns
         -------
         norm_vals : 'numpy.ndarray'
@@ -998,23 +1087,32 @@ class CastroData_Base(object):
 
         if weights is None:
             weights = np.ones((len(components)))
+        weights = np.asarray(weights, dtype=float)
 
         norm_vals = np.zeros(shape)
+        norm_vals[:, 1:] = np.logspace(np.log10(ylims[0]),
+                                       np.log10(ylims[1]), n_vals - 1)
         nll_vals = np.zeros(shape)
-        for i in range(n_bins):
-            log_min = np.log10(ylims[0])
-            log_max = np.log10(ylims[1])
-            norm_vals[i, 1:] = np.logspace(log_min, log_max, n_vals - 1)
-            check = 0
-            for c, w in zip(components, weights):
-                check += w * c[i].interp(norm_vals[i, -1])
-                nll_vals[i] += w * c[i].interp(norm_vals[i])
-                pass
-            # reset the zeros
-            nll_obj = LnLFn(norm_vals[i], nll_vals[i])
-            nll_min = nll_obj.fn_mle()
-            nll_vals[i] -= nll_min
-            pass
+
+        for i0 in range(0, len(components), chunk_size):
+
+            chunk = components[i0:i0 + chunk_size]
+            ny = max([c.ny for c in chunk])
+            x = np.full((len(chunk), n_bins, ny), np.nan)
+            y = np.full((len(chunk), n_bins, ny), np.nan)
+            for j, c in enumerate(chunk):
+                x[j, :, :c.ny] = c._norm_vals[:n_bins]
+                y[j, :, :c.ny] = c._nll_vals[:n_bins]
+
+            interp = StackedInterpolator(x.reshape((-1, ny)),
+                                         y.reshape((-1, ny)))
+            xv = np.tile(norm_vals, (len(chunk), 1))
+            nll = interp(xv).reshape((len(chunk),) + shape)
+            w = weights[i0:i0 + chunk_size]
+            nll_vals += np.sum(w[:, None, None] * nll, axis=0)
+
+        # reset the zeros
+        nll_vals -= np.min(nll_vals, axis=1)[:, None]
 
         return norm_vals, nll_vals
 
@@ -1245,7 +1343,8 @@ class CastroData(CastroData_Base):
         return cls(norm_vals, nll_vals, spec_data, norm_type)
 
     @classmethod
-    def create_from_stack(cls, shape, components, ylims, weights=None):
+    def create_from_stack(cls, shape, components, ylims, weights=None,
+                          chunk_size=256):
         """  Combine the log-likelihoods from a number of components.
 
         Parameters
@@ -1258,6 +1357,9 @@ class CastroData(CastroData_Base):
 
         weights : array-like
 
+        chunk_size : int
+           Number of components that are resampled together.
+
         Returns
         -------
         castro : `~fermipy.castro.CastroData`
@@ -1265,7 +1367,7 @@ class CastroData(CastroData_Base):
         if len(components) == 0:
             return None
         norm_vals, nll_vals = CastroData_Base.stack_nll(
-            shape, components, ylims, weights)
+            shape, components, ylims, weights, chunk_size=chunk_size)
         return cls(norm_vals, nll_vals,
                    components[0].refSpec,
                    components[0].norm_type)
@@ -1372,6 +1474,38 @@ class CastroData(CastroData_Base):
         return fn
 
 
+_TSCUBE_ARGS = None
+
+
+def _test_spectra_worker(ipix):
+    """Fit spectral models to a block of TSCube pixels in a worker
+    process.  The TSCube is inherited from the parent when the worker
+    is forked."""
+    tscube, spec_types = _TSCUBE_ARGS
+    return tscube._test_spectra_of_ipix(ipix, spec_types)
+
+
+class ScanColumn(object):
+    """Read-only view of a likelihood scan column of a TSCube file.
+    Rows are only read from the underlying (possibly memory-mapped)
+    array when they are accessed and are multiplied by ``scale`` on
+    access."""
+
+    def __init__(self, data, scale=1.0):
+        self._data = data
+        self._scale = scale
+
+    @property
+    def shape(self):
+        return self._data.shape
+
+    def __len__(self):
+        return self._data.shape[0]
+
+    def __getitem__(self, idx):
+        return np.array(self._data[idx], dtype=float) * self._scale
+
+
 class TSCube(object):
     """A class wrapping a TSCube, which is a collection of CastroData
     objects for a set of directions.
@@ -1384,7 +1518,7 @@ class TSCube(object):
     """
 
     def __init__(self, tsmap, normmap, tscube, normcube,
-                 norm_vals, nll_vals, refSpec, norm_type):
+                 norm_vals, nll_vals, refSpec, norm_type, cache_size=256):
         """C'tor
 
         Parameters
@@ -1424,6 +1558,10 @@ class TSCube(object):
             * dnde : Differential flux of the test source ( ph cm^-2 s^-1
               MeV^-1 )
 
+        cache_size : int
+            Maximum number of per-pixel `~fermipy.castro.CastroData`
+            objects that are kept in memory.
+
         """
         self._tsmap = tsmap
         self._normmap = normmap
@@ -1436,6 +1574,8 @@ class TSCube(object):
         self._nE = self._refSpec.nE
         self._nN = 10
         self._norm_type = norm_type
+        self._castro_cache = LRUCache(maxsize=cache_size)
+        self._hdulist = None
 
     @property
     def nvals(self):
@@ -1486,7 +1626,8 @@ class TSCube(object):
         return self._nN
 
     @classmethod
-    def create_from_fits(cls, fitsfile, norm_type='flux'):
+    def create_from_fits(cls, fitsfile, norm_type='flux', lazy=False,
+                         cache_size=256):
         """Build a TSCube object from a fits file created by gttscube
         Parameters
         ----------
@@ -1496,15 +1637,31 @@ class TSCube(object):
         norm_type : str
            String specifying the quantity used for the normalization
 
+        lazy : bool
+           Memory-map the likelihood scan columns instead of loading
+           them into memory.  The scan data of a pixel is only read
+           when the `~fermipy.castro.CastroData` object for that pixel
+           is requested.
+
+        cache_size : int
+           Maximum number of per-pixel `~fermipy.castro.CastroData`
+           objects that are kept in memory.
+
         """
         tsmap = WcsNDMap.read(fitsfile)
 
         tab_e = Table.read(fitsfile, 'EBOUNDS')
-        tab_s = Table.read(fitsfile, 'SCANDATA')
         tab_f = Table.read(fitsfile, 'FITDATA')
+        if lazy:
+            hdulist = fits.open(fitsfile, memmap=True)
+            scan_data = hdulist['SCANDATA'].data
+            tab_s = {k: scan_data[k] for k in ['norm_scan', 'dloglike_scan']}
+            tab_s['ts'] = np.array(scan_data['ts'])
+            tab_s['norm'] = np.array(scan_data['norm'])
+        else:
+            tab_s = convert_sed_cols(Table.read(fitsfile, 'SCANDATA'))
 
         tab_e = convert_sed_cols(tab_e)
-        tab_s = convert_sed_cols(tab_s)
         tab_f = convert_sed_cols(tab_f)
 
         emin = np.array(tab_e['e_min'])
@@ -1534,8 +1691,14 @@ class TSCube(object):
             raise RuntimeError("Counts map has dimension %i" % (ndim))
 
         refSpec = ReferenceSpec.create_from_table(tab_e)
-        nll_vals = -np.array(tab_s["dloglike_scan"])
-        norm_vals = np.array(tab_s["norm_scan"])
+        ref_colname = 'ref_%s' % norm_type
+        norm_scale = np.array(tab_e[ref_colname])[:, np.newaxis]
+        if lazy:
+            nll_vals = ScanColumn(tab_s["dloglike_scan"], -1.0)
+            norm_vals = ScanColumn(tab_s["norm_scan"], norm_scale)
+        else:
+            nll_vals = -np.array(tab_s["dloglike_scan"])
+            norm_vals = np.array(tab_s["norm_scan"]) * norm_scale
 
         axis = MapAxis.from_edges(np.concatenate((emin, emax[-1:])),
                                   interp='log')
@@ -1546,23 +1709,36 @@ class TSCube(object):
         ncube = WcsNDMap(geom_3d,
                          np.rollaxis(tab_s["norm"].reshape(cube_shape), 2, 0))
         nmap = WcsNDMap(tsmap.geom,
-                        tab_f['fit_norm'].reshape(tsmap.data.shape))
+                        np.array(tab_f['fit_norm']).reshape(tsmap.data.shape))
 
-        ref_colname = 'ref_%s' % norm_type
-        norm_vals *= tab_e[ref_colname][np.newaxis, :, np.newaxis]
+        o = cls(tsmap, nmap, tscube, ncube,
+                norm_vals, nll_vals, refSpec,
+                norm_type, cache_size=cache_size)
+        if lazy:
+            o._hdulist = hdulist
+        return o
 
-        return cls(tsmap, nmap, tscube, ncube,
-                   norm_vals, nll_vals, refSpec,
-                   norm_type)
+    def close(self):
+        """Close the FITS file backing a lazily loaded TSCube."""
+        if self._hdulist is not None:
+            self._hdulist.close()
+            self._hdulist = None
 
     def castroData_from_ipix(self, ipix, colwise=False):
         """ Build a CastroData object for a particular pixel """
         # pix = utils.skydir_to_pix
         if colwise:
             ipix = self._tsmap.ipix_swap_axes(ipix, colwise)
-        norm_d = self._norm_vals[ipix]
-        nll_d = self._nll_vals[ipix]
-        return CastroData(norm_d, nll_d, self._refSpec, self._norm_type)
+
+        key = tuple(np.ravel(ipix).tolist())
+        castro = self._castro_cache.get(key)
+        if castro is None:
+            norm_d = self._norm_vals[ipix]
+            nll_d = self._nll_vals[ipix]
+            castro = CastroData(norm_d, nll_d, self._refSpec,
+                                self._norm_type)
+            self._castro_cache.put(key, castro)
+        return castro
 
     def castroData_from_pix_xy(self, xy, colwise=False):
         """ Build a CastroData object for a particular pixel """
@@ -1640,6 +1816,147 @@ class TSCube(object):
         test_dict = castro.test_spectra(spec_types)
         return (castro, test_dict)
 
+    def _test_spectra_of_ipix(self, ipix, spec_types):
+        """Fit each spectral model to the CastroData of each pixel in
+        ``ipix`` and return the best-fit parameters, TS and
+        log-likelihood as a dictionary of arrays."""
+
+        o = {}
+        for spec_type in spec_types:
+            o[spec_type] = {'params': [],
+                            'ts': np.zeros(len(ipix)),
+                            'loglike': np.zeros(len(ipix))}
+
+        for i, ip in enumerate(ipix):
+            castro = self.castroData_from_ipix(ip)
+            test_dict = castro.test_spectra(spec_types)
+            for spec_type in spec_types:
+                d = test_dict[spec_type]
+                o[spec_type]['params'] += [np.array(d['Result'])]
+                o[spec_type]['ts'][i] = np.squeeze(d['TS'])
+                o[spec_type]['loglike'][i] = \
+                    -np.squeeze(castro(d['Spectrum']))
+
+        return o
+
+    def test_spectra_of_pixels(self, ipix=None, threshold=None,
+                               spec_types=None, use_cumul=False,
+                               nthread=1):
+        """Test different spectral types against the SED of each pixel
+        in a set of pixels of this TSCube.  Pixels are split into blocks
+        that are fit in parallel by ``nthread`` worker processes.
+
+        Parameters
+        ----------
+        ipix : array-like
+           Flat indices of the pixels to test.  If None then all pixels
+           with TS above ``threshold`` are tested.
+
+        threshold : float
+           TS threshold used to select pixels when ``ipix`` is None.
+
+        spec_types : [str,...]
+           List of spectral types to try
+
+        use_cumul : bool
+           Select pixels with the cumulative TS map (i.e. the TS summed
+           over the energy bins) instead of the TS map.
+
+        nthread : int
+           Number of worker processes.  If None then one process is
+           created for each available core.
+
+        Returns
+        -------
+        tab : `~astropy.table.Table`
+           Table with one row per pixel.  For each spectral type the
+           table contains the best-fit parameters (``<type>_params``),
+           TS (``<type>_ts``), log-likelihood (``<type>_loglike``) and
+           the log-likelihood relative to the first spectral type
+           (``<type>_dloglike``).
+        """
+        global _TSCUBE_ARGS
+
+        if spec_types is None:
+            spec_types = ["PowerLaw", "LogParabola", "PLExpCutoff"]
+
+        if ipix is None:
+            ts = self._ts_cumul.data if use_cumul else self._tsmap.data
+            ts = np.ravel(ts)
+            if threshold is None:
+                ipix = np.arange(len(ts))
+            else:
+                ipix = np.flatnonzero(ts > threshold)
+        ipix = np.array(ipix, ndmin=1, dtype=int)
+
+        if nthread is None:
+            nthread = multiprocessing.cpu_count()
+        nthread = max(min(nthread, len(ipix)), 1)
+
+        if nthread == 1:
+            results = [self._test_spectra_of_ipix(ipix, spec_types)]
+        else:
+            try:
+                ctx = multiprocessing.get_context('fork')
+            except AttributeError:
+                ctx = multiprocessing
+
+            blocks = np.array_split(ipix, 4 * nthread)
+            blocks = [b for b in blocks if len(b)]
+            _TSCUBE_ARGS = (self, spec_types)
+            pool = ctx.Pool(processes=nthread)
+            try:
+                results = pool.map(_test_spectra_worker, blocks)
+            finally:
+                pool.close()
+                pool.join()
+                _TSCUBE_ARGS = None
+
+        tab = Table([Column(name='ipix', data=ipix)])
+        loglike0 = None
+        for spec_type in spec_types:
+            name = spec_type.lower()
+            params = sum([r[spec_type]['params'] for r in results], [])
+            ts = np.concatenate([r[spec_type]['ts'] for r in results])
+            loglike = np.concatenate([r[spec_type]['loglike']
+                                      for r in results])
+            if loglike0 is None:
+                loglike0 = loglike
+            params = np.array(params) if params else np.zeros((0, 1))
+            tab.add_column(Column(name='%s_params' % name, data=params))
+            tab.add_column(Column(name='%s_ts' % name, data=ts))
+            tab.add_column(Column(name='%s_loglike' % name, data=loglike))
+            tab.add_column(Column(name='%s_dloglike' % name,
+                                  data=loglike - loglike0))
+
+        return tab
+
+    def test_spectra_of_peaks(self, peaks, spec_types=None, nthread=1):
+        """Test different spectral types against the SEDs of a list of
+        peaks in this TSCube.  See
+        `~fermipy.castro.TSCube.test_spectra_of_pixels`.
+
+        Parameters
+        ----------
+        peaks : list
+           List of peak dictionaries, e.g. the output of
+           `~fermipy.castro.TSCube.find_and_refine_peaks`.
+
+        spec_types : [str,...]
+           List of spectral types to try
+
+        nthread : int
+           Number of worker processes.
+        """
+        shape = self._tsmap.data.shape
+        if len(shape) == 1:
+            ipix = [peak['ix'] for peak in peaks]
+        else:
+            ipix = [np.ravel_multi_index((peak['iy'], peak['ix']), shape)
+                    for peak in peaks]
+        return self.test_spectra_of_pixels(ipix, spec_types=spec_types,
+                                           nthread=nthread)
+
     def find_sources(self, threshold,
                      min_separation=1.0,
                      use_cumul=False,
@@ -47,6 +47,9 @@ common = {
     'multithread': (False, 'Split the calculation across number of processes set by nthread option.', bool),
     'nthread': (None, 'Number of processes to create when multithread is True.  If None then one process '
                 'will be created for each available core.', int),
+    'template_stack': (False, 'Precompute the source maps for all points of the spatial likelihood scan '
+                       'and refit only the normalization of the source of interest at each point.  '
+                       'This is faster than refitting all free parameters at each point.', bool),
     'model': (None, 'Dictionary defining the spatial/spectral properties of the test source. '
               'If model is None the test source will be a PointSource with an Index 2 power-law spectrum.', dict),
     'free_background': (False, 'Leave background parameters free when performing the fit. If True then any '
@@ -161,7 +164,16 @@ gtlike = {
     'bexpmap_base': (None, 'Set the basline all-sky expoure map file.  This will be used to generate a scaled source map.', str),
     'bexpmap_roi_base': (None, 'Set the basline ROI expoure map file.  This will be used to generate a scaled source map.', str),
     'use_external_srcmap': (False, 'Use an external precomputed source map file.', bool),
+    'srcmap_cache': (None, 'Path to a directory that will be used as a persistent cache of source maps.  '
+                     'Source maps of non-diffuse sources are looked up in this cache before running gtsrcmaps '
+                     'and newly computed maps are added to it.  If None the cache is disabled.', str),
+    'srcmap_cache_size': (10.0, 'Maximum size of the source map cache in GB.  The least recently used '
+                          'source maps are removed when this size is exceeded.', float),
     'use_scaled_srcmap': (False, 'Generate source map by scaling an external srcmap file.', bool),
+    'psf_cache_nside': (None, 'HEALPix NSIDE of the grid on which PSF models are shared.  When set the PSF '
+                        'model is evaluated at the center of the pixel containing the ROI center and is reused '
+                        'by all analyses with a center in the same pixel.  If None then PSF models are only shared '
+                        'by positions within the same livetime cube pixel.', int),
     'wmap': (None, 'Likelihood weights map.', str),
     'llscan_npts': (20, 'Number of evaluation points to use when performing a likelihood scan.', int),
     'src_expscale': (None, 'Dictionary of exposure corrections for individual sources keyed to source name.  The exposure '
@@ -290,6 +302,8 @@ residmap = {
     'loge_bounds': common['loge_bounds'],
     'make_plots': common['make_plots'],
     'use_weights': common['use_weights'],
+    'multithread': common['multithread'],
+    'nthread': common['nthread'],
     'write_fits': common['write_fits'],
     'write_npy': common['write_npy'],
 }
@@ -304,6 +318,9 @@ tsmap = {
     'max_kernel_radius': (3.0, 'Set the maximum radius of the test source kernel.  Using a '
                           'smaller value will speed up the TS calculation at the loss of '
                           'accuracy.', float),
+    'vectorize': (True, 'Fit the test source amplitude simultaneously for batches of pixels '
+                  'using vectorized array operations.  If False the amplitude will be fit '
+                  'separately at each pixel.', bool),
     'loge_bounds': common['loge_bounds'],
     'make_plots': common['make_plots'],
     'write_fits': common['write_fits'],
@@ -357,10 +374,20 @@ sourcefind = {
 lightcurve = {
     'outdir': (None, r'Store all data in this directory (e.g. "30days"). If None then use current directory.', str),
     'use_local_ltcube': (True, 'Generate a fast LT cube.', bool),
+    'use_ltcube_slices': (True, 'Generate the fast LT cubes of all time bins in a single pass over the '
+                          'spacecraft file by summing time slices of the livetime.  Only used when '
+                          'use_local_ltcube is True.', bool),
     'use_scaled_srcmap': (False, 'Generate approximate source maps for each time bin by scaling '
                           'the current source maps by the exposure ratio with respect to that time bin.', bool),
     'save_bin_data': (True, 'Save analysis directories for individual time bins.  If False then only '
                       'the analysis results table will be saved.', bool),
+    'checkpoint': (False, 'Write the result of each time bin to a checkpoint file as soon as it '
+                   'completes.  When rerunning a lightcurve, time bins with an existing checkpoint '
+                   'are restored instead of being refit.  Checkpoints are written to the output '
+                   'directory and are only restored for an identical bin configuration.', bool),
+    'use_batch': (False, 'Dispatch the analysis of the individual time bins to the batch farm '
+                  'with the fermipy-lightcurve-bin-sg scatter-gather application.  Implies '
+                  'checkpoint.', bool),
     'binsz': (86400.0, 'Set the lightcurve bin size in seconds.', float),
     'shape_ts_threshold': (16.0, 'Set the TS threshold at which shape parameters of '
                            'sources will be freed.  If a source is detected with TS less than this '
@@ -542,6 +569,9 @@ extension = {
                      'corrected PSF is given by P\'(x;E) = P(x/(1+f(E));E) where x is the angular separation.',
                      tuple),
     'make_tsmap': (True, 'Make a TS map for the source of interest.', bool),
+    'multithread': common['multithread'],
+    'nthread': common['nthread'],
+    'template_stack': common['template_stack'],
     'make_plots': common['make_plots'],
     'write_fits': common['write_fits'],
     'write_npy': common['write_npy'],
@@ -558,7 +588,13 @@ localize = {
     'free_background': common['free_background'],
     'fix_shape': common['fix_shape'],
     'free_radius': common['free_radius'],
+    'refine': (0, 'Number of refinement passes of the position scan.  In each pass the scan grid '
+               'is recentered on the likelihood peak of the previous pass and the grid spacing is '
+               'halved.', int),
     'update': (True, 'Update the source model with the best-fit position.', bool),
+    'template_stack': common['template_stack'],
+    'multithread': common['multithread'],
+    'nthread': common['nthread'],
     'make_plots': common['make_plots'],
     'write_fits': common['write_fits'],
     'write_npy': common['write_npy'],
@@ -107,7 +107,8 @@ def create_link_fermipy_coadd(**kwargs):
     link = Link(linkname=kwargs.pop('linkname', 'fermipy-coadd'),
                 appname='fermipy-coadd',
                 options=dict(args=([], "List of input files", list),
-                             output=(None, "Output file", str)),
+                             output=(None, "Output file", str),
+                             nthread=(1, "Number of threads used to read input files", int)),
                 file_args=dict(args=FileFlags.input_mask,
                                output=FileFlags.output_mask),
                 **kwargs)
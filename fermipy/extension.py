@@ -5,6 +5,7 @@ import copy
 import json
 import pprint
 import logging
+import multiprocessing
 import numpy as np
 from astropy.io import fits
 from astropy.table import Table, Column
@@ -19,6 +20,16 @@ from fermipy.data_struct import MutableNamedTuple
 from fermipy import fits_utils
 from LikelihoodState import LikelihoodState
 
+_EXT_SCAN_ARGS = None
+
+
+def _scan_extension_worker(width):
+    """Run a width scan in a worker process.  The analysis object is
+    inherited from the parent when the worker is forked so each
+    worker operates on its own copy of the likelihood state."""
+    gta, method, name, kwargs = _EXT_SCAN_ARGS
+    return getattr(gta, method)(name, width=width, **kwargs)
+
 
 class ExtensionFit(object):
     """Mixin class which provides extension fitting to
@@ -184,12 +195,18 @@ class ExtensionFit(object):
         if kwargs['fit_position']:
             ext_fit = self._fit_extension_full(name,
                                                spatial_model=spatial_model,
-                                               optimizer=kwargs['optimizer'])
+                                               optimizer=kwargs['optimizer'],
+                                               multithread=kwargs['multithread'],
+                                               nthread=kwargs['nthread'],
+                                               template_stack=kwargs['template_stack'])
         else:
             ext_fit = self._fit_extension(name,
                                           spatial_model=spatial_model,
                                           optimizer=kwargs['optimizer'],
-                                          psf_scale_fn=psf_scale_fn)
+                                          psf_scale_fn=psf_scale_fn,
+                                          multithread=kwargs['multithread'],
+                                          nthread=kwargs['nthread'],
+                                          template_stack=kwargs['template_stack'])
 
         o.update(ext_fit)
 
@@ -207,7 +224,10 @@ class ExtensionFit(object):
                                          spatial_model=spatial_model,
                                          width=width,
                                          optimizer=kwargs['optimizer'],
-                                         psf_scale_fn=psf_scale_fn)
+                                         psf_scale_fn=psf_scale_fn,
+                                         multithread=kwargs['multithread'],
+                                         nthread=kwargs['nthread'],
+                                         template_stack=kwargs['template_stack'])
 
         self.set_source_morphology(name, spatial_model=spatial_model,
                                    spatial_pars={'ra': o['ra'], 'dec': o['dec'],
@@ -378,13 +398,18 @@ class ExtensionFit(object):
                                    psf_scale_fn=psf_scale_fn,
                                    use_pylike=False)
 
-        o.ebin_loglike = self._scan_extension_fast_ebin(name,
-                                                        spatial_model=spatial_model,
-                                                        width=o.width,
-                                                        optimizer=kwargs[
-                                                            'optimizer'],
-                                                        psf_scale_fn=psf_scale_fn,
-                                                        reoptimize=False)
+        scan_kwargs = dict(spatial_model=spatial_model,
+                           width=o.width,
+                           optimizer=kwargs['optimizer'],
+                           psf_scale_fn=psf_scale_fn,
+                           reoptimize=False)
+        if kwargs.get('multithread', False):
+            o.ebin_loglike = self._scan_extension_parallel(
+                name, '_scan_extension_fast_ebin',
+                nthread=kwargs.get('nthread', None), **scan_kwargs)
+        else:
+            o.ebin_loglike = self._scan_extension_fast_ebin(name,
+                                                            **scan_kwargs)
 
         for i, (logemin, logemax) in enumerate(zip(self.log_energies[:-1],
                                                    self.log_energies[1:])):
@@ -406,9 +431,16 @@ class ExtensionFit(object):
     def _scan_extension(self, name, **kwargs):
 
         saved_state = LikelihoodState(self.like)
+        multithread = kwargs.pop('multithread', False)
+        nthread = kwargs.pop('nthread', None)
 
         if not hasattr(self.components[0].like.logLike, 'setSourceMapImage'):
             loglike = self._scan_extension_pylike(name, **kwargs)
+        elif multithread:
+            loglike = self._scan_extension_parallel(name,
+                                                    '_scan_extension_fast',
+                                                    nthread=nthread,
+                                                    **kwargs)
         else:
             loglike = self._scan_extension_fast(name, **kwargs)
 
@@ -416,6 +448,44 @@ class ExtensionFit(object):
 
         return loglike
 
+    def _scan_extension_parallel(self, name, method, nthread=None,
+                                 **kwargs):
+        """Split the width vector into contiguous blocks and scan each
+        block with ``method`` in a separate process.  Workers are
+        forked after the model has been prepared and inherit a copy
+        of the likelihood state.  Since the fit at every width starts
+        from the same saved model state the result is identical to
+        the serial scan and does not depend on ``nthread``.  The
+        per-block outputs are concatenated along the last (width)
+        axis."""
+        global _EXT_SCAN_ARGS
+
+        width = np.array(kwargs.pop('width'))
+        if nthread is None:
+            nthread = multiprocessing.cpu_count()
+        nthread = max(min(nthread, len(width)), 1)
+        blocks = [width[idx] for idx in
+                  np.array_split(np.arange(len(width)), nthread)]
+
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except AttributeError:
+            ctx = multiprocessing
+
+        self.logger.debug('Scanning %i widths with %i processes.',
+                          len(width), nthread)
+
+        _EXT_SCAN_ARGS = (self, method, name, kwargs)
+        pool = ctx.Pool(processes=nthread)
+        try:
+            loglike = pool.map(_scan_extension_worker, blocks)
+        finally:
+            pool.close()
+            pool.join()
+            _EXT_SCAN_ARGS = None
+
+        return np.concatenate(loglike, axis=-1)
+
     def _scan_extension_fast(self, name, **kwargs):
 
         state = SourceMapState(self.like, [name])
@@ -428,10 +498,30 @@ class ExtensionFit(object):
         skydir = kwargs.pop('skydir', self.roi[name].skydir)
         psf_scale_fn = kwargs.pop('psf_scale_fn', None)
         reoptimize = kwargs.pop('reoptimize', True)
+        template_stack = kwargs.pop('template_stack', False)
 
         src = self.roi.copy_source(name)
         spatial_pars = {'ra': skydir.ra.deg, 'dec': skydir.dec.deg}
 
+        if template_stack:
+            srcs = []
+            for w in width:
+                s = copy.deepcopy(src)
+                s.set_spatial_model(spatial_model,
+                                    dict(spatial_pars,
+                                         SpatialWidth=max(w, 0.00316)))
+                srcs += [s]
+            loglike = self._scan_srcmap_stack(name, srcs,
+                                              optimizer=optimizer,
+                                              psf_scale_fn=psf_scale_fn,
+                                              reoptimize=reoptimize)
+            state.restore()
+            return loglike
+
+        # Start the fit at every width from the same model state such
+        # that the result does not depend on the order of the scan
+        saved_state = LikelihoodState(self.like)
+
         loglike = []
         for i, w in enumerate(width):
 
@@ -442,11 +532,13 @@ class ExtensionFit(object):
                                        use_pylike=False,
                                        psf_scale_fn=psf_scale_fn)
             if reoptimize:
+                saved_state.restore()
                 fit_output = self._fit(loglevel=logging.DEBUG, **optimizer)
                 loglike += [fit_output['loglike']]
             else:
                 loglike += [-self.like()]
 
+        saved_state.restore()
         state.restore()
 
         return np.array(loglike)
@@ -465,6 +557,7 @@ class ExtensionFit(object):
 
         src = self.roi.copy_source(name)
         spatial_pars = {'ra': skydir.ra.deg, 'dec': skydir.dec.deg}
+        saved_state = LikelihoodState(self.like)
 
         loglike = np.ones((self.enumbins, len(width)))
         for i, w in enumerate(width):
@@ -480,12 +573,14 @@ class ExtensionFit(object):
                                                        self.log_energies[1:])):
                 self.set_energy_range(logemin, logemax)
                 if reoptimize:
+                    saved_state.restore()
                     fit_output = self._fit(loglevel=logging.DEBUG, **optimizer)
                     loglike[j, i] = fit_output['loglike']
                 else:
                     loglike[j, i] = -self.like()
             self.set_energy_range(self.log_energies[0], self.log_energies[-1])
 
+        saved_state.restore()
         state.restore()
         return loglike
 
@@ -526,6 +621,9 @@ class ExtensionFit(object):
         skydir = kwargs.get('skydir', self.roi[name].skydir)
         psf_scale_fn = kwargs.get('psf_scale_fn', None)
         reoptimize = kwargs.get('reoptimize', True)
+        multithread = kwargs.get('multithread', False)
+        nthread = kwargs.get('nthread', None)
+        template_stack = kwargs.get('template_stack', False)
 
         src = self.roi.copy_source(name)
 
@@ -541,13 +639,19 @@ class ExtensionFit(object):
                                               optimizer=optimizer,
                                               skydir=skydir,
                                               psf_scale_fn=psf_scale_fn,
-                                              reoptimize=reoptimize)[::-1]
+                                              reoptimize=reoptimize,
+                                              multithread=multithread,
+                                              nthread=nthread,
+                                              template_stack=template_stack)[::-1]
             loglike_hi = self._scan_extension(name, spatial_model=spatial_model,
                                               width=width_hi,
                                               optimizer=optimizer,
                                               skydir=skydir,
                                               psf_scale_fn=psf_scale_fn,
-                                              reoptimize=reoptimize)
+                                              reoptimize=reoptimize,
+                                              multithread=multithread,
+                                              nthread=nthread,
+                                              template_stack=template_stack)
             width = np.concatenate((width_lo, width_hi[1:]))
             loglike = np.concatenate((loglike_lo, loglike_hi[1:]))
         else:
@@ -557,7 +661,10 @@ class ExtensionFit(object):
                                            width=width, optimizer=optimizer,
                                            skydir=skydir,
                                            psf_scale_fn=psf_scale_fn,
-                                           reoptimize=reoptimize)
+                                           reoptimize=reoptimize,
+                                           multithread=multithread,
+                                           nthread=nthread,
+                                           template_stack=template_stack)
 
         ul_data = utils.get_parameter_limits(width, loglike,
                                              bounds=[10**-3.0, 10**0.5])
@@ -584,7 +691,10 @@ class ExtensionFit(object):
                                         width=width2, optimizer=optimizer,
                                         skydir=skydir,
                                         psf_scale_fn=psf_scale_fn,
-                                        reoptimize=reoptimize)
+                                        reoptimize=reoptimize,
+                                        multithread=multithread,
+                                        nthread=nthread,
+                                        template_stack=template_stack)
         ul_data2 = utils.get_parameter_limits(width2, loglike2,
                                               bounds=[10**-3.0, 10**0.5])
 
@@ -615,6 +615,62 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
         for c in self.components:
             c._srcmap_cache.clear()
 
+    def _scan_srcmap_stack(self, name, srcs, **kwargs):
+        """Evaluate the likelihood for a sequence of trial spatial
+        models of a source.  The source maps of all trial models are
+        computed up front and stored in a float32 stack for each
+        component.  At each trial model only the normalization of the
+        source is refit starting from the same model state at each
+        trial.
+
+        Parameters
+        ----------
+        name : str
+            Source name.
+
+        srcs : list
+            List of `~fermipy.roi_model.Source` objects defining the
+            spatial model of each trial.
+
+        Returns
+        -------
+        loglike : `~numpy.ndarray`
+            Log-likelihood for each trial model.
+        """
+
+        optimizer = kwargs.get('optimizer', {})
+        psf_scale_fn = kwargs.get('psf_scale_fn', None)
+        reoptimize = kwargs.get('reoptimize', True)
+
+        stacks = [c._create_srcmap_stack(name, srcs,
+                                         psf_scale_fn=psf_scale_fn)
+                  for c in self.components]
+
+        free_state = gtutils.FreeParameterState(self)
+        self.free_sources(free=False, loglevel=logging.DEBUG)
+        self.free_norm(name, loglevel=logging.DEBUG)
+        saved_state = LikelihoodState(self.like)
+
+        loglike = np.zeros(len(srcs))
+        for i in range(len(srcs)):
+
+            for c, stack in zip(self.components, stacks):
+                c._set_srcmap_image(name, stack[i])
+
+            if self._fitcache is not None:
+                self._fitcache.update_source(name)
+
+            if reoptimize:
+                saved_state.restore()
+                fit_output = self._fit(loglevel=logging.DEBUG, **optimizer)
+                loglike[i] = fit_output['loglike']
+            else:
+                loglike[i] = -self.like()
+
+        saved_state.restore()
+        free_state.restore()
+        return loglike
+
     def reload_source(self, name, init_source=True):
         """Delete and reload a source in the model.  This will update
         the spatial model of this source to the one defined in the XML
@@ -1115,6 +1171,8 @@ class GTAnalysis(fermipy.config.Configurable, sed.SEDGenerator,
 
     def cleanup(self):
 
+        self._close_tsmap_pool()
+
         if self.workdir == self.outdir:
             return
         elif os.path.isdir(self.workdir):
@@ -4397,6 +4455,12 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
     def like(self):
         return self._like
 
+    @property
+    def psf(self):
+        """Return the PSF model (`~fermipy.irfs.PSFModel`) of this
+        component."""
+        return self._psf
+
     @property
     def name(self):
         return self._name
@@ -4989,7 +5053,8 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         self._psf = irfs.PSFModel.create(self.roi.skydir, self._ltc,
                                          self.config['gtlike']['irfs'],
                                          self.config['selection']['evtype'],
-                                         self.energies)
+                                         self.energies,
+                                         cache_nside=self.config['gtlike']['psf_cache_nside'])
 
         # Bin data and create exposure cube
         if not use_external_srcmap:
@@ -5132,14 +5197,11 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
 
         if self.config['ltcube']['use_local_ltcube']:
             self.logger.info('Generating local LT cube.')
-            colnames = ['START', 'STOP', 'LIVETIME',
-                        'RA_SCZ', 'DEC_SCZ',
-                        'RA_ZENITH', 'DEC_ZENITH']
-            tab_sc = create_sc_table(self.data_files['scfile'],
-                                     colnames=colnames)
             tab_gti = Table.read(self.files['ft1'], 'GTI')
             radius = self.config['selection']['radius'] + 10.0
-            ltc_new = LTCube.create_from_gti(self.roi.skydir, tab_sc, tab_gti,
+            ltc_new = LTCube.create_from_gti(self.roi.skydir,
+                                             self.data_files['scfile'],
+                                             tab_gti,
                                              self.config['selection']['zmax'],
                                              radius=radius)
             ltc_new.write(self.files['ltcube'])
@@ -5223,6 +5285,9 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
 
         if os.path.isfile(self.files['srcmap']) and not overwrite:
             self.logger.log(loglevel, 'Skipping gtsrcmaps.')
+        elif self.config['gtlike']['srcmap_cache'] is not None and \
+                not use_scaled_srcmap:
+            self._create_srcmaps_cached(kw, loglevel=loglevel)
         elif use_scaled_srcmap:
             make_scaled_srcmap(self.roi,
                                self.config['gtlike']['srcmap_base'],
@@ -5235,6 +5300,76 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
         else:
             run_gtapp('gtsrcmaps', self.logger, kw, loglevel=loglevel)
 
+    def _create_srcmaps_cached(self, kw, **kwargs):
+        """Run gtsrcmaps only for sources that are not present in the
+        persistent source map cache and fill the remaining source maps
+        from the cache."""
+
+        loglevel = kwargs.get('loglevel', self.loglevel)
+        cache = srcmap_utils.SourceMapFileCache(
+            os.path.expandvars(self.config['gtlike']['srcmap_cache']),
+            max_size=self.config['gtlike']['srcmap_cache_size'] * 1E9)
+
+        # Inputs common to all source maps of this component.  The LT
+        # cube, exposure map and weights map are identified by their
+        # contents such that regenerated files with the same data share
+        # cache entries.  File paths passed to gtsrcmaps are excluded.
+        file_keys = ['scfile', 'expcube', 'cmap', 'srcmdl', 'bexpmap',
+                     'outfile', 'wmap', 'chatter']
+        app_key = sorted([(k, v) for k, v in kw.items()
+                          if k not in file_keys])
+        wmap_key = None
+        if kw.get('wmap') is not None and os.path.isfile(kw['wmap']):
+            wmap_key = srcmap_utils.hash_fits_data(kw['wmap'])
+
+        header = fits.getheader(self.files['ccube'])
+        base_key = [self.config['gtlike']['irfs'],
+                    self.config['selection']['evtype'],
+                    self.config['gtlike']['edisp'],
+                    self.config['gtlike']['rfactor'],
+                    self.config['gtlike']['minbinsz'],
+                    app_key, wmap_key,
+                    srcmap_utils.hash_fits_data(self.files['ltcube']),
+                    srcmap_utils.hash_fits_data(self.files['bexpmap']),
+                    cache.make_geom_key(header), list(self.energies)]
+
+        keys = {}
+        srcmaps = {}
+        for src in self.roi.sources:
+            src_key = cache.make_source_key(src)
+            if src_key is None:
+                continue
+            keys[src.name] = cache.make_key(base_key, src_key)
+            data = cache.get(keys[src.name])
+            if data is not None:
+                srcmaps[src.name] = data
+
+        # gtsrcmaps needs at least one source in the model
+        if len(srcmaps) == len(self.roi.sources):
+            srcmaps.pop(self.roi.sources[0].name)
+
+        self.logger.log(loglevel, 'Found %i of %i source maps in cache.',
+                        len(srcmaps), len(keys))
+
+        kw = copy.deepcopy(kw)
+        kw['srcmdl'] = os.path.join(self.workdir,
+                                    'srcmdl_nocache%s.xml' %
+                                    self.config['file_suffix'])
+        self.roi.write_xml(kw['srcmdl'], self.config['model'],
+                           exclude=list(srcmaps.keys()))
+        run_gtapp('gtsrcmaps', self.logger, kw, loglevel=loglevel)
+        os.remove(kw['srcmdl'])
+
+        if srcmaps:
+            srcmap_utils.update_source_maps(self.files['srcmap'], srcmaps,
+                                            logger=self.logger)
+
+        with fits.open(self.files['srcmap']) as hdulist:
+            for name, key in keys.items():
+                if name in srcmaps or name not in hdulist:
+                    continue
+                cache.put(key, np.array(hdulist[name].data))
+
     def _create_binned_analysis(self, xmlfile=None, **kwargs):
 
         loglevel = kwargs.get('loglevel', self.loglevel)
@@ -5529,12 +5664,34 @@ class GTBinnedAnalysis(fermipy.config.Configurable):
 
         return k
 
+    def _create_srcmap_stack(self, name, srcs, **kwargs):
+        """Generate the source maps for a sequence of trial models of
+        a source and return them as a single float32 array with
+        dimensions (ntrial, nebin+1, npix, npix)."""
+
+        scale = self._src_expscale.get(name, 1.0)
+        stack = None
+        for i, src in enumerate(srcs):
+            k = self._create_srcmap(name, src, **kwargs)
+            if stack is None:
+                stack = np.zeros((len(srcs),) + k.shape, dtype=np.float32)
+            stack[i] = k * scale
+
+        return stack
+
     def _update_srcmap(self, name, src, **kwargs):
         """Update the source map for an existing source in memory."""
 
         k = self._create_srcmap(name, src, **kwargs)
         scale = self._src_expscale.get(name, 1.0)
         k *= scale
+        self._set_srcmap_image(name, k)
+
+    def _set_srcmap_image(self, name, k):
+        """Replace the in-memory source map of a source with the
+        array ``k``."""
+
+        k = np.asarray(k, dtype=float)
 
         # Force the source map to be cached
         # FIXME: No longer necessary to force cacheing in ST after 11-05-02
@@ -3,7 +3,10 @@
 Utilities for dealing with HEALPix projections and mappings
 """
 from __future__ import absolute_import, division, print_function
+import os
 import re
+import tempfile
+import hashlib
 import healpy as hp
 import numpy as np
 from astropy.io import fits
@@ -12,6 +15,7 @@ from astropy.coordinates import SkyCoord
 from astropy.coordinates import Galactic, ICRS
 
 from fermipy.wcs_utils import WCSProj
+from fermipy.utils import LRUCache
 
 # This is an approximation of the size of HEALPix pixels (in degrees)
 # for a particular order.   It is used to convert from HEALPix to WCS-based
@@ -20,6 +24,10 @@ HPX_ORDER_TO_PIXSIZE = [32.0, 16.0, 8.0, 4.0, 2.0, 1.0,
                         0.50, 0.25, 0.1, 0.05, 0.025, 0.01,
                         0.005, 0.002]
 
+# In-memory cache of HEALPix to WCS mapping data keyed by
+# HpxToWcsMapping.make_cache_key()
+_hpx2wcs_cache = LRUCache(maxsize=16)
+
 
 class HPX_Conv(object):
     """ Data structure to define how a HEALPix map is stored to FITS """
@@ -137,11 +145,9 @@ def make_hpx_to_wcs_mapping_centers(hpx, wcs):
     ipixs = -1 * np.ones(npix, int).T.flatten()
     pix_index = npix[1] * pix_crds[0:, 0] + pix_crds[0:, 1]
     if hpx._ipix is None:
-        for ipix, pix_crd in enumerate(pix_index):
-            ipixs[pix_crd] = ipix
+        ipixs[pix_index] = np.arange(len(pix_index))
     else:
-        for pix_crd, ipix in zip(pix_index, hpx._ipix):
-            ipixs[pix_crd] = ipix
+        ipixs[pix_index] = hpx._ipix
     ipixs = ipixs.reshape(npix).T.flatten()
     return ipixs, mult_val, npix
 
@@ -183,22 +189,14 @@ def make_hpx_to_wcs_mapping(hpx, wcs):
     ipixs[mask] = hp.pixelfunc.ang2pix(hpx.nside, sky_crds[0:, 1][mask],
                                        sky_crds[0:, 0][mask], hpx.nest)
 
-    # Here we are counting the number of HEALPix pixels each WCS pixel points to;
-    # this could probably be vectorized by filling a histogram.
-    d_count = {}
-    for ipix in ipixs:
-        if ipix in d_count:
-            d_count[ipix] += 1
-        else:
-            d_count[ipix] = 1
-
-    # Here we are getting a multiplicative factor that tells use how to split up
-    # the counts in each HEALPix pixel (by dividing the corresponding WCS pixels
-    # by the number of associated HEALPix pixels).
-    # This could also likely be vectorized.
-    mult_val = np.ones(ipixs.shape)
-    for i, ipix in enumerate(ipixs):
-        mult_val[i] /= d_count[ipix]
+    # Count the number of WCS pixels pointing at each HEALPix pixel
+    # and use it to get the multiplicative factor that tells us how to
+    # split up the counts in each HEALPix pixel between the
+    # corresponding WCS pixels.
+    _, inverse = np.unique(ipixs, return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse)
+    mult_val = 1. / counts[inverse]
 
     ipixs = ipixs.reshape(npix).flatten()
     mult_val = mult_val.reshape(npix).flatten()
@@ -330,7 +328,7 @@ class HPX(object):
         if self._rmap is not None:
             retval = np.empty((sliced.size), 'i')
             retval.fill(-1)
-            m = np.in1d(sliced.flat, self._ipix)
+            m = np.isin(sliced.flat, self._ipix)
             retval[m] = np.searchsorted(self._ipix, sliced.flat[m])
             return retval.reshape(sliced.shape)
         return sliced
@@ -959,6 +957,94 @@ class HpxToWcsMapping(object):
         hdulist = fits.HDUList([prim_hdu, mult_hdu])
         hdulist.writeto(fitsfile, clobber=clobber)
 
+    @staticmethod
+    def make_cache_key(hpx, wcs):
+        """Make a key that uniquely identifies the mapping between a
+        HEALPix and a WCS projection.  The key is built from the
+        nside, ordering scheme and region of the HEALPix projection
+        and the header of the WCS projection.
+
+        Parameters
+        ----------
+        hpx : `~fermipy.hpx_utils.HPX`
+           The HEALPix projection
+
+        wcs : `~fermipy.wcs_utils.WCSProj`
+           The WCS projection
+
+        """
+        hdr = wcs.wcs.to_header_string()
+        s = '%i,%s,%s,%s,%s' % (hpx.nside, hpx.nest, hpx.coordsys,
+                                hpx.region, hdr)
+        return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def create(cls, hpx, wcs, cachedir=None):
+        """Create a mapping, reusing previously computed mapping data
+        when available.  Mapping data are cached in memory and, if
+        ``cachedir`` is set, as npz files in that directory.
+
+        Parameters
+        ----------
+        hpx : `~fermipy.hpx_utils.HPX`
+           The HEALPix projection
+
+        wcs : `~fermipy.wcs_utils.WCSProj`
+           The WCS projection
+
+        cachedir : str
+           Directory in which mapping files are read and written.  If
+           None the directory is taken from the
+           ``FERMIPY_HPX2WCS_CACHE`` environment variable and only
+           the in-memory cache is used if that is not set.
+
+        """
+        if cachedir is None:
+            cachedir = os.environ.get('FERMIPY_HPX2WCS_CACHE', None)
+
+        key = cls.make_cache_key(hpx, wcs)
+        mapping_data = _hpx2wcs_cache.get(key)
+        if mapping_data is not None:
+            return cls(hpx, wcs, mapping_data)
+
+        cachefile = None
+        if cachedir is not None:
+            cachefile = os.path.join(cachedir, 'hpx2wcs_%s.npz' % key)
+
+        if cachefile is not None and os.path.isfile(cachefile):
+            # An unreadable or truncated file is treated as a cache miss
+            try:
+                f = np.load(cachefile)
+                mapping_data = dict(ipixs=f['ipixs'], mult_val=f['mult_val'],
+                                    npix=tuple(int(n) for n in f['npix']))
+                f.close()
+            except Exception:
+                mapping_data = None
+
+        if mapping_data is not None:
+            m = cls(hpx, wcs, mapping_data)
+        else:
+            m = cls(hpx, wcs)
+            mapping_data = dict(ipixs=m.ipixs, mult_val=m.mult_val,
+                                npix=m.npix)
+            if cachefile is not None:
+                if not os.path.isdir(cachedir):
+                    os.makedirs(cachedir)
+                # Write to a temporary file and rename so that concurrent
+                # processes never read a partially written file
+                fd, tmpfile = tempfile.mkstemp(dir=cachedir, suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'wb') as f:
+                        np.savez(f, **mapping_data)
+                    os.rename(tmpfile, cachefile)
+                except Exception:
+                    if os.path.isfile(tmpfile):
+                        os.remove(tmpfile)
+                    raise
+
+        _hpx2wcs_cache.put(key, mapping_data)
+        return m
+
     @classmethod
     def create_from_fitsfile(cls, fitsfile):
         """ Read a fits file and use it to make a mapping
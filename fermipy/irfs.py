@@ -1,12 +1,17 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
+import os
+import tempfile
 import glob
+import hashlib
 import re
+import warnings
 import numpy as np
 from scipy.interpolate import RegularGridInterpolator
 from scipy.interpolate import UnivariateSpline
 import healpy as hp
 from astropy.io import fits
+from astropy.coordinates import SkyCoord
 
 import pyIrfLoader
 
@@ -34,6 +39,102 @@ evtype_string = {
     512: 'EDISP3',
 }
 
+# Cache of PSF window functions keyed by the PSF hash, energy bins
+# and maximum multipole
+_window_cache = utils.LRUCache(maxsize=64, maxbytes=2**28)
+
+# Cache of PSF models keyed by the observing profile, IRFs, energy
+# grid and spectral model
+_psf_model_cache = utils.LRUCache(maxsize=256, maxbytes=2**30)
+
+# Cache of IRF tables keyed by the response, event class, event type
+# and evaluation grid
+_irf_table_cache = utils.LRUCache(maxsize=256, maxbytes=2**29)
+
+
+def get_psf_model_cache_stats():
+    """Return the hit/miss statistics of the PSF model cache."""
+    return _psf_model_cache.stats()
+
+
+def clear_psf_model_cache():
+    """Clear the PSF model cache."""
+    _psf_model_cache.clear()
+
+
+def get_irf_table_cache_stats():
+    """Return the hit/miss statistics of the IRF table cache."""
+    return _irf_table_cache.stats()
+
+
+def clear_irf_table_cache():
+    """Clear the in-memory IRF table cache."""
+    _irf_table_cache.clear()
+
+
+def make_irf_table_key(rsp, event_class, event_type, *args):
+    """Make a key that uniquely identifies an IRF table from the
+    name of the response, the event class and type, and the arrays of
+    evaluation points.  IRF tables are cached under this key in memory
+    and, if the ``FERMIPY_IRF_CACHE`` environment variable is set, as
+    npz files in that directory.  The CALDB path and the custom IRF
+    settings (``CUSTOM_IRF_DIR``, ``CUSTOM_IRF_NAMES``) are included
+    in the key so that tables are not reused across IRF releases."""
+    if isinstance(event_type, int):
+        event_type = evtype_string[event_type]
+
+    h = hashlib.sha1()
+    h.update(('%s %s %s %s %s %s' %
+              (rsp, event_class, event_type,
+               os.environ.get('CALDB', ''),
+               os.environ.get('CUSTOM_IRF_DIR', ''),
+               os.environ.get('CUSTOM_IRF_NAMES', ''))).encode('utf-8'))
+    for x in args:
+        x = np.ascontiguousarray(x, dtype=float)
+        h.update(str(x.shape).encode('utf-8'))
+        h.update(x.tobytes())
+    return h.hexdigest()
+
+
+def _create_irf_table(rsp, fn, event_class, event_type, *args):
+    """Evaluate an IRF table with ``fn``, reusing the table from a
+    previous call with the same event class, event type and
+    evaluation points when available."""
+
+    key = make_irf_table_key(rsp, event_class, event_type, *args)
+    data = _irf_table_cache.get(key)
+    if data is not None:
+        return data.copy()
+
+    cachedir = os.environ.get('FERMIPY_IRF_CACHE', None)
+    cachefile = None
+    if cachedir is not None:
+        cachefile = os.path.join(cachedir, 'irf_%s_%s.npz' % (rsp, key))
+
+    if cachefile is not None and os.path.isfile(cachefile):
+        f = np.load(cachefile)
+        data = f['data']
+        f.close()
+    else:
+        data = fn(event_class, event_type, *args)
+        if cachefile is not None:
+            if not os.path.isdir(cachedir):
+                os.makedirs(cachedir)
+            # Write to a temporary file and rename so that concurrent
+            # processes never read a partially written file
+            fd, tmpfile = tempfile.mkstemp(dir=cachedir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.savez(f, data=data)
+                os.rename(tmpfile, cachefile)
+            except Exception:
+                if os.path.isfile(tmpfile):
+                    os.remove(tmpfile)
+                raise
+
+    _irf_table_cache.put(key, data)
+    return data.copy()
+
 
 def loglog_quad(x, y, dim):
 
@@ -48,6 +149,7 @@ def loglog_quad(x, y, dim):
 
     xs0[dim] = slice(None, -1)
     xs1[dim] = slice(1, None)
+    ys0, ys1, xs0, xs1 = tuple(ys0), tuple(ys1), tuple(xs0), tuple(xs1)
     log_ratio = np.log(x[xs1] / x[xs0])
     return 0.5 * (y[ys0] * x[xs0] + y[ys1] * x[xs1]) * log_ratio
 
@@ -158,7 +260,7 @@ def compute_ps_counts(ebins, exp, psf, bkg, fn, egy_dim=0, spatial_model='PointS
 
 
 def compute_norm(sig, bkg, ts_thresh, min_counts, sum_axes=None, bkg_fit=None,
-                 rebin_axes=None):
+                 rebin_axes=None, tol=1E-6, max_iter=100):
     """Solve for the normalization of the signal distribution at which the
     detection test statistic (twice delta-loglikelihood ratio) is >=
     ``ts_thresh`` AND the number of signal counts >= ``min_counts``.
@@ -166,6 +268,11 @@ def compute_norm(sig, bkg, ts_thresh, min_counts, sum_axes=None, bkg_fit=None,
     expected TS when the model for the background is fixed (no
     uncertainty on the background amplitude).
 
+    The normalizations of all elements of the output array are
+    solved simultaneously with a safeguarded Newton iteration.
+    Dimensions of ``sig`` that are not summed over can be used to
+    evaluate many positions or spectral models in a single call.
+
     Parameters
     ----------
     sig : `~numpy.ndarray`
@@ -190,78 +297,98 @@ def compute_norm(sig, bkg, ts_thresh, min_counts, sum_axes=None, bkg_fit=None,
         model.  If None then the fit model will be equal to the data
         model.
 
-    """
-
-    if sum_axes is None:
-        sum_axes = np.arange(sig.ndim)
-
-    sig = np.expand_dims(sig, -1)
-    bkg = np.expand_dims(bkg, -1)
-    sig_sum = np.apply_over_axes(np.sum, sig, sum_axes)
-    bkg_sum = np.apply_over_axes(np.sum, bkg, sum_axes)
-    bkg_fit_sum = None
-
-    if bkg_fit is not None:
-        bkg_fit = np.expand_dims(bkg_fit, -1)
-        bkg_fit_sum = np.apply_over_axes(np.sum, bkg_fit, sum_axes)
-
-    sig_rebin = sig
-    bkg_rebin = bkg
-    bkg_fit_rebin = bkg_fit
-
-    if rebin_axes:
-        sig_rebin = sig.copy()
-        bkg_rebin = bkg.copy()
-        if bkg_fit is not None:
-            bkg_fit_rebin = bkg_fit.copy()
-
-        for dim, rebin in zip(sum_axes, rebin_axes):
-            sig_rebin = sum_bins(sig_rebin, dim, rebin)
-            bkg_rebin = sum_bins(bkg_rebin, dim, rebin)
-            if bkg_fit is not None:
-                bkg_fit_rebin = sum_bins(bkg_fit_rebin, dim, rebin)
+    rebin_axes : list
+        Deprecated and ignored.  A `DeprecationWarning` is emitted if
+        this argument is set.
 
-    # Find approx solution using coarse binning and summed arrays
-    sig_scale = 10**np.linspace(0.0, 10.0, 51) * (min_counts / sig_sum)
-    vals_approx = _solve_norm(sig_rebin, bkg_rebin, ts_thresh, min_counts,
-                              sig_scale, sum_axes, bkg_fit_rebin)
+    tol : float
+        Relative tolerance on the normalization.
 
-    # Refine solution using an interval (0.1,10) around approx
-    # solution
-    sig_scale = (10**np.linspace(0.0, 1.0, 21) *
-                 np.fmax(0.333 * vals_approx[..., None],
-                         min_counts / sig_sum))
+    max_iter : int
+        Maximum number of iterations.
 
-    vals = _solve_norm(sig, bkg, ts_thresh, min_counts, sig_scale,
-                       sum_axes, bkg_fit)
-
-    #sig_scale = 10**np.linspace(0.0, 10.0, 101)*(min_counts / sig_sum)
-    # vals = _solve_norm(sig, bkg, ts_thresh, min_counts, sig_scale2,
-    #                   sum_axes, bkg_fit)
-
-    return vals
+    """
 
+    if rebin_axes is not None:
+        warnings.warn('The rebin_axes argument of compute_norm is deprecated '
+                      'and will be ignored.', DeprecationWarning, stacklevel=2)
 
-def _solve_norm(sig, bkg, ts_thresh, min_counts, sig_scale, sum_axes,
-                bkg_fit=None):
+    if sum_axes is None:
+        sum_axes = np.arange(sig.ndim)
 
-    ts = np.apply_over_axes(np.sum, poisson_ts_fast(sig * sig_scale,
-                                                    bkg, bkg_fit),
-                            sum_axes)
+    arrays = [sig, bkg] if bkg_fit is None else [sig, bkg, bkg_fit]
+    shape = np.broadcast(*arrays).shape
+    ndim = len(shape)
+    sum_axes = sorted(set([int(t) % ndim for t in sum_axes]))
+    keep_axes = [i for i in range(ndim) if i not in sum_axes]
+    out_shape = tuple([1 if i in sum_axes else shape[i]
+                       for i in range(ndim)])
+
+    # Move the summed dimensions to the end and flatten them
+    def flatten(x):
+        x = np.transpose(np.broadcast_to(x, shape), keep_axes + sum_axes)
+        return x.reshape((-1, int(np.prod([shape[i] for i in sum_axes]))))
+
+    sig = flatten(sig)
+    bkg = flatten(bkg)
+    bkg_fit = flatten(bkg_fit) if bkg_fit is not None else None
+
+    vals = _solve_norm(sig, bkg, ts_thresh, bkg_fit, tol, max_iter)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vals = np.fmax(vals, min_counts / np.sum(sig, axis=1))
+
+    return vals.reshape(out_shape)
+
+
+def _solve_norm(sig, bkg, ts_thresh, bkg_fit=None, tol=1E-6, max_iter=100):
+    """Solve for the signal scale factor at which the TS summed over
+    the last dimension equals ``ts_thresh``.  Each row is solved with
+    Newton's method, falling back to bisection of the bracketing
+    interval when a step leaves it.  Rows are dropped from the
+    iteration once they have converged."""
+
+    nrow = sig.shape[0]
+    bkg0 = bkg if bkg_fit is None else bkg_fit
+
+    # Initial guess from the large-background limit of the TS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.sqrt(max(ts_thresh, 0.0) / np.sum(sig**2 / bkg0, axis=1))
+    lo = np.zeros(nrow)
+    hi = np.full(nrow, np.inf)
+
+    active = np.flatnonzero(np.isfinite(x) & (x > 0))
+    for i in range(max_iter):
+
+        if len(active) == 0:
+            break
+
+        s = sig[active]
+        b = bkg[active]
+        b0 = bkg0[active]
+        xa = x[active]
+        xs = xa[:, np.newaxis] * s
+        m = xs + b0
+        lnm = np.log(m / b0)
+        ts = 2 * np.sum((xs + b) * lnm - xs, axis=1)
+        if bkg_fit is None:
+            dts = 2 * np.sum(s * lnm, axis=1)
+        else:
+            dts = 2 * np.sum(s * lnm + s * (xs + b) / m - s, axis=1)
 
-    vals = np.ones(ts.shape[:-1])
-    for idx, v in np.ndenumerate(ts[..., 0]):
+        f = ts - ts_thresh
+        lo[active] = np.where(f < 0, xa, lo[active])
+        hi[active] = np.where(f >= 0, xa, hi[active])
 
-        if ts[idx][0] >= ts_thresh:
-            vals[idx] = sig_scale[idx][0]
-            continue
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xn = xa - f / dts
+        bad = ~((xn > lo[active]) & (xn < hi[active]))
+        xn[bad] = np.where(np.isfinite(hi[active]),
+                           0.5 * (lo[active] + hi[active]), 2.0 * xa)[bad]
 
-        m = slice(np.argmin(ts[idx]), None)
-        vals[idx] = np.interp(ts_thresh, ts[idx][m], sig_scale[idx][m])
-        #fn = UnivariateSpline(ts[idx][m], sig_scale[idx][m], k=2, s=0)
-        #vals[idx] = fn(ts_thresh)
+        x[active] = xn
+        active = active[np.abs(xn - xa) > tol * xn]
 
-    return vals
+    return x
 
 
 class ExposureMap(HpxMap):
@@ -347,6 +474,7 @@ class PSFModel(object):
         self._exp = exp
         self._psf = psf
         self._wts = wts
+        self._hash = None
         self._psf_fn = RegularGridInterpolator((self._dtheta, self._log_energies),
                                                np.log(self._psf),
                                                bounds_error=False,
@@ -483,6 +611,47 @@ class PSFModel(object):
 
         return theta
 
+    def window_function(self, egy_bins, lmax, scale_fn=None):
+        """Evaluate the spherical harmonic window function (beam
+        transfer function) of the bin-averaged PSF for a sequence of
+        energy bins.  Window functions are cached unless a PSF scaling
+        function is used.
+
+        Parameters
+        ----------
+        egy_bins : array_like
+            Energy bin edges in MeV.
+
+        lmax : int
+            Maximum multipole.
+
+        scale_fn : callable
+            Function that evaluates the PSF scaling function.
+            Argument is energy in MeV.
+
+        Returns
+        -------
+        bl : `~numpy.ndarray`
+            Array of shape (nebin, lmax+1) with the window function
+            in each energy bin.
+        """
+        if scale_fn is None and self.scale_fn is not None:
+            scale_fn = self.scale_fn
+
+        egy_bins = np.asarray(egy_bins, dtype=float)
+        key = None
+        if scale_fn is None:
+            key = (self.hash, egy_bins.tobytes(), int(lmax))
+            bl = _window_cache.get(key)
+            if bl is not None:
+                return bl.copy()
+
+        vals = self.interp_bin(egy_bins, self.dtheta, scale_fn=scale_fn)
+        bl = utils.make_radial_window(self.dtheta, vals, lmax)
+        if key is not None:
+            _window_cache.put(key, bl.copy())
+        return bl
+
     def set_scale_fn(self, scale_fn):
         self._scale_fn = scale_fn
 
@@ -510,9 +679,48 @@ class PSFModel(object):
     def exp(self):
         return self._exp
 
+    @property
+    def nbytes(self):
+        return sum([x.nbytes for x in [self._dtheta, self._energies,
+                                       self._exp, self._psf, self._wts]])
+
+    @property
+    def hash(self):
+        """Digest of the angular/energy grid and PSF values.  Two
+        models with the same hash evaluate to the same PSF and can
+        share cached kernels."""
+        if self._hash is None:
+            h = hashlib.sha1()
+            for x in [self._dtheta, self._energies, self._psf]:
+                h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+            self._hash = h.hexdigest()
+        return self._hash
+
+    @staticmethod
+    def make_cache_key(skydir, ltc, event_class, event_types, energies,
+                       cth_bins, ndtheta, use_edisp, fn, nbin):
+        """Make a key that identifies a PSF model.  The sky position
+        and livetime cube enter the key through the observing profile
+        (the livetime vs. incidence angle in the livetime cube pixel
+        containing ``skydir``), so positions that share a livetime
+        cube pixel share a PSF model."""
+        ipix = hp.ang2pix(ltc.hpx.nside, np.pi / 2. - np.radians(skydir.dec.deg),
+                          np.radians(skydir.ra.deg), nest=ltc.hpx.nest)
+
+        h = hashlib.sha1()
+        h.update(('%s %s %s %s %i %s %i' %
+                  (event_class, list(event_types), fn.__class__.__name__,
+                   fn.extra_params, ndtheta, use_edisp,
+                   nbin)).encode('utf-8'))
+        for x in [ltc.data[:, ipix], ltc.costh_edges, energies, cth_bins,
+                  fn.params, fn.scale]:
+            h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+        return h.hexdigest()
+
     @classmethod
     def create(cls, skydir, ltc, event_class, event_types, energies, cth_bins=None,
-               ndtheta=500, use_edisp=False, fn=None, nbin=64):
+               ndtheta=500, use_edisp=False, fn=None, nbin=64, cache=True,
+               cache_nside=None):
         """Create a PSFModel object.  This class can be used to evaluate the
         exposure-weighted PSF for a source with a given observing
         profile and energy distribution.
@@ -536,6 +744,18 @@ class PSFModel(object):
         fn : `~fermipy.spectrum.SpectralFunction`
             Model for the spectral energy distribution of the source.
 
+        cache : bool
+            Reuse a PSF model from a previous call with the same
+            observing profile, IRFs, energy grid and spectral model.
+
+        cache_nside : int
+            If not None then the PSF model is evaluated at the center
+            of the HEALPix pixel with this NSIDE that contains
+            ``skydir``.  All positions within a pixel then share a
+            single cached PSF model.  If None the model is evaluated
+            at ``skydir``, which will share a model with other
+            positions in the same livetime cube pixel.
+
         """
 
         if isinstance(event_types, int):
@@ -544,14 +764,31 @@ class PSFModel(object):
         if fn is None:
             fn = spectrum.PowerLaw([1E-13, -2.0])
 
+        if cth_bins is None:
+            cth_bins = np.array([0.2, 1.0])
+
+        if cache_nside is not None:
+            skydir = skydir.icrs
+            ipix = hp.ang2pix(cache_nside, np.pi / 2. - np.radians(skydir.dec.deg),
+                              np.radians(skydir.ra.deg), nest=True)
+            theta, phi = hp.pix2ang(cache_nside, ipix, nest=True)
+            skydir = SkyCoord(np.degrees(phi), 90. - np.degrees(theta),
+                              unit='deg', frame='icrs')
+
+        key = None
+        if cache:
+            key = cls.make_cache_key(skydir, ltc, event_class, event_types,
+                                     energies, cth_bins, ndtheta, use_edisp,
+                                     fn, nbin)
+            psf = _psf_model_cache.get(key)
+            if psf is not None:
+                return psf
+
         dtheta = np.logspace(-4, 1.75, ndtheta)
         dtheta = np.insert(dtheta, 0, [0])
         log_energies = np.log10(energies)
         egy_bins = 10**utils.center_to_edge(log_energies)
 
-        if cth_bins is None:
-            cth_bins = np.array([0.2, 1.0])
-
         if use_edisp:
             psf = create_wtd_psf(skydir, ltc, event_class, event_types,
                                  dtheta, egy_bins, cth_bins, fn, nbin=nbin)
@@ -566,8 +803,11 @@ class PSFModel(object):
         exp = calc_exp(skydir, ltc, event_class, event_types,
                        energies, cth_bins)
 
-        return cls(dtheta, energies, cth_bins, np.squeeze(exp), np.squeeze(psf),
-                   np.squeeze(wts))
+        psf = cls(dtheta, energies, cth_bins, np.squeeze(exp), np.squeeze(psf),
+                  np.squeeze(wts))
+        if key is not None:
+            _psf_model_cache.put(key, psf)
+        return psf
 
 
 def create_irf(event_class, event_type):
@@ -582,7 +822,7 @@ def create_irf(event_class, event_type):
 
 def create_psf(event_class, event_type, dtheta, egy, cth):
     """Create an array of PSF response values versus energy and
-    inclination angle.
+    inclination angle.  Tables are cached (see `make_irf_table_key`).
 
     Parameters
     ----------
@@ -593,6 +833,11 @@ def create_psf(event_class, event_type, dtheta, egy, cth):
         Cosine of the incidence angle.
 
     """
+    return _create_irf_table('psf', _eval_psf, event_class, event_type,
+                             dtheta, egy, cth)
+
+
+def _eval_psf(event_class, event_type, dtheta, egy, cth):
     irf = create_irf(event_class, event_type)
     theta = np.degrees(np.arccos(cth))
     m = np.zeros((len(dtheta), len(egy), len(cth)))
@@ -606,7 +851,7 @@ def create_psf(event_class, event_type, dtheta, egy, cth):
 
 def create_edisp(event_class, event_type, erec, egy, cth):
     """Create an array of energy response values versus energy and
-    inclination angle.
+    inclination angle.  Tables are cached (see `make_irf_table_key`).
 
     Parameters
     ----------
@@ -617,6 +862,11 @@ def create_edisp(event_class, event_type, erec, egy, cth):
         Cosine of the incidence angle.
 
     """
+    return _create_irf_table('edisp', _eval_edisp, event_class, event_type,
+                             erec, egy, cth)
+
+
+def _eval_edisp(event_class, event_type, erec, egy, cth):
     irf = create_irf(event_class, event_type)
     theta = np.degrees(np.arccos(cth))
     v = np.zeros((len(erec), len(egy), len(cth)))
@@ -658,6 +908,11 @@ def create_aeff(event_class, event_type, egy, cth):
         Evaluation points in cosine of the incidence angle.
 
     """
+    return _create_irf_table('aeff', _eval_aeff, event_class, event_type,
+                             egy, cth)
+
+
+def _eval_aeff(event_class, event_type, egy, cth):
     irf = create_irf(event_class, event_type)
     irf.aeff().setPhiDependence(False)
     theta = np.degrees(np.arccos(cth))
@@ -7,6 +7,9 @@ import shutil
 import logging
 import yaml
 import json
+import hashlib
+import argparse
+import traceback
 from collections import OrderedDict
 from multiprocessing import Pool
 from functools import partial
@@ -23,11 +26,16 @@ from fermipy import defaults
 from fermipy import fits_utils
 from fermipy.config import ConfigSchema
 from fermipy.gtutils import FreeParameterState
+from fermipy.ltcube import LTCube, clip_gti
+from fermipy.jobs.file_archive import FileFlags
+from fermipy.jobs.chain import Link
+from fermipy.jobs.scatter_gather import ConfigMaker, build_sg_from_link
+from fermipy.jobs.lsf_impl import get_lsf_default_args, LSF_Interface
 
 import pyLikelihood as pyLike
 from astropy.io import fits
 from astropy.time import Time
-from astropy.table import Table, Column
+from astropy.table import Table, Column, vstack
 
 import pyLikelihood as pyLike
 
@@ -208,6 +216,82 @@ def _process_lc_bin(itime, name, config, basedir, workdir, diff_sources, const_s
     return o
 
 
+# Lightcurve options that do not change the result of a time bin
+_LC_CHECKPOINT_IGNORE_KEYS = ['outdir', 'save_bin_data', 'checkpoint',
+                              'use_batch', 'make_plots', 'write_fits',
+                              'write_npy', 'multithread', 'nthread',
+                              'systematic']
+
+
+def _lc_checkpoint_hash(kwargs, bin_args):
+    """Return a hash of the inputs that determine the result of a time
+    bin: the lightcurve options, the analysis configuration, the
+    spectrum of the source in the full time range, the list of
+    diffuse sources, and the ROI model.  The hash is used to name the
+    checkpoint directory such that checkpoints are never restored for
+    a different bin configuration."""
+
+    def default(x):
+        return x.tolist() if hasattr(x, 'tolist') else str(x)
+
+    cfg = {k: v for k, v in kwargs.items()
+           if k not in _LC_CHECKPOINT_IGNORE_KEYS}
+
+    # Paths of the working directory are excluded since it may be a
+    # scratch area that changes between runs
+    config = copy.deepcopy(bin_args['config'])
+    config.pop('fileio', None)
+    config.get('model', {}).pop('diffuse_dir', None)
+
+    model = [[s.name, s['SpectrumType'], s['SpatialModel'],
+              s['SpatialWidth'], s['Spatial_Filename'],
+              s['ra'], s['dec'], s.spectral_pars]
+             for s in bin_args['roi'].sources]
+
+    s = json.dumps([cfg, config, bin_args['const_spectrum'],
+                    bin_args['diff_sources'], model],
+                   sort_keys=True, default=default)
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()[:12]
+
+
+def _lc_checkpoint_file(checkpoint_dir, name, time):
+    """Return the path of the checkpoint file for a single time bin."""
+    name = name.lower().replace(' ', '_')
+    return os.path.join(checkpoint_dir, '%s_%.0f_%.0f.npy' %
+                        (name, time[0], time[1]))
+
+
+def _write_lc_checkpoint(filename, o):
+    """Write the result of a single time bin.  The output is first
+    written to a temporary file and then renamed so that an
+    interrupted job never leaves a partial checkpoint behind."""
+    tmpfile = filename + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        np.save(f, o)
+    os.rename(tmpfile, filename)
+
+
+def _process_lc_bin_checkpoint(itime, name, checkpoint_dir, catch_errors=True,
+                               **kwargs):
+    """Process a single time bin and write its result to a checkpoint
+    file.  Returns a tuple of the bin index and the output
+    dictionary.  Bins that fail are returned as an empty dictionary
+    and are not checkpointed so that they are retried on restart."""
+    i, time = itime
+
+    try:
+        o = _process_lc_bin(itime, name, **kwargs)
+    except Exception:
+        if not catch_errors:
+            raise
+        print('Analysis failed in time range %i %i' % (time[0], time[1]))
+        traceback.print_exc()
+        return i, {}
+
+    _write_lc_checkpoint(_lc_checkpoint_file(checkpoint_dir, name, time), o)
+    return i, o
+
+
 def calcTS_var(loglike, loglike_const, flux_err, flux_const, systematic):
     # calculates variability according to Eq. 4 in 2FGL
     # including correction using non-numbered Eq. following Eq. 4
@@ -336,6 +420,40 @@ class LightCurve(object):
 
         return o
 
+    def _create_lc_ltcubes(self, times, basedir, itimes=None):
+        """Create the local LT cubes of all time bins from a single
+        time-sliced LT cube and write them to the output directory of
+        each time bin.  If ``itimes`` is given only the LT cubes of
+        those time bins are computed."""
+
+        if itimes is None:
+            itimes = list(enumerate(zip(times[:-1], times[1:])))
+
+        if not itimes:
+            return
+
+        for c in self.components:
+
+            tab_gti = Table.read(c.files['ft1'], 'GTI')
+            # Only keep the GTIs of the time bins that will be analyzed
+            tab_gti = vstack([clip_gti(tab_gti, t0, t1)
+                              for i, (t0, t1) in itimes])
+            self.logger.info('Generating time-sliced LT cube for '
+                             'component %s.', c.name)
+            radius = c.config['selection']['radius'] + 10.0
+            ltc = LTCube.create_from_gti(self.roi.skydir,
+                                         c.data_files['scfile'], tab_gti,
+                                         c.config['selection']['zmax'],
+                                         radius=radius, time_bins=times)
+
+            for i, (t0, t1) in itimes:
+                outdir = os.path.join(self.workdir, basedir +
+                                      'lightcurve_%.0f_%.0f' % (t0, t1))
+                utils.mkdir(outdir)
+                outfile = os.path.join(outdir, 'ltcube%s.fits' %
+                                       c.config['file_suffix'])
+                ltc.create_time_slice(t0, t1).write(outfile)
+
     def _make_lc(self, name, **kwargs):
 
         # make array of time values in MET
@@ -397,20 +515,76 @@ class LightCurve(object):
 
         outdir = kwargs.get('outdir', None)
         basedir = outdir + '/' if outdir is not None else ''
-        wrap = partial(_process_lc_bin, name=name, config=config,
-                       basedir=basedir, workdir=self.workdir, diff_sources=diff_sources,
-                       const_spectrum=const_spectrum, roi=self.roi, **kwargs)
-        itimes = enumerate(zip(times[:-1], times[1:]))
-        if kwargs.get('multithread', False):
-            p = Pool(processes=kwargs.get('nthread', None))
-            mapo = p.map(wrap, itimes)
-            p.close()
+
+        bin_args = dict(name=name, config=config, basedir=basedir,
+                        workdir=self.workdir, diff_sources=diff_sources,
+                        const_spectrum=const_spectrum, roi=self.roi)
+
+        # Checkpoints are written to the output directory since the
+        # working directory may be a scratch area
+        checkpoint_dir = os.path.join(self.outdir,
+                                      basedir + 'lightcurve_checkpoints',
+                                      _lc_checkpoint_hash(kwargs, bin_args))
+        checkpoint = kwargs.get('checkpoint', False) or \
+            kwargs.get('use_batch', False)
+
+        mapo = [{} for i in range(len(times) - 1)]
+        itimes = list(enumerate(zip(times[:-1], times[1:])))
+
+        if checkpoint:
+            utils.mkdir(checkpoint_dir)
+            itimes = self._load_lc_checkpoints(name, itimes, checkpoint_dir,
+                                               mapo)
+            self.logger.info('Restored %i of %i time bins from %s',
+                             len(mapo) - len(itimes), len(mapo),
+                             checkpoint_dir)
+
+        if kwargs['use_local_ltcube'] and kwargs['use_ltcube_slices']:
+            self._create_lc_ltcubes(times, basedir, itimes)
+
+        if not itimes:
+            pass
+        elif kwargs.get('use_batch', False):
+            self._run_lc_batch(itimes, times, checkpoint_dir, bin_args,
+                               kwargs)
+            self._load_lc_checkpoints(name, itimes, checkpoint_dir, mapo)
+        elif checkpoint:
+            wrap = partial(_process_lc_bin_checkpoint,
+                           checkpoint_dir=checkpoint_dir,
+                           **dict(bin_args, **kwargs))
+            if kwargs.get('multithread', False):
+                p = Pool(processes=kwargs.get('nthread', None))
+                results = p.imap_unordered(wrap, itimes)
+            else:
+                p = None
+                results = map(wrap, itimes)
+
+            for n, (i, m) in enumerate(results):
+                mapo[i] = m
+                self.logger.info('Finished time bin %i (%i/%i)%s', i,
+                                 n + 1, len(itimes),
+                                 '' if m else ' -- analysis failed')
+
+            if p is not None:
+                p.close()
         else:
-            mapo = map(wrap, itimes)
+            wrap = partial(_process_lc_bin, **dict(bin_args, **kwargs))
+            if kwargs.get('multithread', False):
+                p = Pool(processes=kwargs.get('nthread', None))
+                results = p.map(wrap, itimes)
+                p.close()
+            else:
+                results = list(map(wrap, itimes))
+
+            for (i, time), m in zip(itimes, results):
+                mapo[i] = m
 
         if not kwargs.get('save_bin_data', False):
             for m in mapo:
-                shutil.rmtree(m['config']['fileio']['outdir'])
+                if 'config' not in m:
+                    continue
+                shutil.rmtree(m['config']['fileio']['outdir'],
+                              ignore_errors=True)
 
         o = self._create_lc_dict(name, times)
         o['config'] = kwargs
@@ -418,7 +592,7 @@ class LightCurve(object):
         itimes = enumerate(zip(times[:-1], times[1:]))
         for i, time in itimes:
 
-            if not mapo[i]['fit_success']:
+            if not mapo[i].get('fit_success', False):
                 self.logger.error(
                     'Fit failed in bin %d in range %i %i.' % (i, time[0], time[1]))
                 continue
@@ -442,11 +616,151 @@ class LightCurve(object):
         #merged = utils.merge_list_of_dicts(mapo)
         #o = utils.merge_dict(o, merged, add_new_keys=True)
         systematic = kwargs.get('systematic', 0.02)
+        flux_const = [m['flux_const'] for m in mapo if 'flux_const' in m]
 
         o['ts_var'] = calcTS_var(loglike=o['loglike'],
                                  loglike_const=o['loglike_const'],
                                  flux_err=o['flux_err'],
-                                 flux_const=mapo[0]['flux_const'],
+                                 flux_const=flux_const[0] if flux_const else np.nan,
                                  systematic=systematic)
 
         return o
+
+    @staticmethod
+    def _load_lc_checkpoints(name, itimes, checkpoint_dir, mapo):
+        """Fill ``mapo`` with the results of time bins that have a
+        checkpoint file in ``checkpoint_dir`` and return the list of
+        time bins that still need to be processed."""
+        todo = []
+        for i, time in itimes:
+            filename = _lc_checkpoint_file(checkpoint_dir, name, time)
+            if not os.path.isfile(filename):
+                todo += [(i, time)]
+                continue
+            mapo[i] = utils.load_npy(filename)
+        return todo
+
+    def _run_lc_batch(self, itimes, times, checkpoint_dir, bin_args, kwargs):
+        """Dispatch the analysis of the time bins in ``itimes`` to the
+        batch farm and wait for the jobs to finish.  Each job writes
+        the result of its time bin to a checkpoint file."""
+        slug = bin_args['name'].lower().replace(' ', '_')
+        jobfile = os.path.join(checkpoint_dir, '%s_jobs.npy' % slug)
+        job = dict(bin_args, times=times, checkpoint_dir=checkpoint_dir,
+                   kwargs=kwargs)
+        np.save(jobfile, job)
+
+        self.logger.info('Submitting %i time bins to the batch farm',
+                         len(itimes))
+        sg = create_sg_lightcurve_bin()
+        sg(['fermipy-lightcurve-bin-sg', '--action', 'run',
+            '--jobfile', jobfile])
+
+
+class LightCurveBin(Link):
+    """Small class to run the lightcurve analysis of a single time bin.
+    The inputs are read from a job file written by
+    `LightCurve.lightcurve` and the result is written to the
+    checkpoint directory of the lightcurve.
+    """
+
+    default_options = dict(jobfile=(None, 'Lightcurve job file', str),
+                           ibin=(0, 'Index of the time bin', int))
+
+    def __init__(self, **kwargs):
+        """C'tor
+        """
+        parser = argparse.ArgumentParser(usage="fermipy-lightcurve-bin [options]",
+                                         description="Run the lightcurve analysis of a single time bin")
+
+        Link.__init__(self, kwargs.pop('linkname', 'lightcurve-bin'),
+                      parser=parser,
+                      appname='fermipy-lightcurve-bin',
+                      options=LightCurveBin.default_options.copy(),
+                      file_args=dict(jobfile=FileFlags.input_mask))
+
+    def run_analysis(self, argv):
+        """Run this analysis"""
+        args = self._parser.parse_args(argv)
+        job = utils.load_npy(args.jobfile)
+        times = job.pop('times')
+        kwargs = dict(job.pop('kwargs'), **job)
+        time = (times[args.ibin], times[args.ibin + 1])
+        _process_lc_bin_checkpoint((args.ibin, time), catch_errors=False,
+                                   **kwargs)
+
+
+class ConfigMaker_LightCurveBin(ConfigMaker):
+    """Small class to generate configurations for the lightcurve time bins
+    This takes the following arguments:
+    --jobfile  : Lightcurve job file
+
+    Time bins that already have a checkpoint file are skipped.
+    """
+    default_options = dict(jobfile=(None, 'Lightcurve job file', str))
+
+    def __init__(self, link, **kwargs):
+        """C'tor
+        """
+        ConfigMaker.__init__(self, link,
+                             options=kwargs.get('options',
+                                                ConfigMaker_LightCurveBin.default_options.copy()))
+
+    def build_job_configs(self, args):
+        """Hook to build job configurations
+        """
+        job_configs = {}
+
+        job = utils.load_npy(args['jobfile'])
+        times = job['times']
+        checkpoint_dir = job['checkpoint_dir']
+
+        for i, time in enumerate(zip(times[:-1], times[1:])):
+            filename = _lc_checkpoint_file(checkpoint_dir, job['name'], time)
+            if os.path.isfile(filename):
+                continue
+            job_configs['bin_%04i' % i] = dict(jobfile=args['jobfile'],
+                                               ibin=i,
+                                               logfile=filename.replace('.npy', '.log'))
+
+        return job_configs
+
+
+def create_link_lightcurve_bin(**kwargs):
+    """Build and return a `Link` object that can invoke LightCurveBin"""
+    link = LightCurveBin(**kwargs)
+    return link
+
+
+def create_sg_lightcurve_bin(**kwargs):
+    """Build and return a ScatterGather object that can invoke the
+    lightcurve analysis of individual time bins"""
+    appname = kwargs.pop('appname', 'fermipy-lightcurve-bin-sg')
+    link = create_link_lightcurve_bin(**kwargs)
+    linkname = kwargs.pop('linkname', link.linkname)
+    batch_args = get_lsf_default_args()
+    batch_interface = LSF_Interface(**batch_args)
+    usage = "%s [options]" % (appname)
+    description = "Run the lightcurve analysis of individual time bins"
+
+    config_maker = ConfigMaker_LightCurveBin(link)
+    lsf_sg = build_sg_from_link(link, config_maker,
+                                interface=batch_interface,
+                                usage=usage,
+                                description=description,
+                                linkname=linkname,
+                                appname=appname,
+                                **kwargs)
+    return lsf_sg
+
+
+def main_single():
+    """Entry point for command line use for single job """
+    lcbin = LightCurveBin()
+    lcbin.run_analysis(sys.argv[1:])
+
+
+def main_batch():
+    """Entry point for command line use  for dispatching batch jobs """
+    lsf_sg = create_sg_lightcurve_bin()
+    lsf_sg(sys.argv)
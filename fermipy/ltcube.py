@@ -3,11 +3,12 @@ from __future__ import absolute_import, division, print_function
 import glob
 import re
 import copy
+import multiprocessing
 import numpy as np
 import healpy as hp
 from astropy.io import fits
 from astropy.coordinates import SkyCoord
-from astropy.table import Table, Column
+from astropy.table import Table, Column, vstack
 
 from fermipy import utils
 from fermipy.utils import edge_to_center
@@ -17,7 +18,44 @@ from fermipy.skymap import HpxMap
 from fermipy.hpx_utils import HPX
 
 
-def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
+def _fill_livetime_hist_block(xyz, sc_xyz, zn_xyz, sc_live, sc_lfrac,
+                              cos_zmax, costh_edges, block_size):
+    """Accumulate livetime histograms for a set of sky directions.
+    The calculation is vectorized over blocks of directions and SC
+    rows where the size of each block is limited to ``block_size``
+    elements."""
+
+    nbin = len(costh_edges) - 1
+    ndir = len(xyz)
+    lt = np.zeros((nbin, ndir))
+    lt_wt = np.zeros((nbin, ndir))
+    nrow = max(int(block_size // max(ndir, 1)), 1)
+
+    for i in range(0, len(sc_live), nrow):
+
+        s = slice(i, i + nrow)
+        cos_sep = np.dot(xyz, sc_xyz[s].T)
+        cos_zn = np.dot(xyz, zn_xyz[s].T)
+        m = (cos_zn > cos_zmax) & (cos_sep > 0.0)
+        idir, irow = np.nonzero(m)
+        bins = np.digitize(cos_sep[idir, irow], bins=costh_edges) - 1
+        bins = np.clip(bins, 0, nbin - 1)
+        idx = bins * ndir + idir
+        live = sc_live[s][irow]
+        lt += np.bincount(idx, weights=live,
+                          minlength=nbin * ndir).reshape(nbin, ndir)
+        lt_wt += np.bincount(idx, weights=live * sc_lfrac[s][irow],
+                             minlength=nbin * ndir).reshape(nbin, ndir)
+
+    return lt, lt_wt
+
+
+def _fill_livetime_hist_worker(args):
+    return _fill_livetime_hist_block(*args)
+
+
+def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges,
+                       block_size=2**22, nthread=1, pool=None):
     """Generate a sequence of livetime distributions at the sky
     positions given by ``skydir``.  The output of the method are two
     NxM arrays containing a sequence of histograms for N sky positions
@@ -45,6 +83,21 @@ def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
     costh_edges : `~numpy.ndarray`
         Incidence angle bin edges in cos(angle).
 
+    block_size : int
+        Maximum number of elements in the (directions x SC rows)
+        blocks that are processed in a single vectorized step.  This
+        sets the peak memory usage of the calculation.
+
+    nthread : int
+        Number of processes over which blocks of SC rows will be
+        distributed.  If None then one process will be created for
+        each available core.
+
+    pool : `~multiprocessing.pool.Pool`
+        Process pool used when ``nthread`` is not 1.  If None a pool
+        is created for this call.  Passing a pool allows it to be
+        reused across calls.
+
     Returns
     -------
     lt : `~numpy.ndarray`
@@ -66,13 +119,6 @@ def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
     cos_zmax = np.cos(np.radians(zmax))
     sc_t0 = np.array(tab_sc['START'].data)
     sc_t1 = np.array(tab_sc['STOP'].data)
-    sc_live = np.array(tab_sc['LIVETIME'].data)
-    sc_lfrac = sc_live / (sc_t1 - sc_t0)
-
-    sc_xyz = angle_to_cartesian(np.radians(tab_sc['RA_SCZ'].data),
-                                np.radians(tab_sc['DEC_SCZ'].data))
-    zn_xyz = angle_to_cartesian(np.radians(tab_sc['RA_ZENITH'].data),
-                                np.radians(tab_sc['DEC_ZENITH'].data))
 
     tab_gti_t0 = np.array(tab_gti['START'].data)
     tab_gti_t1 = np.array(tab_gti['STOP'].data)
@@ -86,28 +132,344 @@ def fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges):
     gti_t0[idx >= 0] = tab_gti_t0[idx[idx >= 0]]
     gti_t1[idx >= 0] = tab_gti_t1[idx[idx >= 0]]
 
+    # Only keep SC intervals that are contained in a GTI
+    m0 = (idx >= 0) & (sc_t0 >= gti_t0) & (sc_t1 <= gti_t1)
+    sc_t0 = sc_t0[m0]
+    sc_t1 = sc_t1[m0]
+    sc_live = np.array(tab_sc['LIVETIME'].data)[m0]
+    sc_lfrac = sc_live / (sc_t1 - sc_t0)
+
+    sc_xyz = angle_to_cartesian(np.radians(tab_sc['RA_SCZ'].data[m0]),
+                                np.radians(tab_sc['DEC_SCZ'].data[m0]))
+    zn_xyz = angle_to_cartesian(np.radians(tab_sc['RA_ZENITH'].data[m0]),
+                                np.radians(tab_sc['DEC_ZENITH'].data[m0]))
+
+    xyz = angle_to_cartesian(skydir.ra.rad, skydir.dec.rad)
     nbin = len(costh_edges) - 1
 
-    lt = np.zeros((nbin,) + skydir.shape)
-    lt_wt = np.zeros((nbin,) + skydir.shape)
+    if nthread == 1:
+        # Split directions into chunks such that each block spans a
+        # comparable number of directions and SC rows
+        ndir = max(int(np.sqrt(block_size)), 1)
+        results = [_fill_livetime_hist_block(xyz[i:i + ndir], sc_xyz, zn_xyz,
+                                             sc_live, sc_lfrac, cos_zmax,
+                                             costh_edges, block_size)
+                   for i in range(0, len(xyz), ndir)]
+        if not results:
+            return np.zeros((nbin, 0)), np.zeros((nbin, 0))
+
+        lt = np.concatenate([r[0] for r in results], axis=1)
+        lt_wt = np.concatenate([r[1] for r in results], axis=1)
+        return lt, lt_wt
+
+    # Distribute blocks of SC rows over the processes and sum the
+    # histograms.  Each SC row is only sent to a single process.
+    if nthread is None:
+        nthread = multiprocessing.cpu_count()
+    rows = np.array_split(np.arange(len(sc_live)), max(nthread, 1))
+    tasks = [(xyz, sc_xyz[r], zn_xyz[r], sc_live[r], sc_lfrac[r],
+              cos_zmax, costh_edges, block_size) for r in rows if len(r)]
+
+    own_pool = pool is None
+    if own_pool:
+        pool = multiprocessing.Pool(processes=nthread)
+    try:
+        results = pool.map(_fill_livetime_hist_worker, tasks)
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    lt = np.zeros((nbin, len(xyz)))
+    lt_wt = np.zeros((nbin, len(xyz)))
+    for r in results:
+        lt += r[0]
+        lt_wt += r[1]
+    return lt, lt_wt
 
-    m0 = (idx >= 0) & (sc_t0 >= gti_t0) & (sc_t1 <= gti_t1)
 
-    xyz = angle_to_cartesian(skydir.ra.rad, skydir.dec.rad)
+SC_COLNAMES = ['START', 'STOP', 'LIVETIME', 'RA_SCZ', 'DEC_SCZ',
+               'RA_ZENITH', 'DEC_ZENITH']
 
-    for i, t in enumerate(xyz):
-        cos_sep = utils.dot_prod(t, sc_xyz)
-        cos_zn = utils.dot_prod(t, zn_xyz)
-        m = m0 & (cos_zn > cos_zmax) & (cos_sep > 0.0)
-        bins = np.digitize(cos_sep[m], bins=costh_edges) - 1
-        bins = np.clip(bins, 0, nbin - 1)
-        lt[:, i] = np.bincount(bins, weights=sc_live[m], minlength=nbin)
-        lt_wt[:, i] = np.bincount(bins, weights=sc_live[m] * sc_lfrac[m],
-                                  minlength=nbin)
+
+def _get_sc_files(scfile):
+    """Resolve the FT2 files from a file path, a list of file paths,
+    or a text file containing a list of file paths."""
+
+    if isinstance(scfile, list):
+        files = scfile
+    elif utils.is_fits_file(scfile):
+        files = [scfile]
+    else:
+        files = [line.strip() for line in open(scfile, 'r')
+                 if line.strip()]
+
+    # Sort files by start time
+    tstart = []
+    for f in files:
+        with fits.open(f, memmap=True) as h:
+            tstart += [h['SC_DATA'].header.get('TSTART', 0.0)]
+
+    return [files[i] for i in np.argsort(tstart, kind='mergesort')]
+
+
+def read_sc_chunks(scfile, chunk_size=100000, tmin=None, tmax=None,
+                   colnames=None):
+    """Generator that reads a spacecraft (FT2) file in time-ordered
+    chunks.  FITS columns are memory-mapped such that at most
+    ``chunk_size`` rows are loaded into memory at a time.
+
+    Parameters
+    ----------
+    scfile : str or list
+        FT2 file, list of FT2 files, or text file containing a list
+        of FT2 files.
+
+    chunk_size : int
+        Number of rows per chunk.
+
+    tmin : float
+        Skip rows ending before this time (MET).
+
+    tmax : float
+        Skip rows starting after this time (MET).
+
+    colnames : list
+        Names of the columns that will be loaded.  By default only the
+        columns required for livetime calculations are loaded.
+
+    Returns
+    -------
+    tab_sc : `~astropy.table.Table`
+        Table containing one chunk of the FT2 file.
+    """
+
+    if colnames is None:
+        colnames = SC_COLNAMES
+
+    for f in _get_sc_files(scfile):
+
+        with fits.open(f, memmap=True) as h:
+
+            data = h['SC_DATA'].data
+            if data is None:
+                continue
+
+            nrows = len(data)
+            irow0, irow1 = 0, nrows
+            if tmin is not None:
+                irow0 = np.searchsorted(data.field('STOP'), tmin,
+                                        side='right')
+            if tmax is not None:
+                irow1 = np.searchsorted(data.field('START'), tmax,
+                                        side='left')
+
+            for i in range(irow0, irow1, chunk_size):
+                rows = slice(i, min(i + chunk_size, irow1))
+                cols = [Column(name=k, data=np.array(data.field(k)[rows]))
+                        for k in colnames]
+                yield Table(cols)
+
+
+def fill_livetime_hist_from_ft2(skydir, scfile, tab_gti, zmax,
+                                costh_edges, chunk_size=100000, **kwargs):
+    """Generate livetime distributions at the sky positions given by
+    ``skydir`` by streaming the spacecraft (FT2) file in chunks.  The
+    output is identical to `fill_livetime_hist` but the full
+    spacecraft table is never loaded into memory.
+
+    Parameters
+    ----------
+    skydir : `~astropy.coordinates.SkyCoord`
+        Vector of sky directions for which livetime histograms will be
+        accumulated.
+
+    scfile : str or list
+        FT2 file, list of FT2 files, or text file containing a list
+        of FT2 files.
+
+    tab_gti : `~astropy.table.Table`
+        Table of good time intervals (GTIs).
+
+    zmax : float
+        Zenith cut.
+
+    costh_edges : `~numpy.ndarray`
+        Incidence angle bin edges in cos(angle).
+
+    chunk_size : int
+        Number of FT2 rows that are processed at a time.
+
+    Returns
+    -------
+    lt : `~numpy.ndarray`
+        Array of livetime histograms.
+
+    lt_wt : `~numpy.ndarray`
+        Array of histograms of weighted livetime (livetime x livetime
+        fraction).
+    """
+
+    shape = (len(costh_edges) - 1, len(skydir))
+    lt = np.zeros(shape)
+    lt_wt = np.zeros(shape)
+
+    if len(tab_gti) == 0:
+        return lt, lt_wt
+
+    gti_t0 = np.array(tab_gti['START'].data)
+    gti_t1 = np.array(tab_gti['STOP'].data)
+
+    # Create a single pool that is reused for all chunks
+    nthread = kwargs.get('nthread', 1)
+    pool = kwargs.pop('pool', None)
+    own_pool = pool is None and nthread != 1
+    if own_pool:
+        pool = multiprocessing.Pool(processes=nthread)
+
+    try:
+        for tab_sc in read_sc_chunks(scfile, chunk_size,
+                                     tmin=gti_t0[0], tmax=gti_t1[-1]):
+
+            # Select GTIs that overlap with this chunk
+            m = (gti_t1 > tab_sc['START'][0]) & (gti_t0 < tab_sc['STOP'][-1])
+            if not np.any(m):
+                continue
+
+            o = fill_livetime_hist(skydir, tab_sc, tab_gti[m], zmax,
+                                   costh_edges, pool=pool, **kwargs)
+            lt += o[0]
+            lt_wt += o[1]
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
 
     return lt, lt_wt
 
 
+def fill_livetime_hist_slices(skydir, tab_sc, tab_gti, zmax, costh_edges,
+                              time_bins, chunk_size=100000, **kwargs):
+    """Generate livetime distributions at the sky positions given by
+    ``skydir`` separately for each time slice defined by
+    ``time_bins``.  The spacecraft table (or FT2 file) is traversed
+    a single time and each SC interval is assigned to the time slice
+    containing its start time.  SC intervals that straddle the edge
+    of a time slice are dropped in the same way as for GTI
+    boundaries.
+
+    Parameters
+    ----------
+    skydir : `~astropy.coordinates.SkyCoord`
+        Vector of sky directions for which livetime histograms will be
+        accumulated.
+
+    tab_sc : `~astropy.table.Table` or str
+        Spacecraft table or FT2 file, list of FT2 files, or text file
+        containing a list of FT2 files.
+
+    tab_gti : `~astropy.table.Table`
+        Table of good time intervals (GTIs).
+
+    zmax : float
+        Zenith cut.
+
+    costh_edges : `~numpy.ndarray`
+        Incidence angle bin edges in cos(angle).
+
+    time_bins : `~numpy.ndarray`
+        Edges of the time slices (MET).
+
+    chunk_size : int
+        Number of FT2 rows that are processed at a time.
+
+    Returns
+    -------
+    lt : `~numpy.ndarray`
+        Array of livetime histograms with one leading dimension for
+        each time slice.
+
+    lt_wt : `~numpy.ndarray`
+        Array of histograms of weighted livetime (livetime x livetime
+        fraction) with one leading dimension for each time slice.
+    """
+
+    time_bins = np.array(time_bins, dtype=float)
+    nslice = len(time_bins) - 1
+    shape = (nslice, len(costh_edges) - 1, len(skydir))
+    lt = np.zeros(shape)
+    lt_wt = np.zeros(shape)
+
+    if len(tab_gti) == 0:
+        return lt, lt_wt
+
+    slice_gti = [clip_gti(tab_gti, t0, t1)
+                 for t0, t1 in zip(time_bins[:-1], time_bins[1:])]
+
+    if isinstance(tab_sc, Table):
+        chunks = [tab_sc]
+    else:
+        chunks = read_sc_chunks(tab_sc, chunk_size,
+                                tmin=max(tab_gti['START'][0], time_bins[0]),
+                                tmax=min(tab_gti['STOP'][-1], time_bins[-1]))
+
+    nthread = kwargs.get('nthread', 1)
+    pool = kwargs.pop('pool', None)
+    own_pool = pool is None and nthread != 1
+    if own_pool:
+        pool = multiprocessing.Pool(processes=nthread)
+
+    try:
+        for tab in chunks:
+
+            islice = np.searchsorted(time_bins, np.array(tab['START'].data),
+                                     side='right') - 1
+            for i in np.unique(islice):
+                if i < 0 or i >= nslice or len(slice_gti[i]) == 0:
+                    continue
+                o = fill_livetime_hist(skydir, tab[islice == i],
+                                       slice_gti[i], zmax, costh_edges,
+                                       pool=pool, **kwargs)
+                lt[i] += o[0]
+                lt_wt[i] += o[1]
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    return lt, lt_wt
+
+
+def _fill_livetime_hist(skydir, tab_sc, tab_gti, zmax, costh_edges,
+                        **kwargs):
+    """Dispatch to `fill_livetime_hist` or
+    `fill_livetime_hist_from_ft2` depending on whether ``tab_sc``
+    is a table or a path to an FT2 file."""
+
+    if isinstance(tab_sc, Table):
+        kwargs.pop('chunk_size', None)
+        return fill_livetime_hist(skydir, tab_sc, tab_gti, zmax,
+                                  costh_edges, **kwargs)
+    else:
+        return fill_livetime_hist_from_ft2(skydir, tab_sc, tab_gti, zmax,
+                                           costh_edges, **kwargs)
+
+
+def clip_gti(tab_gti, tmin, tmax):
+    """Clip a table of GTIs to the time range [``tmin``, ``tmax``].
+    GTIs outside of the time range are removed and GTIs overlapping
+    with the boundaries are truncated."""
+
+    t0 = np.array(tab_gti['START'], dtype=float)
+    t1 = np.array(tab_gti['STOP'], dtype=float)
+    m = (t1 > tmin) & (t0 < tmax)
+    cols = [Column(name='START', data=np.clip(t0[m], tmin, tmax),
+                   dtype='f8', unit='s'),
+            Column(name='STOP', data=np.clip(t1[m], tmin, tmax),
+                   dtype='f8', unit='s')]
+    return Table(cols)
+
+
 class LTCube(HpxMap):
     """Class for reading and manipulating livetime cubes generated with
     gtltcube.
@@ -215,8 +577,8 @@ class LTCube(HpxMap):
             # hdulist["WEIGHTED_EXPOSURE"].header["NBRBINS"])
         data = data.astype(float)
         data_wt = data_wt.astype(float)
-        tstart = hdulist[0].header['TSTART']
-        tstop = hdulist[0].header['TSTOP']
+        tstart = hdulist[0].header.get('TSTART', None)
+        tstop = hdulist[0].header.get('TSTOP', None)
         zmin = hdulist['EXPOSURE'].header['ZENMIN']
         zmax = hdulist['EXPOSURE'].header['ZENMAX']
 
@@ -255,40 +617,240 @@ class LTCube(HpxMap):
 
     @classmethod
     def create_from_gti(cls, skydir, tab_sc, tab_gti, zmax, **kwargs):
+        """Create a livetime cube from a spacecraft table and a
+        table of GTIs.  ``tab_sc`` can be either a
+        `~astropy.table.Table` or the path to an FT2 file (or list of
+        FT2 files) in which case the file will be read in chunks of
+        ``chunk_size`` rows.
+
+        If ``time_bins`` is given the livetime of each time slice will
+        be kept such that the livetime cube of any range of time
+        slices can be created with `create_time_slice`.  SC intervals
+        that straddle the edge of a time slice are dropped in the same
+        way as for GTI boundaries.
+        """
 
-        radius = kwargs.get('radius', 180.0)
         cth_edges = kwargs.get('cth_edges', None)
         if cth_edges is None:
             cth_edges = 1.0 - np.linspace(0, 1.0, 41)**2
             cth_edges = cth_edges[::-1]
 
-        hpx = HPX(2**4, True, 'CEL', ebins=cth_edges)
+        time_bins = kwargs.get('time_bins', None)
+        tab_gti = Table([tab_gti['START'], tab_gti['STOP']])
+        hpx = HPX(2**6, True, 'CEL', ebins=cth_edges)
+        ltc = cls(np.zeros((len(cth_edges) - 1, hpx.npix)), hpx, cth_edges,
+                  zmax=zmax, tab_gti=tab_gti)
 
-        hpx_skydir = hpx.get_sky_dirs()
+        if len(tab_gti):
+            ltc._tstart = tab_gti['START'][0]
+            ltc._tstop = tab_gti['STOP'][-1]
+
+        if time_bins is None:
+            lt, lt_wt = ltc._fill_coarse_hist(skydir, tab_sc, tab_gti,
+                                              **kwargs)
+        else:
+            time_bins = np.array(time_bins, dtype=float)
+            lt_slices, lt_wt_slices = ltc._fill_coarse_hist(skydir, tab_sc,
+                                                            tab_gti, **kwargs)
+            ltc._slices = {'time_bins': time_bins,
+                           'skydir': skydir,
+                           'radius': kwargs.get('radius', 180.0),
+                           'lt': lt_slices, 'lt_wt': lt_wt_slices}
+            lt = np.sum(lt_slices, axis=0)
+            lt_wt = np.sum(lt_wt_slices, axis=0)
+
+        ltc._region = {'skydir': skydir,
+                       'radius': kwargs.get('radius', 180.0)}
+        ltc._fill_from_coarse_hist(skydir, lt, lt_wt,
+                                   kwargs.get('radius', 180.0))
+        return ltc
+
+    def _get_coarse_hpx(self):
+        """Return the coarse HEALPix geometry on which livetime
+        histograms are computed before being interpolated onto the
+        geometry of this cube."""
+        return HPX(2**4, True, 'CEL', ebins=self.costh_edges)
 
+    def _fill_coarse_hist(self, skydir, tab_sc, tab_gti, **kwargs):
+        """Compute livetime histograms on the coarse HEALPix grid for
+        all pixels within ``radius`` of ``skydir``.  If ``time_bins``
+        is given one histogram is returned for each time slice."""
+
+        radius = kwargs.get('radius', 180.0)
+        time_bins = kwargs.get('time_bins', None)
+        hpx = self._get_coarse_hpx()
+        hpx_skydir = hpx.get_sky_dirs()
         m = skydir.separation(hpx_skydir).deg < radius
-        map_lt = HpxMap(np.zeros((40, hpx.npix)), hpx)
-        map_lt_wt = HpxMap(np.zeros((40, hpx.npix)), hpx)
 
-        lt, lt_wt = fill_livetime_hist(
-            hpx_skydir[m], tab_sc, tab_gti, zmax, cth_edges)
+        if time_bins is not None:
+            return fill_livetime_hist_slices(
+                hpx_skydir[m], tab_sc, tab_gti, self.zmax,
+                self.costh_edges, time_bins,
+                block_size=kwargs.get('block_size', 2**22),
+                nthread=kwargs.get('nthread', 1),
+                chunk_size=kwargs.get('chunk_size', 100000))
+
+        return _fill_livetime_hist(
+            hpx_skydir[m], tab_sc, tab_gti, self.zmax, self.costh_edges,
+            block_size=kwargs.get('block_size', 2**22),
+            nthread=kwargs.get('nthread', 1),
+            chunk_size=kwargs.get('chunk_size', 100000))
+
+    def _fill_from_coarse_hist(self, skydir, lt, lt_wt, radius, add=False):
+        """Interpolate livetime histograms computed on the coarse
+        HEALPix grid onto the pixels of this cube."""
+
+        nbin = len(self.costh_edges) - 1
+        hpx = self._get_coarse_hpx()
+        hpx_skydir = hpx.get_sky_dirs()
+        m = skydir.separation(hpx_skydir).deg < radius
+        map_lt = HpxMap(np.zeros((nbin, hpx.npix)), hpx)
+        map_lt_wt = HpxMap(np.zeros((nbin, hpx.npix)), hpx)
         map_lt.data[:, m] = lt
         map_lt_wt.data[:, m] = lt_wt
 
-        hpx2 = HPX(2**6, True, 'CEL', ebins=cth_edges)
-
-        ltc = cls(np.zeros((len(cth_edges) - 1, hpx2.npix)), hpx2, cth_edges)
-        ltc_skydir = ltc.hpx.get_sky_dirs()
+        ltc_skydir = self.hpx.get_sky_dirs()
         m = skydir.separation(ltc_skydir).deg < radius
 
-        ltc.data[:, m] = map_lt.interpolate(ltc_skydir[m].ra.deg,
-                                            ltc_skydir[m].dec.deg,
-                                            interp_log=False)
-        ltc.data_wt[:, m] = map_lt_wt.interpolate(ltc_skydir[m].ra.deg,
-                                                  ltc_skydir[m].dec.deg,
-                                                  interp_log=False)
+        data = map_lt.interpolate(ltc_skydir[m].ra.deg,
+                                  ltc_skydir[m].dec.deg,
+                                  interp_log=False)
+        data_wt = map_lt_wt.interpolate(ltc_skydir[m].ra.deg,
+                                        ltc_skydir[m].dec.deg,
+                                        interp_log=False)
+        if not add:
+            self.data[...] = 0.0
+            self.data_wt[...] = 0.0
+
+        self.data[:, m] += data
+        self.data_wt[:, m] += data_wt
+
+    @property
+    def time_bins(self):
+        """Return the edges of the time slices of this cube or None if
+        the cube was created without time slices."""
+        slices = getattr(self, '_slices', None)
+        if slices is None:
+            return None
+        return slices['time_bins']
+
+    def create_time_slice(self, tmin, tmax):
+        """Create a livetime cube for the time range [``tmin``,
+        ``tmax``] by summing the livetime of the time slices of this
+        cube.  The time range must be aligned with the edges of the
+        time slices.
+
+        Parameters
+        ----------
+        tmin : float
+            Start time (MET).
+
+        tmax : float
+            Stop time (MET).
+
+        Returns
+        -------
+        ltc : `~fermipy.ltcube.LTCube`
+        """
+
+        if self.time_bins is None:
+            raise ValueError('Livetime cube was created without time slices.')
+
+        i0 = np.argmin(np.abs(self.time_bins - tmin))
+        i1 = np.argmin(np.abs(self.time_bins - tmax))
+        if (not np.isclose(self.time_bins[i0], tmin) or
+                not np.isclose(self.time_bins[i1], tmax) or i1 <= i0):
+            raise ValueError('Time range %f %f is not aligned with the '
+                             'time slices of the livetime cube.' % (tmin, tmax))
+
+        tab_gti = clip_gti(self._tab_gti, tmin, tmax)
+        ltc = LTCube(np.zeros_like(self.data), copy.deepcopy(self.hpx),
+                     self.costh_edges, tstart=tmin, tstop=tmax,
+                     zmin=self.zmin, zmax=self.zmax, tab_gti=tab_gti)
+
+        ltc._region = {'skydir': self._slices['skydir'],
+                       'radius': self._slices['radius']}
+        lt = np.sum(self._slices['lt'][i0:i1], axis=0)
+        lt_wt = np.sum(self._slices['lt_wt'][i0:i1], axis=0)
+        ltc._fill_from_coarse_hist(self._slices['skydir'], lt, lt_wt,
+                                   self._slices['radius'])
         return ltc
 
+    def append_from_gti(self, skydir, tab_sc, tab_gti, **kwargs):
+        """Add the livetime accumulated in a new set of GTIs to this
+        cube.  GTIs are clipped to start after the current stop time
+        of the cube (or the upper edge of the last time slice) such
+        that livetime is never double counted.  A cube with an
+        undefined stop time cannot be appended to.  This method can be
+        used to update a livetime cube when new data become available
+        without recomputing the full time range.
+
+        Parameters
+        ----------
+        skydir : `~astropy.coordinates.SkyCoord`
+            Center of the region in which livetime is computed.
+
+        tab_sc : `~astropy.table.Table` or str
+            Spacecraft (FT2) table or path to an FT2 file.
+
+        tab_gti : `~astropy.table.Table`
+            Table of GTIs for the new time range.
+
+        radius : float
+            Radius in degrees around ``skydir`` in which livetime is
+            computed.  For a cube created with `create_from_gti`,
+            ``skydir`` and ``radius`` must match the region on which
+            the cube was originally computed.
+        """
+
+        radius = kwargs.get('radius', 180.0)
+        region = getattr(self, '_region', None)
+        if region is not None:
+            if (skydir.separation(region['skydir']).deg > 1E-6 or
+                    not np.isclose(radius, region['radius'])):
+                raise ValueError('Region does not match the region on which '
+                                 'the livetime cube was computed: '
+                                 '(%.4f, %.4f) r=%.2f.' %
+                                 (region['skydir'].ra.deg,
+                                  region['skydir'].dec.deg,
+                                  region['radius']))
+            skydir = region['skydir']
+            radius = region['radius']
+
+        # The livetime of a cube with time slices only covers the
+        # range of its time bins
+        if self.time_bins is not None:
+            tmin = self.time_bins[-1]
+        elif self.tstop is not None:
+            tmin = self.tstop
+        else:
+            raise ValueError('Cannot append to a livetime cube with '
+                             'an undefined stop time.')
+
+        tab_gti = clip_gti(tab_gti, tmin, np.inf)
+        if len(tab_gti) == 0:
+            return
+
+        kwargs = dict(kwargs, radius=radius)
+        kwargs.pop('time_bins', None)
+        lt, lt_wt = self._fill_coarse_hist(skydir, tab_sc, tab_gti,
+                                           **kwargs)
+        self._fill_from_coarse_hist(skydir, lt, lt_wt, radius, add=True)
+
+        # Add a new time slice
+        if self.time_bins is not None:
+            self._slices['time_bins'] = np.append(self.time_bins,
+                                                  tab_gti['STOP'][-1])
+            self._slices['lt'] = np.concatenate(
+                (self._slices['lt'], lt[np.newaxis]))
+            self._slices['lt_wt'] = np.concatenate(
+                (self._slices['lt_wt'], lt_wt[np.newaxis]))
+
+        self._tab_gti = vstack([self._tab_gti, tab_gti])
+        if self._tstart is None:
+            self._tstart = tab_gti['START'][0]
+        self._tstop = tab_gti['STOP'][-1]
+
     def load_ltfile(self, ltfile):
 
         ltc = LTCube.create_from_fits(ltfile)
@@ -297,6 +859,8 @@ class LTCube(HpxMap):
     def load(self, ltc):
 
         self._counts += ltc.data
+        self._data_wt += ltc.data_wt
+        self._tab_gti = vstack([self._tab_gti, ltc._tab_gti])
 
         if self._tstart is not None:
             self._tstart = min(self.tstart, ltc.tstart)
@@ -348,8 +912,9 @@ class LTCube(HpxMap):
         ----------
         skydir :  `~astropy.coordinates.SkyCoord`
 
-        tab_sc : `~astropy.table.Table`
-            Spacecraft (FT2) table.
+        tab_sc : `~astropy.table.Table` or str
+            Spacecraft (FT2) table.  If a path to an FT2 file is given
+            the file will be read in chunks.
 
         tab_gti : `~astropy.table.Table`
             Table of GTIs.
@@ -361,8 +926,8 @@ class LTCube(HpxMap):
         skydir = SkyCoord(np.array([skydir.ra.deg]),
                           np.array([skydir.dec.deg]), unit='deg')
 
-        lt, lt_wt = fill_livetime_hist(skydir, tab_sc, tab_gti, zmax,
-                                       self.costh_edges)
+        lt, lt_wt = _fill_livetime_hist(skydir, tab_sc, tab_gti, zmax,
+                                        self.costh_edges)
 
         ipix = self.hpx.skydir_to_pixel(skydir)
 
@@ -428,8 +993,10 @@ class LTCube(HpxMap):
                 hdu_bnds, hdu_gti]
 
         for hdu in hdus:
-            hdu.header['TSTART'] = self.tstart
-            hdu.header['TSTOP'] = self.tstop
+            if self.tstart is not None:
+                hdu.header['TSTART'] = self.tstart
+            if self.tstop is not None:
+                hdu.header['TSTOP'] = self.tstop
 
         with fits.HDUList(hdus) as hdulist:
             hdulist.writeto(outfile, clobber=True)
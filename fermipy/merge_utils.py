@@ -5,10 +5,12 @@ from __future__ import absolute_import, division, print_function
 
 import sys
 import argparse
+import functools
+from multiprocessing.pool import ThreadPool
 import numpy as np
 from astropy.io import fits
 from fermipy.hpx_utils import HPX
-from fermipy.skymap import HpxMap
+from fermipy.skymap import HpxMap, SparseHpxMap
 
 def update_null_primary(hdu_in, hdu=None):
     """ 'Update' a null primary HDU
@@ -159,38 +161,176 @@ def update_hpx_skymap_allsky(map_in, map_out):
     return map_out
 
 
-def merge_wcs_counts_cubes(filelist):
+def update_hpx_skymap_sparse(map_in, map_out):
+    """ 'Update' a sparse HEALPix skymap
+
+    This returns map_in if map_out does not exist.
+    If map_out does exist, this returns the sum of map_in and map_out.
+    map_in can also be a list of maps.
+    """
+    if map_out is None:
+        if isinstance(map_in, SparseHpxMap):
+            return map_in
+        map_out, map_in = map_in[0], map_in[1:]
+    return map_out.coadd(map_in)
+
+
+def update_hpx_skymap_dense(map_in, data_out=None):
+    """ 'Update' a dense HEALPix data array with a sparse skymap
+
+    This allocates data_out from map_in if it does not exist and then
+    adds the data in map_in to data_out in place.
+    """
+    if data_out is None:
+        data_out = np.zeros(map_in.shape, map_in.counts.dtype)
+    elif data_out.shape != map_in.shape:
+        raise ValueError("Map shapes do not match : %s %s" %
+                         (data_out.shape, map_in.shape))
+
+    if map_in.nebin is None:
+        data_out[map_in.pix] += map_in.counts
+    else:
+        data_out[map_in.chan, map_in.pix] += map_in.counts
+    return data_out
+
+
+def update_gti_data(data_in, data_out=None, nrows=0):
+    """ 'Update' the merged GTI data
+
+    This appends the rows of data_in to data_out, which is allocated
+    if it does not exist and grown by doubling its size when it is
+    full.
+
+    Returns
+    -------
+    data_out : `~numpy.ndarray`
+        The merged GTI data, only the first nrows are filled
+
+    nrows : int
+        The number of rows filled in data_out
+    """
+    nrows_in = len(data_in)
+    if data_out is None:
+        data_out = np.zeros(max(2 * nrows_in, 1), dtype=data_in.dtype)
+    elif nrows + nrows_in > len(data_out):
+        data_new = np.zeros(max(2 * len(data_out), nrows + nrows_in),
+                            dtype=data_out.dtype)
+        data_new[:nrows] = data_out[:nrows]
+        data_out = data_new
+    data_out[nrows:nrows + nrows_in] = data_in
+    return data_out, nrows + nrows_in
+
+
+def read_counts_cube_data(filename, is_hpx=False):
+    """ Read the data needed to merge a counts cube
+
+    The file is opened memory-mapped and only the map and GTI data
+    are read, so this can be run in a thread pool.
+
+    Returns
+    -------
+    data : `~numpy.ndarray` or `~fermipy.skymap.SparseHpxMap`
+        The map data
+
+    gti_data : `~numpy.ndarray` or None
+        The GTI data
+
+    exposure : float
+        Exposure value taken from the GTI header
+
+    tstop : float
+        TSTOP value taken from the GTI header
+
+    date_end : str or None
+        DATE-END value taken from the primary header
+    """
+    fin = fits.open(filename, memmap=True)
+    try:
+        if is_hpx:
+            data = SparseHpxMap.create_from_hdulist(fin)
+        else:
+            data = np.array(fin[0].data)
+
+        try:
+            (gti_data, exposure, tstop) = extract_gti_data(fin["GTI"])
+            gti_data = np.array(gti_data)
+        except KeyError:
+            (gti_data, exposure, tstop) = (None, 0., None)
+        date_end = fin[0].header.get('DATE-END', None)
+    finally:
+        fin.close()
+    return (data, gti_data, exposure, tstop, date_end)
+
+
+def iterate_counts_cube_data(filelist, is_hpx=False, nthread=1):
+    """ Iterate over the data of a list of counts cubes
+
+    If nthread is larger than one, the files are read in blocks of
+    nthread files using a thread pool.  The blocks are returned in
+    the order of filelist.
+    """
+    if nthread is None or nthread <= 1:
+        for filename in filelist:
+            yield read_counts_cube_data(filename, is_hpx)
+        return
+
+    func = functools.partial(read_counts_cube_data, is_hpx=is_hpx)
+    pool = ThreadPool(nthread)
+    try:
+        for i in range(0, len(filelist), nthread):
+            for result in pool.map(func, filelist[i:i + nthread]):
+                yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def merge_wcs_counts_cubes(filelist, nthread=1):
     """ Merge all the files in filelist, assuming that they WCS counts cubes
+
+    The files are read one at a time and the counts are accumulated in
+    place, so memory usage does not grow with the number of files.
+
+    Parameters
+    ----------
+    filelist : list
+        Input file names
+
+    nthread : int
+        Number of threads used to read the input files
     """
     out_prim = None
-    out_ebounds = None
-
-    datalist_gti = []
+    out_gti = None
+    ngti = 0
     exposure_sum = 0.
-    nfiles = len(filelist)
-    ngti = np.zeros(nfiles, int)
+    tstop = None
+    date_end = None
+
+    first = fits.open(filelist[0], memmap=False)
+    out_ebounds = update_ebounds(first["EBOUNDS"])
 
-    for i, filename in enumerate(filelist):
-        fin = fits.open(filename)
+    for (data, gti_data, exposure,
+         tstop_in, date_end_in) in iterate_counts_cube_data(filelist,
+                                                            False, nthread):
         sys.stdout.write('.')
         sys.stdout.flush()
-        if i == 0:
-            out_prim = update_primary(fin[0], out_prim)
-            out_ebounds = update_ebounds(fin["EBOUNDS"], out_ebounds)
-        (gti_data, exposure, tstop) = extract_gti_data(fin["GTI"])
-        datalist_gti.append(gti_data)
-        exposure_sum += exposure
-        ngti[i] = len(gti_data)
-        if i == 0:
-            first = fin
-        elif i == nfiles - 1:
-            date_end = fin[0].header['DATE-END']
+        if out_prim is None:
+            out_prim = fits.PrimaryHDU(data=data,
+                                       header=first[0].header.copy())
         else:
-            fin.close()
+            out_prim.data += data
+        if gti_data is not None:
+            out_gti, ngti = update_gti_data(gti_data, out_gti, ngti)
+            exposure_sum += exposure
+            tstop = tstop_in
+        date_end = date_end_in
 
-    out_gti = merge_all_gti_data(datalist_gti, ngti, first['GTI'])
+    out_gti = fits.BinTableHDU(data=out_gti[:ngti],
+                               header=first['GTI'].header.copy(),
+                               name='GTI')
     out_gti.header['EXPOSURE'] = exposure_sum
     out_gti.header['TSTOP'] = tstop
+    first.close()
 
     hdulist = [out_prim, out_ebounds, out_gti]
     for hdu in hdulist:
@@ -201,62 +341,84 @@ def merge_wcs_counts_cubes(filelist):
     return fits.HDUList(hdulist)
 
 
-def merge_hpx_counts_cubes(filelist):
+def merge_hpx_counts_cubes(filelist, sparse=False, nthread=1):
     """ Merge all the files in filelist, assuming that they HEALPix counts cubes
-    """
-    out_prim = None
-    out_skymap = None
-    out_ebounds = None
 
-    datalist_gti = []
-    exposure_sum = 0.
-    nfiles = len(filelist)
-    ngti = np.zeros(nfiles, int)
+    The files are read one at a time with a sparse representation.
+    Unless sparse is set, the counts are accumulated in place in a
+    dense array that is allocated when reading the first file.
+    Otherwise they are accumulated as a sparse map, so only the
+    non-zero pixels are held in memory while merging.
 
-    out_name = None
+    Parameters
+    ----------
+    filelist : list
+        Input file names
+
+    sparse : bool
+        Write the merged map with the sparse (FGST_SRCMAP_SPARSE)
+        convention instead of expanding it to a dense map.
 
-    for i, filename in enumerate(filelist):
-        fin = fits.open(filename)
+    nthread : int
+        Number of threads used to read the input files
+    """
+    out_skymap = None
+    out_data = None
+    out_hpx = None
+    out_gti = None
+    ngti = 0
+    exposure_sum = 0.
+    tstop = None
+    date_end = None
+
+    # Number of sparse maps to hold before adding them to the output
+    nbuffer = max(8, nthread)
+    buffered = []
+
+    first = fits.open(filelist[0], memmap=False)
+    out_prim = update_null_primary(first[0])
+    try:
+        out_ebounds = update_ebounds(first["EBOUNDS"])
+    except KeyError:
+        out_ebounds = update_energies(first["ENERGIES"])
+
+    for (map_in, gti_data, exposure,
+         tstop_in, date_end_in) in iterate_counts_cube_data(filelist,
+                                                            True, nthread):
         sys.stdout.write('.')
         sys.stdout.flush()
-        if i == 0:
-            out_prim = update_null_primary(fin[0], out_prim)
-            out_name = fin[1].name
-
-        map_in = HpxMap.create_from_hdulist(fin)
-        out_skymap = update_hpx_skymap_allsky(map_in, out_skymap)
-        if i == 0:
-            try:
-                out_ebounds = update_ebounds(fin["EBOUNDS"], out_ebounds)
-            except KeyError:
-                out_ebounds = update_energies(fin["ENERGIES"], out_ebounds)
-        try:
-            (gti_data, exposure, tstop) = extract_gti_data(fin["GTI"])
-            datalist_gti.append(gti_data)
-            exposure_sum += exposure
-            ngti[i] = len(gti_data)
-        except KeyError:
-            pass
-
-        if i == 0:
-            first = fin
-        elif i == nfiles - 1:
-            try:
-                date_end = fin[0].header['DATE-END']
-            except KeyError:
-                date_end = None
+        if out_hpx is None:
+            out_hpx = map_in.hpx
+        if sparse:
+            buffered.append(map_in)
+            if len(buffered) >= nbuffer:
+                out_skymap = update_hpx_skymap_sparse(buffered, out_skymap)
+                buffered = []
         else:
-            fin.close()
+            out_data = update_hpx_skymap_dense(map_in, out_data)
+        if gti_data is not None:
+            out_gti, ngti = update_gti_data(gti_data, out_gti, ngti)
+            exposure_sum += exposure
+            tstop = tstop_in
+        date_end = date_end_in
 
-    out_skymap_hdu = out_skymap.create_image_hdu("SKYMAP")
+    if sparse:
+        if buffered:
+            out_skymap = update_hpx_skymap_sparse(buffered, out_skymap)
+        out_skymap_hdu = out_skymap.create_image_hdu("SKYMAP")
+    else:
+        out_skymap_hdu = HpxMap(out_data, out_hpx).create_image_hdu("SKYMAP")
 
     hdulist = [out_prim, out_skymap_hdu, out_ebounds]
 
-    if len(datalist_gti) > 0:
-        out_gti = merge_all_gti_data(datalist_gti, ngti, first['GTI'])
+    if out_gti is not None:
+        out_gti = fits.BinTableHDU(data=out_gti[:ngti],
+                                   header=first['GTI'].header.copy(),
+                                   name='GTI')
         out_gti.header['EXPOSURE'] = exposure_sum
         out_gti.header['TSTOP'] = tstop
         hdulist.append(out_gti)
+    first.close()
 
     for hdu in hdulist:
         if date_end:
@@ -3,8 +3,12 @@ from __future__ import absolute_import, division, print_function
 import copy
 import os
 import json
+import hashlib
 import numpy as np
-import scipy.signal
+try:
+    import scipy.fft as fftpack
+except ImportError:
+    fftpack = None
 import healpy as hp
 from astropy.io import fits
 from gammapy.maps import WcsNDMap, HpxNDMap
@@ -33,7 +37,169 @@ def poisson_lnl(nc, mu):
     return lnl
 
 
-def convolve_map(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None):
+# Cache of kernel transforms used by convolve_maps
+_kernel_fft_cache = utils.LRUCache(maxsize=64, maxbytes=2**28)
+
+
+def get_kernel_fft_cache_stats():
+    """Return the hit/miss statistics of the kernel transform cache."""
+    return _kernel_fft_cache.stats()
+
+
+def clear_kernel_fft_cache():
+    """Remove all entries from the kernel transform cache."""
+    _kernel_fft_cache.clear()
+
+
+def _rfftn(a, s, nthread=None):
+    if fftpack is not None:
+        return fftpack.rfftn(a, s, axes=(-2, -1), workers=nthread)
+    return np.fft.rfftn(a, s, axes=(-2, -1))
+
+
+def _irfftn(a, s, nthread=None):
+    if fftpack is not None:
+        return fftpack.irfftn(a, s, axes=(-2, -1), workers=nthread)
+    return np.fft.irfftn(a, s, axes=(-2, -1))
+
+
+def _next_fast_len(n):
+    if fftpack is not None:
+        return fftpack.next_fast_len(n, real=True)
+    import scipy.fftpack
+    return scipy.fftpack.next_fast_len(n)
+
+
+def truncate_kernel(ks, cpix, threshold=0.001, map_shape=None):
+    """Truncate a 2-D convolution kernel to the region where its
+    amplitude is above ``threshold`` times the amplitude at the
+    reference pixel ``cpix``.  Returns the half-widths (nx, ny) of the
+    truncated kernel.  Both half-widths are reduced by one if the
+    kernel extends beyond the first dimension of a map with spatial
+    dimensions ``map_shape`` (by default the shape of the kernel)."""
+    ix = int(cpix[0])
+    iy = int(cpix[1])
+
+    mx = ks[ix, :] > ks[ix, iy] * threshold
+    my = ks[:, iy] > ks[ix, iy] * threshold
+
+    nx = int(max(3, np.round(np.sum(mx) / 2.)))
+    ny = int(max(3, np.round(np.sum(my) / 2.)))
+
+    # Ensure that there is an odd number of pixels in the kernel
+    # array
+    if map_shape is None:
+        map_shape = ks.shape
+
+    if ix + nx + 1 >= map_shape[0] or ix - nx < 0:
+        nx -= 1
+        ny -= 1
+
+    return nx, ny
+
+
+def make_kernel_fft(k, cpix, map_shape, threshold=0.001, nthread=None):
+    """Compute the transforms of a sequence of 2-D convolution
+    kernels for maps with spatial dimensions ``map_shape``.  Each
+    kernel is truncated with `truncate_kernel`.  Planes whose
+    truncated kernels need the same transform size are grouped and
+    their kernels are zero-padded to a common size centered on the
+    reference pixel so that each group can be transformed in a
+    single pass.  Transforms are cached using the kernel values and
+    the map shape as the key.
+
+    Returns
+    -------
+    groups : list
+       List of tuples (idx, kfft, fft_shape, offset) with the indices
+       of the energy planes in the group, the kernel transforms, the
+       shape of the transform in the spatial dimensions and the
+       offset of the first pixel of the output map in the full
+       convolution.
+    """
+    k = np.ascontiguousarray(k, dtype=float)
+    key = (hashlib.sha1(k.tobytes()).hexdigest(), k.shape,
+           tuple(map_shape), int(cpix[0]), int(cpix[1]), threshold)
+    groups = _kernel_fft_cache.get(key)
+    if groups is not None:
+        return groups
+
+    ix = int(cpix[0])
+    iy = int(cpix[1])
+    widths = [truncate_kernel(ks, cpix, threshold, map_shape) for ks in k]
+    fft_shapes = [(_next_fast_len(map_shape[0] + 2 * nx),
+                   _next_fast_len(map_shape[1] + 2 * ny))
+                  for nx, ny in widths]
+
+    groups = []
+    for fft_shape in sorted(set(fft_shapes)):
+        idx = np.array([i for i, t in enumerate(fft_shapes)
+                        if t == fft_shape])
+        nxmax = max([widths[i][0] for i in idx])
+        nymax = max([widths[i][1] for i in idx])
+        kpad = np.zeros((len(idx), 2 * nxmax + 1, 2 * nymax + 1))
+        for j, i in enumerate(idx):
+            nx, ny = widths[i]
+            ks = k[i, ix - nx:ix + nx + 1, iy - ny:iy + ny + 1]
+            kpad[j, nxmax - nx:nxmax - nx + ks.shape[0],
+                 nymax - ny:nymax - ny + ks.shape[1]] = ks
+        kfft = _rfftn(kpad, fft_shape, nthread)
+        groups += [(idx, kfft, fft_shape, (nxmax, nymax))]
+
+    _kernel_fft_cache.put(key, groups)
+    return groups
+
+
+def convolve_maps(maps, k, cpix, threshold=0.001, imin=0, imax=None,
+                  wmap=None, nthread=None):
+    """
+    Perform an energy-dependent convolution on a batch of 3-D maps.
+    The transforms of all energy planes of all maps are computed
+    in a single pass and the kernel transforms are cached.  See
+    `convolve_map` for a description of the parameters.
+
+    Parameters
+    ----------
+
+    maps : list or `~numpy.ndarray`
+       Sequence of 3-D maps or a 4-D array with the maps stacked
+       along the first dimension.
+
+    nthread : int
+       Number of threads used to compute the transforms.  If None
+       the transforms are computed in a single thread.
+
+    Returns
+    -------
+
+    o : `~numpy.ndarray`
+       4-D array with the convolved maps.
+    """
+    islice = slice(imin, imax)
+
+    maps = np.asarray(maps, dtype=float)[:, islice, ...]
+    ks = k[islice, ...]
+    map_shape = maps.shape[-2:]
+    o = np.zeros(maps.shape)
+    if maps.shape[1] == 0:
+        return o
+
+    groups = make_kernel_fft(ks, cpix, map_shape, threshold, nthread)
+    for idx, kfft, fft_shape, offset in groups:
+        mfft = _rfftn(maps[:, idx, ...], fft_shape, nthread)
+        mfft *= kfft[np.newaxis, ...]
+        oi = _irfftn(mfft, fft_shape, nthread)
+        o[:, idx, ...] = oi[..., offset[0]:offset[0] + map_shape[0],
+                            offset[1]:offset[1] + map_shape[1]]
+
+    if wmap is not None:
+        o *= wmap[islice, ...][np.newaxis, ...]
+
+    return o
+
+
+def convolve_map(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None,
+                 nthread=None):
     """
     Perform an energy-dependent convolution on a sequence of 2-D spatial maps.
 
@@ -64,66 +230,67 @@ def convolve_map(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None):
        3-D map containing a sequence of 2-D spatial maps of weights.  First
        dimension should be energy. This map should have the same dimension as m.
 
-    """
-    islice = slice(imin, imax)
-
-    o = np.zeros(m[islice, ...].shape)
-    ix = int(cpix[0])
-    iy = int(cpix[1])
-
-    # Loop over energy
-    for i in range(m[islice, ...].shape[0]):
-
-        ks = k[islice, ...][i, ...]
-        ms = m[islice, ...][i, ...]
-
-        mx = ks[ix, :] > ks[ix, iy] * threshold
-        my = ks[:, iy] > ks[ix, iy] * threshold
+    nthread : int
+       Number of threads used to compute the transforms.
 
-        nx = int(max(3, np.round(np.sum(mx) / 2.)))
-        ny = int(max(3, np.round(np.sum(my) / 2.)))
-
-        # Ensure that there is an odd number of pixels in the kernel
-        # array
-        if ix + nx + 1 >= ms.shape[0] or ix - nx < 0:
-            nx -= 1
-            ny -= 1
-
-        sx = slice(ix - nx, ix + nx + 1)
-        sy = slice(iy - ny, iy + ny + 1)
+    """
+    return convolve_maps([m], k, cpix, threshold=threshold, imin=imin,
+                         imax=imax, wmap=wmap, nthread=nthread)[0]
 
-        ks = ks[sx, sy]
 
-#        origin = [0, 0]
-#        if ks.shape[0] % 2 == 0: origin[0] += 1
-#        if ks.shape[1] % 2 == 0: origin[1] += 1
-#        o[i,...] = ndimage.convolve(ms, ks, mode='constant',
-#                                     origin=origin, cval=0.0)
+def make_source_window(src_dict, lmax):
+    """Compute the spherical harmonic window function of the spatial
+    model of a test source.
 
-        o[i, ...] = scipy.signal.fftconvolve(ms, ks, mode='same')
-        if wmap is not None:
-            o[i, ...] *= wmap[islice, ...][i, ...]
+    Parameters
+    ----------
 
-    return o
+    src_dict : dict
+       Source dictionary with the ``SpatialModel`` and
+       ``SpatialWidth`` of the test source.  Supported spatial models
+       are PointSource, Gaussian and RadialDisk.  For the Gaussian
+       the width is the standard deviation and for the RadialDisk the
+       radius, in degrees.
 
+    lmax : int
+       Maximum multipole.
 
-def convolve_map_hpx(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None):
     """
-    Perform an energy-dependent convolution on a sequence of 2-D spatial maps.
+    spatial_model = src_dict['SpatialModel']
+    width = src_dict.get('SpatialWidth', None)
+
+    if spatial_model == 'PointSource':
+        return np.ones(lmax + 1)
+    elif spatial_model in ['Gaussian', 'RadialGaussian']:
+        return hp.sphtfunc.gauss_beam(np.radians(width) * 2.0 *
+                                      np.sqrt(2.0 * np.log(2.0)), lmax)
+    elif spatial_model in ['Disk', 'RadialDisk']:
+        dtheta = np.linspace(0.0, width, 1001)
+        return utils.make_radial_window(dtheta, np.ones(dtheta.shape), lmax)
+    else:
+        raise Exception('Unsupported spatial model for HEALPix convolution: %s'
+                        % spatial_model)
+
+
+def convolve_map_hpx(m, bls, imin=0, imax=None, wmap=None):
+    """
+    Perform an energy-dependent convolution on a sequence of all-sky
+    HEALPix maps with radially symmetric kernels.  The convolution is
+    performed in harmonic space by multiplying the spherical harmonic
+    coefficients of each energy plane by the window function of the
+    kernel.
 
     Parameters
     ----------
 
-    m : `~numpy.ndarray`
+    m : `HpxNDMap`
        2-D map containing a sequence of 1-D HEALPix maps.  First
        dimension should be energy.
 
-    k : `~numpy.ndarray`
-       2-D map containing a sequence of convolution kernels (PSF) for
-       each slice in m.  This map should have the same dimension as m.
-
-    threshold : float
-       Kernel amplitude 
+    bls : `~numpy.ndarray`
+       2-D array containing a sequence of kernel window functions
+       (e.g. from `~fermipy.irfs.PSFModel.window_function`) for each
+       slice in m.  A 1-D array is applied to all slices.
 
     imin : int
        Minimum index in energy dimension.
@@ -131,11 +298,34 @@ def convolve_map_hpx(m, k, cpix, threshold=0.001, imin=0, imax=None, wmap=None):
     imax : int
        Maximum index in energy dimension.
 
-    wmap :  `~numpy.ndarray`
+    wmap :  `HpxNDMap`
        2-D map containing a sequence of 1-D HEALPix maps of weights.  First
        dimension should be energy. This map should have the same dimension as m.
     """
-    raise NotImplementedError('convolve_map_hpx')
+    islice = slice(imin, imax)
+
+    o = np.zeros(m.data.shape)
+    nest = np.all(m.geom.nest)
+    bls = np.asarray(bls, dtype=float)
+    if bls.ndim == 1:
+        bls = bls[np.newaxis, :] * np.ones((m.data.shape[0], 1))
+
+    # Loop over energy
+    for i, ms in enumerate(m.data[islice, ...]):
+        bl = bls[islice][i]
+        # Need to be in RING scheme
+        if nest:
+            ms = hp.pixelfunc.reorder(ms, n2r=True)
+
+        o[islice, ...][i] = hp.sphtfunc.smoothing(ms, beam_window=bl,
+                                                  lmax=len(bl) - 1)
+        if nest:
+            o[islice, ...][i] = hp.pixelfunc.reorder(
+                o[islice, ...][i], r2n=True)
+        if wmap is not None:
+            o[islice, ...][i] *= wmap.data[islice, ...][i]
+
+    return HpxNDMap(m.geom, o)
 
 
 def convolve_map_hpx_gauss(m, sigmas, imin=0, imax=None, wmap=None):
@@ -316,6 +506,8 @@ class ResidMapGenerator(object):
         exclude = kwargs.setdefault('exclude', None)
         loge_bounds = kwargs.setdefault('loge_bounds', None)
         use_weights = kwargs.setdefault('use_weights', False)
+        multithread = kwargs.setdefault('multithread', False)
+        nthread = kwargs.setdefault('nthread', None)
 
         if loge_bounds:
             if len(loge_bounds) != 2:
@@ -327,6 +519,11 @@ class ResidMapGenerator(object):
         else:
             loge_bounds = [self.log_energies[0], self.log_energies[-1]]
 
+        if multithread:
+            fft_workers = nthread if nthread is not None else -1
+        else:
+            fft_workers = None
+
         # Put the test source at the pixel closest to the ROI center
         xpix, ypix = (np.round((self.npix - 1.0) / 2.),
                       np.round((self.npix - 1.0) / 2.))
@@ -387,12 +584,9 @@ class ResidMapGenerator(object):
                 wmap = None
                 mask = None
 
-            ccs = convolve_map(
-                cc, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
-            mcs = convolve_map(
-                mc, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
-            ecs = convolve_map(
-                ec, sm[i], cpix, imin=imin, imax=imax, wmap=wmap)
+            ccs, mcs, ecs = convolve_maps([cc, mc, ec], sm[i], cpix,
+                                          imin=imin, imax=imax, wmap=wmap,
+                                          nthread=fft_workers)
 
             cms = np.sum(ccs, axis=0)
             mms = np.sum(mcs, axis=0)
@@ -443,9 +637,8 @@ class ResidMapGenerator(object):
         else:
             loge_bounds = [self.log_energies[0], self.log_energies[-1]]
 
-        kernel = None
-
-        gauss_width = np.radians(0.3)
+        src_dict.setdefault('SpatialModel', 'PointSource')
+        src_dict.setdefault('SpatialWidth', 0.3)
 
         hpxsky = self.counts_map().geom.to_image()
 
@@ -473,13 +666,15 @@ class ResidMapGenerator(object):
                 wmap = None
                 mask = None
 
-            sigmas = gauss_width * np.ones(cc.data.shape[0])
-            ccs = convolve_map_hpx_gauss(
-                cc, sigmas, imin=imin, imax=imax, wmap=wmap)
-            mcs = convolve_map_hpx_gauss(
-                mc, sigmas, imin=imin, imax=imax, wmap=wmap)
-            ecs = convolve_map_hpx_gauss(
-                ec, sigmas, imin=imin, imax=imax, wmap=wmap)
+            # Window functions of the PSF convolved with the
+            # spatial model of the test source
+            lmax = 3 * int(np.max(cc.geom.nside)) - 1
+            bls = c.psf.window_function(c.energies, lmax)
+            bls *= make_source_window(src_dict, lmax)[np.newaxis, :]
+
+            ccs = convolve_map_hpx(cc, bls, imin=imin, imax=imax, wmap=wmap)
+            mcs = convolve_map_hpx(mc, bls, imin=imin, imax=imax, wmap=wmap)
+            ecs = convolve_map_hpx(ec, bls, imin=imin, imax=imax, wmap=wmap)
 
             cms = ccs.sum_over_energy()
             mms = mcs.sum_over_energy()
@@ -498,7 +693,9 @@ class ResidMapGenerator(object):
                          poisson_lnl(cmst.data, mmst.data))
         sigma.data = np.sqrt(ts.data)
         sigma.data[emst.data < 0] *= -1
-        modelname = 'gauss_0p3'
+        modelname = src_dict['SpatialModel'].lower()
+        if src_dict['SpatialModel'] != 'PointSource':
+            modelname += '_s%04.2f' % src_dict['SpatialWidth']
 
         o = {'name': utils.join_strings([prefix, modelname]),
              'projtype': 'HPX',
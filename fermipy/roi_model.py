@@ -2072,13 +2072,17 @@ class ROIModel(fermipy.config.Configurable):
         self._src_skydir = SkyCoord(ra=radec[0], dec=radec[1], unit=u.deg)
         self._src_radius = self._src_skydir.separation(self.skydir)
 
-    def write_xml(self, xmlfile, config=None):
-        """Save the ROI model as an XML file."""
+    def write_xml(self, xmlfile, config=None, exclude=None):
+        """Save the ROI model as an XML file.  Sources with names in
+        ``exclude`` will be omitted from the file."""
 
         root = ElementTree.Element('source_library')
         root.set('title', 'source_library')
 
+        exclude = [] if exclude is None else exclude
         for s in self._srcs:
+            if s.name in exclude:
+                continue
             s.write_xml(root)
 
         if config is not None:
@@ -19,6 +19,11 @@ def main():
                         help='Output file.')
     parser.add_argument('--clobber', default=False, action='store_true',
                         help='Overwrite output file.')
+    parser.add_argument('--sparse', default=False, action='store_true',
+                        help='Write merged HEALPix maps with the sparse '
+                        'convention.')
+    parser.add_argument('--nthread', default=1, type=int,
+                        help='Number of threads used to read input files.')
     parser.add_argument('files', nargs='+', default=None,
                         help='List of input files.')
 
@@ -26,9 +31,12 @@ def main():
 
     proj, f, hdu = fits_utils.read_projection_from_fits(args.files[0])
     if isinstance(proj, WCS):
-        hdulist = merge_utils.merge_wcs_counts_cubes(args.files)
+        hdulist = merge_utils.merge_wcs_counts_cubes(args.files,
+                                                     nthread=args.nthread)
     elif isinstance(proj, HPX):
-        hdulist = merge_utils.merge_hpx_counts_cubes(args.files)
+        hdulist = merge_utils.merge_hpx_counts_cubes(args.files,
+                                                     sparse=args.sparse,
+                                                     nthread=args.nthread)
     else:
         raise TypeError("Could not read projection from file %s" %
                         args.files[0])
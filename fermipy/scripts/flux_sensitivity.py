@@ -95,6 +95,12 @@ def main(args=None):
     parser.add_argument('--spatial_size', default=1.0, type=float,
                         help='Set the intrinsic 68-percent containment radius in degrees for '
                         'extended spatial models (RadialDisk, RadialGaussian).')
+    parser.add_argument('--lookup_nside', default=None, type=int,
+                        help='Tabulate the exposure and galactic diffuse intensity on a HEALPix grid '
+                        'with this NSIDE and interpolate the tables when evaluating the sensitivity.  '
+                        'This speeds up the calculation for large numbers of sky positions.')
+    parser.add_argument('--nthread', default=1, type=int,
+                        help='Number of processes used to compute the sensitivity maps.')
     parser.add_argument('--output', default='output.fits', type=str,
                         help='Output filename.')
     parser.add_argument('--obs_time_yr', default=None, type=float,
@@ -105,6 +111,32 @@ def main(args=None):
     run_flux_sensitivity(**vars(args))
 
 
+def fill_sensitivity_map(scalc, method, map_flux, map_npred, map_skydir, pix_idx,
+                         fn, ts_thresh, min_counts, nstep=500, nthread=1):
+    """Fill the flux and npred maps with the output of the flux
+    threshold method ``method`` of ``scalc``.  Each chunk of pixels
+    is written into the maps as soon as it completes.
+
+    Parameters
+    ----------
+    pix_idx : tuple
+        Tuple of pixel index arrays into the spatial dimensions of
+        the maps for each element of ``map_skydir``.
+    """
+    for s, o in scalc.iter_flux_threshold(map_skydir, fn, ts_thresh,
+                                          min_counts, method=method,
+                                          nstep=nstep, nthread=nthread):
+        idx = tuple(t[s] for t in pix_idx)
+        npix = len(idx[0])
+        if map_flux.data.ndim > len(idx):
+            idx = (slice(None),) + idx
+            map_flux.data[idx] = np.reshape(o['flux'], (npix, -1)).T
+            map_npred.data[idx] = np.reshape(o['npred'], (npix, -1)).T
+        else:
+            map_flux.data[idx] = np.ravel(o['flux'])
+            map_npred.data[idx] = np.ravel(o['npred'])
+
+
 def run_flux_sensitivity(**kwargs):
 
     index = kwargs.get('index', 2.0)
@@ -135,6 +167,8 @@ def run_flux_sensitivity(**kwargs):
     ts_thresh = kwargs.get('ts_thresh', 25.0)
     nside = kwargs.get('hpx_nside', 16)
     output = kwargs.get('output', None)
+    nthread = kwargs.get('nthread', 1)
+    lookup_nside = kwargs.get('lookup_nside', None)
 
     event_types = [['FRONT', 'BACK']]
 
@@ -186,7 +220,7 @@ def run_flux_sensitivity(**kwargs):
     scalc = SensitivityCalc(gdiff, iso, ltc, ebins,
                             event_class, event_types, gdiff_fit=gdiff_fit,
                             iso_fit=iso_fit, spatial_model=spatial_model,
-                            spatial_size=spatial_size)
+                            spatial_size=spatial_size, lookup_nside=lookup_nside)
 
     # Compute Maps
     map_diff_flux = None
@@ -195,6 +229,10 @@ def run_flux_sensitivity(**kwargs):
     map_int_npred = None
 
     map_nstep = 500
+    if nthread is not None and nthread > 1 and map_type is not None:
+        # Use enough chunks to keep all of the processes busy
+        npix = 12 * nside**2 if map_type == 'hpx' else wcs_npix**2
+        map_nstep = int(min(map_nstep, max(npix // (4 * nthread), 1)))
 
     if map_type == 'hpx':
 
@@ -202,25 +240,21 @@ def run_flux_sensitivity(**kwargs):
         map_diff_flux = HpxMap(np.zeros((nbin, hpx.npix)), hpx)
         map_diff_npred = HpxMap(np.zeros((nbin, hpx.npix)), hpx)
         map_skydir = map_diff_flux.hpx.get_sky_dirs()
+        pix_idx = (np.arange(hpx.npix),)
 
-        for i in range(0, len(map_skydir), map_nstep):
-            s = slice(i, i + map_nstep)
-            o = scalc.diff_flux_threshold(
-                map_skydir[s], fn, ts_thresh, min_counts)
-            map_diff_flux.data[:, s] = o['flux'].T
-            map_diff_npred.data[:, s] = o['npred'].T
+        fill_sensitivity_map(scalc, 'diff_flux_threshold', map_diff_flux,
+                             map_diff_npred, map_skydir, pix_idx,
+                             fn, ts_thresh, min_counts,
+                             nstep=map_nstep, nthread=nthread)
 
         hpx = HPX(nside, True, 'GAL')
         map_int_flux = HpxMap(np.zeros((hpx.npix)), hpx)
         map_int_npred = HpxMap(np.zeros((hpx.npix)), hpx)
-        map_skydir = map_int_flux.hpx.get_sky_dirs()
 
-        for i in range(0, len(map_skydir), map_nstep):
-            s = slice(i, i + map_nstep)
-            o = scalc.int_flux_threshold(
-                map_skydir[s], fn, ts_thresh, min_counts)
-            map_int_flux.data[s] = o['flux']
-            map_int_npred.data[s] = o['npred']
+        fill_sensitivity_map(scalc, 'int_flux_threshold', map_int_flux,
+                             map_int_npred, map_skydir, pix_idx,
+                             fn, ts_thresh, min_counts,
+                             nstep=map_nstep, nthread=nthread)
 
     elif map_type == 'wcs':
 
@@ -232,28 +266,20 @@ def run_flux_sensitivity(**kwargs):
         map_diff_npred = Map.create(
             c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj, ebins=ebins)
         map_skydir = map_diff_flux.get_pixel_skydirs()
+        pix_idx = np.unravel_index(np.arange(wcs_size), wcs_shape)[::-1]
 
-        for i in range(0, len(map_skydir), map_nstep):
-            idx = np.unravel_index(
-                np.arange(i, min(i + map_nstep, wcs_size)), wcs_shape)
-            s = (slice(None), idx[1], idx[0])
-            o = scalc.diff_flux_threshold(
-                map_skydir[slice(i, i + map_nstep)], fn, ts_thresh, min_counts)
-            map_diff_flux.data[s] = o['flux'].T
-            map_diff_npred.data[s] = o['npred'].T
+        fill_sensitivity_map(scalc, 'diff_flux_threshold', map_diff_flux,
+                             map_diff_npred, map_skydir, pix_idx,
+                             fn, ts_thresh, min_counts,
+                             nstep=map_nstep, nthread=nthread)
 
         map_int_flux = Map.create(c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj)
         map_int_npred = Map.create(c, wcs_cdelt, wcs_shape, 'GAL', wcs_proj)
-        map_skydir = map_int_flux.get_pixel_skydirs()
 
-        for i in range(0, len(map_skydir), map_nstep):
-            idx = np.unravel_index(
-                np.arange(i, min(i + map_nstep, wcs_size)), wcs_shape)
-            s = (idx[1], idx[0])
-            o = scalc.int_flux_threshold(
-                map_skydir[slice(i, i + map_nstep)], fn, ts_thresh, min_counts)
-            map_int_flux.data[s] = o['flux']
-            map_int_npred.data[s] = o['npred']
+        fill_sensitivity_map(scalc, 'int_flux_threshold', map_int_flux,
+                             map_int_npred, map_skydir, pix_idx,
+                             fn, ts_thresh, min_counts,
+                             nstep=map_nstep, nthread=nthread)
 
     o = scalc.diff_flux_threshold(c, fn, ts_thresh, min_counts)
 
@@ -307,9 +333,10 @@ def run_flux_sensitivity(**kwargs):
 
     index = np.linspace(1.0, 5.0, 4 * 4 + 1)
 
-    for g in index:
-        fn = spectrum.PowerLaw([1E-13, -g], scale=10**3.5)
-        o = scalc.int_flux_threshold(c, fn, ts_thresh, 3.0)
+    fns = [spectrum.PowerLaw([1E-13, -g], scale=10**3.5) for g in index]
+    outputs = scalc.int_flux_threshold_batch(c, fns, ts_thresh, 3.0)
+
+    for g, o in zip(index, outputs):
         row = [g]
         for colname in tab_int.columns:
             if colname == 'index':
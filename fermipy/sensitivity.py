@@ -1,9 +1,12 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
 
+import multiprocessing
+
 import pyLikelihood as pyLike
 
 import numpy as np
+import healpy as hp
 from astropy.coordinates import SkyCoord
 from astropy.table import Table, Column
 from astropy.io import fits
@@ -14,6 +17,17 @@ from fermipy import irfs
 from fermipy import skymap
 from fermipy.ltcube import LTCube
 
+_SENS_MAP_ARGS = None
+
+
+def _flux_threshold_worker(s):
+    """Evaluate the flux threshold for one chunk of sky positions in a
+    worker process.  The calculator object is inherited from the
+    parent when the worker is forked so the diffuse model, exposure
+    and PSF are shared with the parent rather than pickled."""
+    scalc, method, skydir, fn, ts_thresh, min_counts = _SENS_MAP_ARGS
+    return s, getattr(scalc, method)(skydir[s], fn, ts_thresh, min_counts)
+
 
 class SensitivityCalc(object):
     """Class for evaluating LAT source flux sensitivity.  
@@ -41,11 +55,19 @@ class SensitivityCalc(object):
         [['FRONT','BACK']].  A selection for joint FRONT/BACK analysis
         is defined with [['FRONT'],['BACK']].
 
+    lookup_nside : int
+        If not None then the exposure and galactic diffuse intensity
+        are tabulated on a HEALPix grid with this NSIDE the first time
+        an energy binning is used (or when `build_lookup_tables` is
+        called).  Subsequent calls interpolate these
+        tables instead of the underlying maps, which is much faster
+        when evaluating the sensitivity at many positions.
+
     """
 
     def __init__(self, gdiff, iso, ltc, ebins, event_class, event_types=None,
                  gdiff_fit=None, iso_fit=None, spatial_model='PointSource',
-                 spatial_size=None):
+                 spatial_size=None, lookup_nside=None):
 
         self._gdiff = gdiff
         self._gdiff_fit = gdiff_fit
@@ -58,6 +80,8 @@ class SensitivityCalc(object):
         self._event_class = event_class
         self._spatial_model = spatial_model
         self._spatial_size = spatial_size
+        self._lookup_nside = lookup_nside
+        self._lookup_tables = {}
         if event_types is None:
             self._event_types = [['FRONT'], ['BACK']]
         else:
@@ -92,6 +116,104 @@ class SensitivityCalc(object):
     def spatial_size(self):
         return self._spatial_size
 
+    @property
+    def lookup_nside(self):
+        return self._lookup_nside
+
+    def _interpolate_maps(self, skydir, ectr):
+        """Interpolate the exposure of each event type and the galactic
+        diffuse intensity at positions ``skydir`` and energies
+        ``ectr``.  All output arrays have dimensions of position and
+        energy."""
+
+        skydir_cel = skydir.transform_to('icrs')
+        skydir_gal = skydir.transform_to('galactic')
+
+        coords0 = np.meshgrid(*[skydir_cel.ra.deg, ectr], indexing='ij')
+        coords1 = np.meshgrid(*[skydir_cel.dec.deg, ectr], indexing='ij')
+
+        expv = [exp.interpolate(coords0[0], coords1[0], coords0[1])
+                for exp in self._exp]
+
+        coords0 = np.meshgrid(*[skydir_gal.l.deg, ectr], indexing='ij')
+        coords1 = np.meshgrid(*[skydir_gal.b.deg, ectr], indexing='ij')
+
+        bkgv = self._gdiff.interpolate(np.ravel(coords0[0]),
+                                       np.ravel(coords1[0]),
+                                       np.ravel(coords0[1]))
+        bkgv = bkgv.reshape(coords0[0].shape)
+
+        bkgv_fit = None
+        if self._gdiff_fit is not None:
+            bkgv_fit = self._gdiff_fit.interpolate(np.ravel(coords0[0]),
+                                                   np.ravel(coords1[0]),
+                                                   np.ravel(coords0[1]))
+            bkgv_fit = bkgv_fit.reshape(coords0[0].shape)
+
+        return expv, bkgv, bkgv_fit
+
+    def _get_lookup_tables(self, ectr):
+        """Return the exposure and galactic diffuse lookup tables for
+        the energies ``ectr``, creating them if necessary."""
+
+        key = tuple(ectr)
+        if key in self._lookup_tables:
+            return self._lookup_tables[key]
+
+        nside = self._lookup_nside
+        theta, phi = hp.pix2ang(nside, np.arange(hp.nside2npix(nside)),
+                                nest=True)
+        skydir = SkyCoord(np.degrees(phi), 90. - np.degrees(theta),
+                          unit='deg', frame='galactic')
+        tables = self._interpolate_maps(skydir, ectr)
+        self._lookup_tables[key] = tables
+        return tables
+
+    def build_lookup_tables(self, ebins=None):
+        """Create the exposure and galactic diffuse lookup tables for
+        the energy binning ``ebins`` if they do not already exist.
+        Tables are otherwise created on first use.  Creating them
+        ahead of time ensures that they are shared by processes forked
+        from this object rather than rebuilt in each process.  This
+        method has no effect if ``lookup_nside`` is None.
+
+        Parameters
+        ----------
+        ebins : `~numpy.ndarray`
+            Energy bin edges in MeV.  If None the energy binning of
+            this object is used.
+        """
+
+        if self._lookup_nside is None:
+            return
+
+        if ebins is None:
+            ectr = self.ectr
+        else:
+            ectr = np.exp(utils.edge_to_center(np.log(ebins)))
+        self._get_lookup_tables(ectr)
+
+    def _lookup_maps(self, skydir, ectr):
+        """Evaluate the exposure and galactic diffuse intensity at
+        positions ``skydir`` by bilinear interpolation of the HEALPix
+        lookup tables.  Outputs are the same as for
+        `_interpolate_maps`."""
+
+        skydir_gal = skydir.transform_to('galactic')
+        theta = np.radians(90. - np.atleast_1d(skydir_gal.b.deg))
+        phi = np.radians(np.atleast_1d(skydir_gal.l.deg))
+        pix, wts = hp.get_interp_weights(self._lookup_nside, theta, phi,
+                                         nest=True)
+        wts = wts[..., np.newaxis]
+
+        expv, bkgv, bkgv_fit = self._get_lookup_tables(ectr)
+        expv = [np.sum(t[pix] * wts, axis=0) for t in expv]
+        bkgv = np.sum(bkgv[pix] * wts, axis=0)
+        if bkgv_fit is not None:
+            bkgv_fit = np.sum(bkgv_fit[pix] * wts, axis=0)
+
+        return expv, bkgv, bkgv_fit
+
     def compute_counts(self, skydir, fn, ebins=None):
         """Compute signal and background counts for a point source at
         position ``skydir`` with spectral parameterization ``fn``.
@@ -120,8 +242,10 @@ class SensitivityCalc(object):
         else:
             ectr = np.exp(utils.edge_to_center(np.log(ebins)))
 
-        skydir_cel = skydir.transform_to('icrs')
-        skydir_gal = skydir.transform_to('galactic')
+        if self._lookup_nside is None:
+            expvs, gdiffv, gdiffv_fit = self._interpolate_maps(skydir, ectr)
+        else:
+            expvs, gdiffv, gdiffv_fit = self._lookup_maps(skydir, ectr)
 
         sig = []
         bkg = []
@@ -129,35 +253,12 @@ class SensitivityCalc(object):
         if self._gdiff_fit is not None:
             bkg_fit = []
 
-
-        for psf, exp in zip(self._psf, self._exp):
-
-            coords0 = np.meshgrid(*[skydir_cel.ra.deg, ectr], indexing='ij')
-            coords1 = np.meshgrid(*[skydir_cel.dec.deg, ectr], indexing='ij')
-
-            # expv = exp.interpolate(skydir_cel.icrs.ra.deg,
-            #                       skydir_cel.icrs.dec.deg,
-            #                       ectr)
-
-            expv = exp.interpolate(coords0[0], coords1[0], coords0[1])
-
-            coords0 = np.meshgrid(*[skydir_gal.l.deg, ectr], indexing='ij')
-            coords1 = np.meshgrid(*[skydir_gal.b.deg, ectr], indexing='ij')
-
-            bkgv = self._gdiff.interpolate(np.ravel(coords0[0]),
-                                           np.ravel(coords1[0]),
-                                           np.ravel(coords0[1]))
-            bkgv = bkgv.reshape(expv.shape)
-            
-
-            # bkgv = self._gdiff.interpolate(
-            #    skydir_gal.l.deg, skydir_gal.b.deg, ectr)
+        for psf, expv in zip(self._psf, expvs):
 
             isov = np.exp(np.interp(np.log(ectr), np.log(self._iso[0]),
                                     np.log(self._iso[1])))
-            bkgv += isov
+            bkgv = gdiffv + isov
 
-            
             s0, b0 = irfs.compute_ps_counts(ebins, expv, psf, bkgv, fn,
                                             egy_dim=1,
                                             spatial_model=self.spatial_model,
@@ -173,11 +274,7 @@ class SensitivityCalc(object):
                 isov_fit = isov
 
             if self._gdiff_fit is not None:
-                bkgv_fit = self._gdiff_fit.interpolate(np.ravel(coords0[0]),
-                                                       np.ravel(coords1[0]),
-                                                       np.ravel(coords0[1]))
-                bkgv_fit = bkgv_fit.reshape(expv.shape)
-                bkgv_fit += isov_fit
+                bkgv_fit = gdiffv_fit + isov_fit
                 s0, b0 = irfs.compute_ps_counts(ebins, expv, psf,
                                                 bkgv_fit, fn, egy_dim=1,
                                                 spatial_model=self.spatial_model,
@@ -213,7 +310,6 @@ class SensitivityCalc(object):
         sig, bkg, bkg_fit = self.compute_counts(skydir, fn)
         norms = irfs.compute_norm(sig, bkg, ts_thresh,
                                   min_counts, sum_axes=[2, 3],
-                                  rebin_axes=[10, 1],
                                   bkg_fit=bkg_fit)
 
         npred = np.squeeze(np.apply_over_axes(np.sum, norms * sig, [2, 3]))
@@ -234,46 +330,164 @@ class SensitivityCalc(object):
         position ``skydir`` with spectral parameterization ``fn``.
 
         """
+        return self.int_flux_threshold_batch(skydir, [fn], ts_thresh,
+                                             min_counts)[0]
 
-        ebins = 10**np.linspace(np.log10(self.ebins[0]),
-                                np.log10(self.ebins[-1]), 33)
+    def int_flux_threshold_batch(self, skydir, fns, ts_thresh, min_counts):
+        """Compute the integral flux threshold for a point source at
+        position ``skydir`` for each spectral parameterization in
+        ``fns``.  The thresholds of all models are solved in a single
+        pass.  Returns a list with one output dictionary per model in
+        the format of `int_flux_threshold`.
+
+        """
+
+        ebins = self._int_flux_ebins()
         ectr = np.sqrt(ebins[0] * ebins[-1])
 
-        sig, bkg, bkg_fit = self.compute_counts(skydir, fn, ebins)
+        sig, bkg, bkg_fit = self._compute_counts_batch(skydir, fns, ebins)
 
         norms = irfs.compute_norm(sig, bkg, ts_thresh,
-                                  min_counts, sum_axes=[1, 2, 3], bkg_fit=bkg_fit,
-                                  rebin_axes=[4, 10, 1])
+                                  min_counts, sum_axes=[2, 3, 4],
+                                  bkg_fit=bkg_fit)
 
-        npred = np.squeeze(np.apply_over_axes(np.sum, norms * sig, [1, 2, 3]))
-        npred = np.array(npred, ndmin=1)
-        flux = np.squeeze(norms) * fn.flux(ebins[0], ebins[-1])
-        eflux = np.squeeze(norms) * fn.eflux(ebins[0], ebins[-1])
-        dnde = np.squeeze(norms) * fn.dnde(ectr)
-        e2dnde = ectr**2 * dnde
+        sig_bins, bkg, bkg_fit = self._compute_counts_batch(skydir, fns)
+
+        output = []
+        for fn, norm, sig_fn, sig_bins_fn in zip(fns, norms, sig, sig_bins):
+
+            npred = np.squeeze(np.apply_over_axes(np.sum, norm * sig_fn,
+                                                  [1, 2, 3]))
+            npred = np.array(npred, ndmin=1)
+            flux = np.squeeze(norm) * fn.flux(ebins[0], ebins[-1])
+            eflux = np.squeeze(norm) * fn.eflux(ebins[0], ebins[-1])
+            dnde = np.squeeze(norm) * fn.dnde(ectr)
+            e2dnde = ectr**2 * dnde
+
+            o = dict(e_min=self.ebins[0], e_max=self.ebins[-1], e_ref=ectr,
+                     npred=npred, flux=flux, eflux=eflux,
+                     dnde=dnde, e2dnde=e2dnde)
+
+            npred = np.squeeze(np.apply_over_axes(np.sum, norm * sig_bins_fn,
+                                                  [2, 3]))
+            flux = np.squeeze(np.squeeze(norm, axis=(1, 2, 3))[:, None] *
+                              fn.flux(self.ebins[:-1], self.ebins[1:]))
+            eflux = np.squeeze(np.squeeze(norm, axis=(1, 2, 3))[:, None] *
+                               fn.eflux(self.ebins[:-1], self.ebins[1:]))
+            dnde = np.squeeze(np.squeeze(norm, axis=(1, 2, 3))
+                              [:, None] * fn.dnde(self.ectr))
+            e2dnde = ectr**2 * dnde
+
+            o['bins'] = dict(npred=npred,
+                             flux=flux,
+                             eflux=eflux,
+                             dnde=dnde,
+                             e2dnde=e2dnde,
+                             e_min=self.ebins[:-1], e_max=self.ebins[1:],
+                             e_ref=self.ectr)
+            output += [o]
+
+        return output
+
+    def _int_flux_ebins(self):
+        """Return the energy binning on which the integral flux
+        threshold is computed."""
+        return 10**np.linspace(np.log10(self.ebins[0]),
+                               np.log10(self.ebins[-1]), 33)
+
+    def _compute_counts_batch(self, skydir, fns, ebins=None):
+        """Compute signal and background counts for a list of spectral
+        models.  The signal counts of each model are obtained by
+        rescaling the counts of the first model in each energy bin.
+        The signal array has an additional leading dimension for the
+        spectral model and the background arrays have a leading
+        dimension of size one."""
 
-        o = dict(e_min=self.ebins[0], e_max=self.ebins[-1], e_ref=ectr,
-                 npred=npred, flux=flux, eflux=eflux,
-                 dnde=dnde, e2dnde=e2dnde)
+        if ebins is None:
+            ebins = self.ebins
 
-        sig, bkg, bkg_fit = self.compute_counts(skydir, fn)
+        sig, bkg, bkg_fit = self.compute_counts(skydir, fns[0], ebins)
+        flux0 = fns[0].flux(ebins[:-1], ebins[1:])
+        sig = np.concatenate([sig[np.newaxis] *
+                              (fn.flux(ebins[:-1], ebins[1:]) /
+                               flux0)[:, np.newaxis, np.newaxis]
+                              for fn in fns])
+        bkg = bkg[np.newaxis]
+        if bkg_fit is not None:
+            bkg_fit = bkg_fit[np.newaxis]
+        return sig, bkg, bkg_fit
 
-        npred = np.squeeze(np.apply_over_axes(np.sum, norms * sig,
-                                              [2, 3]))
-        flux = np.squeeze(np.squeeze(norms, axis=(1, 2, 3))[:, None] *
-                          fn.flux(self.ebins[:-1], self.ebins[1:]))
-        eflux = np.squeeze(np.squeeze(norms, axis=(1, 2, 3))[:, None] *
-                           fn.eflux(self.ebins[:-1], self.ebins[1:]))
-        dnde = np.squeeze(np.squeeze(norms, axis=(1, 2, 3))
-                          [:, None] * fn.dnde(self.ectr))
-        e2dnde = ectr**2 * dnde
-
-        o['bins'] = dict(npred=npred,
-                         flux=flux,
-                         eflux=eflux,
-                         dnde=dnde,
-                         e2dnde=e2dnde,
-                         e_min=self.ebins[:-1], e_max=self.ebins[1:],
-                         e_ref=self.ectr)
-
-        return o
+    def iter_flux_threshold(self, skydir, fn, ts_thresh, min_counts,
+                            method='int_flux_threshold', nstep=500,
+                            nthread=1):
+        """Evaluate the flux threshold at each position in ``skydir``
+        in chunks of ``nstep`` positions.  This is a generator that
+        yields a tuple of the slice of ``skydir`` and the output
+        dictionary of ``method`` for each chunk as soon as it
+        completes.  When ``nthread`` is greater than one the chunks are
+        distributed over a pool of forked processes and may be yielded
+        out of order.
+
+        Parameters
+        ----------
+        skydir : `~astropy.coordinates.SkyCoord`
+            Sky coordinates at which the sensitivity will be evaluated.
+
+        fn : `~fermipy.spectrum.SpectralFunction`
+
+        ts_thresh : float
+            Threshold on the detection test statistic (TS).
+
+        min_counts : float
+            Threshold on the minimum number of counts.
+
+        method : str
+            Name of the threshold method
+            (``diff_flux_threshold`` or ``int_flux_threshold``).
+
+        nstep : int
+            Number of sky positions per chunk.
+
+        nthread : int
+            Number of processes.  If None then one process will be
+            created for each available core.
+        """
+        global _SENS_MAP_ARGS
+
+        if method not in ['diff_flux_threshold', 'int_flux_threshold']:
+            raise ValueError('Unrecognized method: %s' % method)
+
+        npos = len(skydir)
+        slices = [slice(i, min(i + nstep, npos))
+                  for i in range(0, npos, nstep)]
+
+        if nthread is None:
+            nthread = multiprocessing.cpu_count()
+        nthread = max(min(nthread, len(slices)), 1)
+
+        if nthread == 1:
+            for s in slices:
+                yield s, getattr(self, method)(skydir[s], fn, ts_thresh,
+                                               min_counts)
+            return
+
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except AttributeError:
+            ctx = multiprocessing
+
+        # Build the lookup tables before forking so that they are
+        # shared by all workers
+        self.build_lookup_tables()
+        if method == 'int_flux_threshold':
+            self.build_lookup_tables(self._int_flux_ebins())
+
+        _SENS_MAP_ARGS = (self, method, skydir, fn, ts_thresh, min_counts)
+        pool = ctx.Pool(processes=nthread)
+        try:
+            for s, o in pool.imap_unordered(_flux_threshold_worker, slices):
+                yield s, o
+        finally:
+            pool.terminate()
+            pool.join()
+            _SENS_MAP_ARGS = None
@@ -476,11 +476,12 @@ class HpxMap(Map_Base):
         return self.hpx.make_hdu(self.counts, **kwargs)
 
     def make_wcs_from_hpx(self, sum_ebins=False, proj='CAR', oversample=2,
-                          normalize=True):
+                          normalize=True, cachedir=None):
         """Make a WCS object and convert HEALPix data into WCS projection
 
-        NOTE: this re-calculates the mapping, if you have already
-        calculated the mapping it is much faster to use
+        NOTE: the mapping is reused if it was previously computed for
+        the same HEALPix and WCS projections.  If you have already
+        made the mapping for this map it is faster to use
         convert_to_cached_wcs() instead
 
         Parameters
@@ -497,13 +498,17 @@ class HpxMap(Map_Base):
         normalize  : bool
            True -> perserve integral by splitting HEALPix values between bins
 
+        cachedir   : str
+           Directory used to cache the HEALPix to WCS mapping on disk
+
         returns (WCS object, np.ndarray() with reprojected data)
 
         """
         self._wcs_proj = proj
         self._wcs_oversample = oversample
         self._wcs_2d = self.hpx.make_wcs(2, proj=proj, oversample=oversample)
-        self._hpx2wcs = HpxToWcsMapping(self.hpx, self._wcs_2d)
+        self._hpx2wcs = HpxToWcsMapping.create(self.hpx, self._wcs_2d,
+                                               cachedir=cachedir)
         wcs, wcs_data = self.convert_to_cached_wcs(self.counts, sum_ebins,
                                                    normalize)
         return wcs, wcs_data
@@ -712,8 +717,8 @@ class HpxMap(Map_Base):
                     nz = summed.nonzero()[0]
                 else:
                     nz = pixels
-                data_out = np.vstack(self.data[i].flat[nz]
-                                     for i in range(self.data.shape[0]))
+                data_out = np.vstack([self.data[i].flat[nz]
+                                      for i in range(self.data.shape[0])])
             else:
                 if pixels is None:
                     nz = self.data.nonzero()[0]
@@ -732,7 +737,7 @@ class HpxMap(Map_Base):
         """ return a counts map with sparse index scheme
         """
         if self.hpx._ipix is None:
-            flatarray = self.data.flattern()
+            flatarray = self.data.flatten()
         else:
             flatarray = self.expanded_counts_map()
         nz = flatarray.nonzero()[0]
@@ -767,3 +772,371 @@ class HpxMap(Map_Base):
                                                         order_out=new_hpx.ordering,
                                                         power=power) for i in range(shape[0])])
         return HpxMap(new_data, new_hpx)
+
+
+class SparseHpxMap(Map_Base):
+    """Sparse representation of a 2D or 3D HEALPix counts map.  Only
+    the non-zero pixels are stored as a list of global HEALPix pixel
+    indices, energy plane indices and values.  The entries are kept
+    sorted by energy plane and then by pixel index with no
+    duplicates.  The ``counts`` of this map are the array of stored
+    values."""
+
+    def __init__(self, pix, vals, hpx, chan=None):
+        """C'tor
+
+        Parameters
+        ----------
+        pix  : `~numpy.ndarray`
+            Global HEALPix pixel indices.  Duplicate entries are summed.
+
+        vals : `~numpy.ndarray`
+            Map values.
+
+        hpx  : `~fermipy.hpx_utils.HPX`
+            All-sky HEALPix projection of this map.
+
+        chan : `~numpy.ndarray`
+            Energy plane indices.  Only used for maps with an energy
+            axis.
+        """
+        if hpx._ipix is not None:
+            raise ValueError('SparseHpxMap requires an all-sky HPX object')
+
+        self._hpx = hpx
+        if hpx.evals is None:
+            self._nebin = None
+            chan = np.zeros(len(pix), dtype=int)
+        else:
+            self._nebin = len(hpx.evals)
+
+        keys = (np.asarray(chan, dtype=np.int64) * hpx.npix +
+                np.asarray(pix, dtype=np.int64))
+        keys, vals = self._coalesce(keys, np.asarray(vals))
+        super(SparseHpxMap, self).__init__(vals)
+        self._keys = keys
+
+    @staticmethod
+    def _coalesce(keys, vals):
+        """Sort the entries by key, sum entries with the same key and
+        drop zeros."""
+        if len(keys) == 0:
+            return keys, vals
+        ukeys, inverse = np.unique(keys, return_inverse=True)
+        if len(ukeys) < len(keys):
+            vals = np.bincount(inverse.ravel(), weights=vals,
+                               minlength=len(ukeys)).astype(vals.dtype)
+        else:
+            vals = vals[np.argsort(keys, kind='mergesort')]
+        m = vals != 0
+        return ukeys[m], vals[m]
+
+    @property
+    def hpx(self):
+        return self._hpx
+
+    @property
+    def pix(self):
+        """Global HEALPix pixel indices of the non-zero pixels."""
+        return self._keys % self.hpx.npix
+
+    @property
+    def chan(self):
+        """Energy plane indices of the non-zero pixels."""
+        return self._keys // self.hpx.npix
+
+    @property
+    def nebin(self):
+        return self._nebin
+
+    @property
+    def shape(self):
+        """Shape of the equivalent dense array."""
+        if self._nebin is None:
+            return (self.hpx.npix,)
+        return (self._nebin, self.hpx.npix)
+
+    @property
+    def nnz(self):
+        """Number of stored (non-zero) pixels."""
+        return len(self._keys)
+
+    @classmethod
+    def create_from_hpxmap(cls, hpxmap):
+        """Create a sparse map from a `~fermipy.skymap.HpxMap`."""
+        pix, vals = hpxmap.explicit_counts_map()
+        hpx = hpxmap.hpx
+        hpx_out = HPX.create_hpx(hpx.nside, hpx.nest, hpx.coordsys, -1,
+                                 hpx.ebins, None, hpx.conv, None)
+        if vals.ndim == 1:
+            m = vals != 0
+            return cls(pix[m], vals[m], hpx_out)
+
+        chan, idx = vals.nonzero()
+        return cls(pix[idx], vals[chan, idx], hpx_out, chan)
+
+    @classmethod
+    def create_from_hdu(cls, hdu, ebins):
+        """Creates and returns a SparseHpxMap object from a FITS HDU.
+        For maps stored with a dense convention the columns are
+        converted one at a time so that the full cube is never
+        loaded in memory.
+
+        hdu    : The FITS HDU
+        ebins  : Energy bin edges [optional]
+        """
+        hpx = HPX.create_from_hdu(hdu, ebins)
+        hpx_out = HPX.create_hpx(hpx.nside, hpx.nest, hpx.coordsys, -1,
+                                 hpx.ebins, None, hpx.conv, None)
+
+        if hpx.conv.convname == 'FGST_SRCMAP_SPARSE':
+            pix = hdu.data.field('PIX')
+            vals = hdu.data.field('VALUE')
+            if 'CHANNEL' in hdu.columns.names:
+                chan = hdu.data.field('CHANNEL')
+            else:
+                chan = None
+            return cls(pix, vals, hpx_out, chan)
+
+        cnames = [c for c in hdu.columns.names
+                  if c.find(hpx.conv.colstring) == 0]
+        pixs, chans, vals = [], [], []
+        for i, cname in enumerate(cnames):
+            col = hdu.data.field(cname)
+            nz = col.nonzero()[0]
+            pix = nz if hpx._ipix is None else hpx._ipix[nz]
+            pixs += [pix]
+            chans += [np.full(len(nz), i, dtype=int)]
+            vals += [col[nz]]
+
+        pix = np.concatenate(pixs)
+        vals = np.concatenate(vals)
+        chan = np.concatenate(chans) if hpx_out.evals is not None else None
+        return cls(pix, vals, hpx_out, chan)
+
+    @classmethod
+    def create_from_hdulist(cls, hdulist, **kwargs):
+        """ Creates and returns a SparseHpxMap object from a FITS HDUList
+
+        extname : The name of the HDU with the map data
+        ebounds : The name of the HDU with the energy bin data
+        """
+        extname = kwargs.get('hdu', hdulist[1].name)
+        ebins = fits_utils.find_and_read_ebins(hdulist)
+        return cls.create_from_hdu(hdulist[extname], ebins)
+
+    @classmethod
+    def create_from_fits(cls, fitsfile, **kwargs):
+        hdulist = fits.open(fitsfile)
+        return cls.create_from_hdulist(hdulist, **kwargs)
+
+    def create_image_hdu(self, name=None, **kwargs):
+        """Make a FITS HDU with the sparse (FGST_SRCMAP_SPARSE)
+        convention.  The map is not expanded to a dense array."""
+        extname = kwargs.get('extname', name)
+        hpx = self.hpx
+        hpx_sparse = HPX.create_hpx(hpx.nside, hpx.nest, hpx.coordsys, -1,
+                                    hpx.ebins, None,
+                                    hpx_utils.HPX_FITS_CONVENTIONS[
+                                        'FGST_SRCMAP_SPARSE'], None)
+        cols = [fits.Column("PIX", "J", array=self.pix.astype(np.int32))]
+        if self._nebin is not None:
+            cols.append(fits.Column("CHANNEL", "I",
+                                    array=self.chan.astype(np.int16)))
+        cols.append(fits.Column("VALUE", "E",
+                                array=self.counts.astype(np.float32)))
+        header = hpx_sparse.make_header()
+        return fits.BinTableHDU.from_columns(cols, header=header,
+                                             name=extname)
+
+    def to_dense(self):
+        """Expand this map to a dense `~fermipy.skymap.HpxMap`."""
+        data = np.zeros(self.shape, dtype=self.counts.dtype)
+        data.flat[self._keys] = self.counts
+        return HpxMap(data, self.hpx)
+
+    def get_pixel_indices(self, lats, lons):
+        """Return the indices in the flat array corresponding to a set of coordinates """
+        return self._hpx.get_pixel_indices(lats, lons)
+
+    def get_pixel_values(self, pix, ibin=None):
+        """Look up the values of a set of global HEALPix pixels.
+
+        Parameters
+        ----------
+        pix  : array-like
+           Global HEALPix pixel indices.
+
+        ibin : int or array-like
+           Energy plane indices.  None -> look up all planes, the
+           energy plane is the first dimension of the output.
+        """
+        pix = np.asarray(pix, dtype=np.int64)
+        if self._nebin is None:
+            keys = pix
+        elif ibin is None:
+            keys = (np.arange(self._nebin).reshape((-1,) + (1,) * pix.ndim) *
+                    self.hpx.npix + pix)
+        else:
+            keys = np.asarray(ibin, dtype=np.int64) * self.hpx.npix + pix
+
+        vals = np.zeros(keys.shape, dtype=self.counts.dtype)
+        if self.nnz == 0:
+            return vals
+        idx = np.searchsorted(self._keys, keys)
+        idx[idx == self.nnz] = 0
+        m = self._keys[idx] == keys
+        vals[m] = self.counts[idx[m]]
+        return vals
+
+    def get_map_values(self, lons, lats, ibin=None):
+        """Return the map values corresponding to a set of coordinates
+
+        Parameters
+        ----------
+        lons  : array-like
+           'Longitudes' (RA or GLON)
+
+        lats  : array-like
+           'Latitidues' (DEC or GLAT)
+
+        ibin : int or array-like
+           Extract data only for a given energy bin.  None -> extract data for all bins
+
+        Returns
+        ----------
+        vals : numpy.ndarray((n))
+           Values of pixels in the map
+        """
+        theta = np.pi / 2. - np.radians(lats)
+        phi = np.radians(lons)
+        pix = hp.ang2pix(self.hpx.nside, theta, phi, nest=self.hpx.nest)
+        return self.get_pixel_values(pix, ibin)
+
+    def interpolate(self, lon, lat, egy=None, interp_log=True):
+        """Interpolate map values.  Uses the same bilinear HEALPix
+        interpolation as `~fermipy.skymap.HpxMap.interpolate`.
+
+        Parameters
+        ----------
+        interp_log : bool
+            Interpolate the z-coordinate in logspace.
+
+        """
+        shape = np.broadcast(lon, lat, egy).shape
+        lon = lon * np.ones(shape)
+        lat = lat * np.ones(shape)
+        theta = np.pi / 2. - np.radians(lat)
+        phi = np.radians(lon)
+        pix, wts = hp.get_interp_weights(self.hpx.nside, theta, phi,
+                                         nest=self.hpx.nest)
+
+        if self._nebin is None:
+            return np.sum(self.get_pixel_values(pix) * wts, axis=0)
+
+        vals = np.sum(self.get_pixel_values(pix) * wts, axis=1)
+        if egy is None:
+            return vals
+
+        egy = egy * np.ones(shape)
+        if interp_log:
+            xvals = utils.val_to_pix(np.log(self.hpx.evals), np.log(egy))
+        else:
+            xvals = utils.val_to_pix(self.hpx.evals, egy)
+
+        vals = np.moveaxis(vals, 0, -1).reshape((-1, self._nebin))
+        xvals = np.ravel(xvals)
+        v = map_coordinates(vals, [np.arange(vals.shape[0]), xvals],
+                            order=1)
+        return v.reshape(shape)
+
+    def sum_over_energy(self):
+        """ Reduce a counts cube to a counts map """
+        return SparseHpxMap(self.pix, self.counts,
+                            self.hpx.copy_and_drop_energy())
+
+    def ud_grade(self, order, preserve_counts=False):
+        """Upgrade or degrade the resolution of this map.  This follows
+        the conventions of `healpy.pixelfunc.ud_grade`: when
+        degrading pixel values are averaged (or summed if
+        ``preserve_counts`` is True), when upgrading pixel values
+        are copied (or split evenly if ``preserve_counts`` is
+        True).
+
+        Parameters
+        ----------
+        order : int
+            HEALPix order of the output map.
+
+        preserve_counts : bool
+            Preserve the integral of the map.
+        """
+        new_hpx = self.hpx.ud_graded_hpx(order)
+        dorder = order - self.hpx.order
+
+        pix = self.pix
+        chan = self.chan if self._nebin is not None else None
+        vals = self.counts.astype(float)
+        if not self.hpx.nest:
+            pix = hp.ring2nest(self.hpx.nside, pix)
+
+        if dorder < 0:
+            pix = pix >> (-2 * dorder)
+            if not preserve_counts:
+                vals = vals / 4**(-dorder)
+        elif dorder > 0:
+            nsub = 4**dorder
+            pix = ((pix << (2 * dorder))[:, np.newaxis] +
+                   np.arange(nsub)).ravel()
+            vals = np.repeat(vals, nsub)
+            if chan is not None:
+                chan = np.repeat(chan, nsub)
+            if preserve_counts:
+                vals = vals / nsub
+
+        if not self.hpx.nest:
+            pix = hp.nest2ring(new_hpx.nside, pix)
+
+        return SparseHpxMap(pix, vals, new_hpx, chan)
+
+    def coadd(self, other, preserve_counts=True):
+        """Add one or more sparse maps to this one and return the
+        result.  Maps with a lower resolution are first upgraded to the
+        resolution of this map.
+
+        Parameters
+        ----------
+        other : `~fermipy.skymap.SparseHpxMap` or list
+            Map or list of maps to add.
+
+        preserve_counts : bool
+            Preserve the integral of the other maps when upgrading them.
+        """
+        if isinstance(other, SparseHpxMap):
+            other = [other]
+
+        keys = [self._keys]
+        vals = [self.counts]
+        for m in other:
+            if m.hpx.nest != self.hpx.nest:
+                raise ValueError('SparseHpxMap.coadd: HEALPix ordering '
+                                 'schemes do not match.')
+            if m.nebin != self.nebin:
+                raise ValueError('SparseHpxMap.coadd: number of energy '
+                                 'planes do not match: %s, %s' %
+                                 (self.nebin, m.nebin))
+            if m.hpx.nside < self.hpx.nside:
+                m = m.ud_grade(self.hpx.order, preserve_counts)
+            elif m.hpx.nside > self.hpx.nside:
+                raise ValueError('SparseHpxMap.coadd: cannot add a map with '
+                                 'higher resolution.')
+            keys += [m._keys]
+            vals += [m.counts]
+
+        keys = np.concatenate(keys)
+        vals = np.concatenate(vals)
+        chan = keys // self.hpx.npix if self._nebin is not None else None
+        return SparseHpxMap(keys % self.hpx.npix, vals, self.hpx, chan)
+
+    def __add__(self, other):
+        return self.coadd(other)
@@ -5,6 +5,7 @@ import json
 import copy
 import pprint
 import logging
+import multiprocessing
 import numpy as np
 from astropy.io import fits
 from astropy.coordinates import SkyCoord
@@ -25,6 +26,16 @@ from fermipy.model_utils import get_function_norm_par_name
 from LikelihoodState import LikelihoodState
 import pyLikelihood as pyLike
 
+_LOC_SCAN_ARGS = None
+
+
+def _scan_position_worker(pos):
+    """Evaluate a block of scan positions in a worker process.  The
+    analysis object is inherited from the parent when the worker is
+    forked."""
+    gta, name, kwargs = _LOC_SCAN_ARGS
+    return gta._scan_position_points(name, pos[0], pos[1], **kwargs)
+
 
 class SourceFind(object):
     """Mixin class which provides source-finding functionality to
@@ -592,6 +603,10 @@ class SourceFind(object):
         use_cache = kwargs.get('use_cache', True)
         use_pylike = kwargs.get('use_pylike', False)
         optimizer = kwargs.get('optimizer', {})
+        template_stack = kwargs.get('template_stack', False)
+        multithread = kwargs.get('multithread', False)
+        nthread = kwargs.get('nthread', None)
+        refine = kwargs.get('refine', 0)
 
         # Fit without source
         self.zero_source(name, loglevel=logging.DEBUG)
@@ -601,27 +616,53 @@ class SourceFind(object):
         saved_state.restore()
         self.free_norm(name, loglevel=logging.DEBUG)
 
-        lnlmap = WcsNDMap.create(skydir=skydir, binsz=scan_cdelt, npix=(nstep, nstep),
-                                 coordsys=wcs_utils.get_coordsys(self.geom.wcs))
-
         src = self.roi.copy_source(name)
 
         if use_cache and not use_pylike:
             self._create_srcmap_cache(src.name, src)
 
-        coord = MapCoord.create(lnlmap.geom.get_coord(flat=True),
-                                coordsys=lnlmap.geom.coordsys)
-        scan_skydir = coord.skycoord.icrs
-        for lon, lat, ra, dec in zip(coord.lon, coord.lat,
-                                     scan_skydir.ra.deg, scan_skydir.dec.deg):
-
-            spatial_pars = {'ra': ra, 'dec': dec}
-            self.set_source_morphology(name,
-                                       spatial_pars=spatial_pars,
-                                       use_pylike=use_pylike)
-            fit_output = self._fit(loglevel=logging.DEBUG,
-                                   **optimizer)
-            lnlmap.set_by_coord((lon, lat), fit_output['loglike'])
+        if multithread and use_pylike:
+            self.logger.warning('Parallel position scan requires '
+                                'use_pylike=False.  Scanning serially.')
+            multithread = False
+
+        for i in range(refine + 1):
+
+            lnlmap = WcsNDMap.create(skydir=skydir, binsz=scan_cdelt,
+                                     npix=(nstep, nstep),
+                                     coordsys=wcs_utils.get_coordsys(self.geom.wcs))
+            coord = MapCoord.create(lnlmap.geom.get_coord(flat=True),
+                                    coordsys=lnlmap.geom.coordsys)
+            scan_skydir = coord.skycoord.icrs
+
+            if multithread:
+                loglike = self._scan_position_parallel(name,
+                                                       scan_skydir.ra.deg,
+                                                       scan_skydir.dec.deg,
+                                                       nthread=nthread,
+                                                       src=src,
+                                                       use_pylike=use_pylike,
+                                                       optimizer=optimizer,
+                                                       template_stack=template_stack)
+            else:
+                loglike = self._scan_position_points(name,
+                                                     scan_skydir.ra.deg,
+                                                     scan_skydir.dec.deg,
+                                                     src=src,
+                                                     use_pylike=use_pylike,
+                                                     optimizer=optimizer,
+                                                     template_stack=template_stack)
+
+            lnlmap.set_by_coord((coord.lon, coord.lat), loglike)
+
+            # Recenter the grid on the peak and halve the grid spacing
+            if i < refine:
+                skydir = scan_skydir[np.argmax(loglike)]
+                scan_cdelt *= 0.5
+                self.logger.debug('Refining position scan around '
+                                  '(ra,dec) = (%10.4f,%10.4f) with '
+                                  'spacing %.4f deg',
+                                  skydir.ra.deg, skydir.dec.deg, scan_cdelt)
 
         self.set_source_morphology(name, spatial_pars=src.spatial_pars,
                                    use_pylike=use_pylike)
@@ -633,6 +674,70 @@ class SourceFind(object):
         self._clear_srcmap_cache()
         return tsmap, fit_output_nosrc['loglike']
 
+    def _scan_position_points(self, name, ra, dec, **kwargs):
+        """Evaluate the likelihood with the source of interest moved
+        to each of the positions (ra, dec)."""
+
+        src = kwargs.get('src', self.roi[name])
+        use_pylike = kwargs.get('use_pylike', False)
+        optimizer = kwargs.get('optimizer', {})
+        template_stack = kwargs.get('template_stack', False)
+
+        if (template_stack and not use_pylike and
+                hasattr(pyLike.BinnedLikelihood, 'setSourceMapImage')):
+            srcs = []
+            for ra_i, dec_i in zip(ra, dec):
+                s = copy.deepcopy(src)
+                s.set_radec(ra_i, dec_i)
+                srcs += [s]
+            return self._scan_srcmap_stack(name, srcs, optimizer=optimizer)
+
+        loglike = np.zeros(len(ra))
+        for i, (ra_i, dec_i) in enumerate(zip(ra, dec)):
+
+            spatial_pars = {'ra': ra_i, 'dec': dec_i}
+            self.set_source_morphology(name,
+                                       spatial_pars=spatial_pars,
+                                       use_pylike=use_pylike)
+            fit_output = self._fit(loglevel=logging.DEBUG,
+                                   **optimizer)
+            loglike[i] = fit_output['loglike']
+
+        return loglike
+
+    def _scan_position_parallel(self, name, ra, dec, nthread=None,
+                                **kwargs):
+        """Split the scan positions into blocks and evaluate each block
+        with `_scan_position_points` in a separate process.  Workers
+        are forked after the model has been prepared and inherit a
+        copy of the likelihood state."""
+        global _LOC_SCAN_ARGS
+
+        if nthread is None:
+            nthread = multiprocessing.cpu_count()
+        nthread = max(min(nthread, len(ra)), 1)
+        blocks = [(ra[idx], dec[idx]) for idx in
+                  np.array_split(np.arange(len(ra)), nthread)]
+
+        try:
+            ctx = multiprocessing.get_context('fork')
+        except AttributeError:
+            ctx = multiprocessing
+
+        self.logger.debug('Scanning %i positions with %i processes.',
+                          len(ra), nthread)
+
+        _LOC_SCAN_ARGS = (self, name, kwargs)
+        pool = ctx.Pool(processes=nthread)
+        try:
+            loglike = pool.map(_scan_position_worker, blocks)
+        finally:
+            pool.close()
+            pool.join()
+            _LOC_SCAN_ARGS = None
+
+        return np.concatenate(loglike)
+
     def _fit_position_opt(self, name, use_cache=True):
 
         state = SourceMapState(self.like, [name])
@@ -1,6 +1,9 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
+import os
 import copy
+import re
+import hashlib
 import numpy as np
 from scipy.ndimage import map_coordinates
 from scipy.ndimage.interpolation import spline_filter
@@ -426,3 +429,181 @@ def update_source_maps(srcmap_file, srcmaps, logger=None):
             hdulist[name].data[...] = data
 
         hdulist.writeto(srcmap_file, clobber=True)
+
+
+def hash_file(path, blocksize=2**20):
+    """Compute the SHA1 hash of the contents of a file."""
+
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Header keywords that do not affect the contents of a FITS file
+HASH_IGNORE_KEYWORDS = ['DATE', 'CHECKSUM', 'DATASUM', 'CREATOR',
+                        'FILENAME', 'HISTORY', 'COMMENT']
+
+
+def hash_fits_data(path):
+    """Compute the SHA1 hash of the data arrays and header keywords of
+    all HDUs of a FITS file.  Keywords that do not describe the
+    contents of the file (e.g. DATE or CHECKSUM) are ignored such that
+    files with identical contents that were written at different
+    times have the same hash."""
+
+    h = hashlib.sha1()
+    with fits.open(path, memmap=True) as hdulist:
+        for hdu in hdulist:
+            cards = [(k, repr(v)) for k, v in hdu.header.items()
+                     if k not in HASH_IGNORE_KEYWORDS]
+            h.update(repr(cards).encode('utf-8'))
+            if hdu.data is not None:
+                h.update(np.ascontiguousarray(hdu.data).tobytes())
+    return h.hexdigest()
+
+
+# Prefixes of the header keywords that define the geometry of a
+# counts cube (WCS and HEALPix)
+GEOM_KEYWORDS = ['NAXIS', 'CTYPE', 'CRVAL', 'CRPIX', 'CDELT', 'CROTA',
+                 'CUNIT', 'EQUIN', 'RADES', 'LONPO', 'LATPO', 'PV2_1',
+                 'PV2_2', 'PIXTY', 'ORDER', 'NSIDE', 'COORD', 'HPX_C',
+                 'HPX_R', 'INDXS', 'FIRST', 'LASTP']
+
+
+class SourceMapFileCache(object):
+    """Content-addressed on-disk cache of source maps.  Each source map
+    is stored as a numpy file whose name is the hash of all inputs
+    that determine the map (source spatial parameters, IRFs, event
+    type, LT cube, exposure map, and map geometry).  When the total
+    size of the cache exceeds ``max_size`` the least recently used
+    maps are removed.
+
+    A cached map is only returned for a counts cube with exactly the
+    same geometry (projection, reference point, and pixelization) as
+    the map from which it was computed such that a cache hit is
+    identical to the output of gtsrcmaps."""
+
+    def __init__(self, cachedir, max_size=None):
+        """
+        Parameters
+        ----------
+        cachedir : str
+            Path to the cache directory.
+
+        max_size : float
+            Maximum size of the cache in bytes.  If None the size of
+            the cache is unbounded.
+        """
+        self._cachedir = cachedir
+        self._max_size = max_size
+        utils.mkdir(cachedir)
+
+    @property
+    def cachedir(self):
+        return self._cachedir
+
+    @staticmethod
+    def make_key(*args):
+        """Create a cache key by hashing a sequence of values."""
+        h = hashlib.sha1()
+        for arg in args:
+            h.update(repr(arg).encode('utf-8'))
+        return h.hexdigest()
+
+    @staticmethod
+    def make_source_key(src):
+        """Create the part of a cache key that depends on the spatial
+        properties of a source.  Returns None for sources that cannot
+        be cached (e.g. diffuse sources)."""
+
+        if src.diffuse:
+            return None
+
+        key = [src['SpatialModel'], src['SpatialType'],
+               '%.6f' % src['ra'], '%.6f' % src['dec'],
+               src['SpatialWidth']]
+
+        filename = src['Spatial_Filename']
+        if filename:
+            filename = os.path.expandvars(filename)
+            if not os.path.isfile(filename):
+                return None
+            key += [hash_file(filename)]
+
+        return key
+
+    @staticmethod
+    def make_geom_key(header):
+        """Create the part of a cache key that depends on the geometry
+        of a counts cube.  The key contains all header keywords that
+        define the projection, reference point, and pixelization of
+        the cube.
+
+        Parameters
+        ----------
+        header : `~astropy.io.fits.Header`
+            Header of the counts cube.
+        """
+        return [(k, header[k]) for k in header
+                if k[:5] in GEOM_KEYWORDS or re.match(r'(PC|CD)\d', k)]
+
+    def _get_path(self, key):
+        return os.path.join(self.cachedir, key + '.npz')
+
+    def get(self, key):
+        """Return the source map for the given key or None if it is
+        not present in the cache."""
+
+        path = self._get_path(key)
+        if not os.path.isfile(path):
+            return None
+
+        try:
+            with np.load(path) as f:
+                data = f['data']
+        except (IOError, ValueError, KeyError):
+            return None
+
+        # Update access time for LRU eviction
+        os.utime(path, None)
+        return data
+
+    def put(self, key, data):
+        """Add a source map to the cache."""
+
+        path = self._get_path(key)
+        tmppath = path + '.%i.tmp' % os.getpid()
+        with open(tmppath, 'wb') as f:
+            np.savez(f, data=data)
+        os.rename(tmppath, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used maps until the size of the cache
+        is below the size limit."""
+
+        if self._max_size is None:
+            return
+
+        files = []
+        for f in os.listdir(self.cachedir):
+            if not f.endswith('.npz'):
+                continue
+            path = os.path.join(self.cachedir, f)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files += [(st.st_mtime, st.st_size, path)]
+
+        size = sum([t[1] for t in files])
+        for mtime, fsize, path in sorted(files):
+            if size <= self._max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= fsize
@@ -1,6 +1,7 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
 import os
+import warnings
 import numpy as np
 from numpy.testing import assert_allclose
 from astropy.tests.helper import pytest
@@ -80,3 +81,47 @@ def test_fit_dmfitfunction(sedfile):
 
     assert_allclose(fit_out['ts_spec'], 17.14991598, atol=0.01)
     assert_allclose(fit_out['params'][0], 2.98000000e-25, rtol=0.05)
+
+
+def test_stacked_interpolator():
+
+    x = np.linspace(0.0, 1.0, 11)[None, :] * np.array([[1.0], [2.0], [3.0]])
+    y = (x - 0.5)**2
+    y[1, 4] = np.nan
+
+    interp = castro.StackedInterpolator(x, y)
+    xv = np.array([[-0.5, 0.25, 0.5, 1.5],
+                   [0.0, 0.7, 2.0, 3.0],
+                   [0.3, 1.3, 2.5, 3.5]])
+
+    vals = interp(xv)
+    ders = interp.derivative(xv)
+    for i in range(3):
+        fn = castro.Interpolator(x[i], y[i])
+        assert_allclose(vals[i], fn(xv[i]))
+        assert_allclose(ders[i], fn.derivative(xv[i]))
+
+
+def test_stack_nll():
+
+    norm = np.linspace(0.0, 2.0, 21)
+    components = []
+    for i, ny in enumerate([21, 12, 8, 21]):
+        norm_vals = np.tile(norm[:ny], (3, 1)) * (i + 1)
+        nll_vals = (norm_vals - 0.4 * (i + 1))**2
+        components += [castro.CastroData_Base(norm_vals, nll_vals, 'norm')]
+
+    # Components with different numbers of sampled values are padded
+    # without raising warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        norm_vals, nll_vals = castro.CastroData_Base.stack_nll(
+            (3, 15), components, [0.1, 5.0], chunk_size=3)
+
+    nll_ref = np.zeros((3, 15))
+    for c in components:
+        for j in range(3):
+            fn = castro.Interpolator(c._norm_vals[j], c._nll_vals[j])
+            nll_ref[j] += fn(norm_vals[j])
+    nll_ref -= np.min(nll_ref, axis=1)[:, None]
+    assert_allclose(nll_vals, nll_ref, rtol=1E-10, atol=1E-10)
@@ -278,6 +278,20 @@ def test_gtanalysis_extension_gaussian(create_draco_analysis):
     gta.simulate_roi(restore=True)
 
 
+def test_gtanalysis_extension_parallel(create_draco_analysis):
+    gta = create_draco_analysis
+    gta.load_roi('fit1')
+
+    kw = dict(width=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6],
+              spatial_model='RadialGaussian', optimizer={},
+              reoptimize=True)
+    loglike = gta._scan_extension('draco', **kw)
+    for nthread in [1, 2, 3]:
+        loglike_mt = gta._scan_extension('draco', multithread=True,
+                                         nthread=nthread, **kw)
+        assert_allclose(loglike_mt, loglike, rtol=1E-10)
+
+
 def test_gtanalysis_localization(create_draco_analysis):
     gta = create_draco_analysis
     gta.simulate_roi(restore=True)
@@ -108,6 +108,73 @@ def test_psfmodel():
                               0.09070837,  0.08331364]), rtol=1E-3)
 
 
+def test_psfmodel_cache():
+
+    ltc = irfs.LTCube.create_from_obs_time(3.1536E8)
+    log_energies = np.linspace(2.0, 6.0, 17)
+    c0 = SkyCoord(10.0, 10.0, unit='deg')
+    c1 = SkyCoord(10.01, 10.01, unit='deg')
+
+    irfs.clear_psf_model_cache()
+    psf0 = irfs.PSFModel.create(c0, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                                10**log_energies, ndtheta=400)
+    psf1 = irfs.PSFModel.create(c1, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                                10**log_energies, ndtheta=400)
+    psf2 = irfs.PSFModel.create(c0, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                                10**log_energies, ndtheta=400, cache=False)
+    psf3 = irfs.PSFModel.create(c0, ltc, 'P8R2_SOURCE_V6', ['FRONT', 'BACK'],
+                                10**log_energies, ndtheta=400,
+                                fn=spectrum.PowerLaw([1E-13, -3.0]))
+
+    assert psf1 is psf0
+    assert psf2 is not psf0
+    assert psf3 is not psf0
+    assert_allclose(psf2.val, psf0.val)
+    assert_allclose(psf2.exp, psf0.exp)
+    assert irfs.get_psf_model_cache_stats()['hits'] == 1
+
+
+def test_compute_norm():
+
+    from scipy.optimize import brentq
+
+    def ts_fn(x, s, b, b0):
+        return 2.0 * np.sum((x * s + b) * np.log((x * s + b0) / b0) - x * s)
+
+    rng = np.random.RandomState(1)
+    sig = rng.uniform(0.1, 10.0, size=(5, 4, 8))
+    sig[2] = 0.0
+    bkg = rng.uniform(10.0, 1000.0, size=(5, 4, 8))
+    bkg_fit = bkg * rng.uniform(0.9, 1.1, size=bkg.shape)
+    ts_thresh = 25.0
+
+    for b0 in [None, bkg_fit]:
+
+        norm = irfs.compute_norm(sig, bkg, ts_thresh, 0.0, sum_axes=[1, 2],
+                                 bkg_fit=b0)
+        assert norm.shape == (5, 1, 1)
+        assert np.isinf(norm[2, 0, 0])
+
+        for i in [0, 1, 3, 4]:
+            s = sig[i].ravel()
+            b = bkg[i].ravel()
+            bf = b if b0 is None else b0[i].ravel()
+            x = brentq(lambda t: ts_fn(t, s, b, bf) - ts_thresh, 0.0, 1E6,
+                       xtol=1E-12)
+            assert_allclose(norm[i, 0, 0], x, rtol=1E-5)
+
+    # Counts threshold
+    min_counts = 1E4
+    norm = irfs.compute_norm(sig, bkg, ts_thresh, min_counts, sum_axes=[1, 2])
+    assert_allclose(norm[[0, 1, 3, 4], 0, 0],
+                    min_counts / np.sum(sig[[0, 1, 3, 4]], axis=(1, 2)))
+    assert np.isinf(norm[2, 0, 0])
+
+    with pytest.warns(DeprecationWarning):
+        irfs.compute_norm(sig, bkg, ts_thresh, 0.0, sum_axes=[1, 2],
+                          rebin_axes=[2, 2])
+
+
 def test_psfmodel_edisp():
 
     ltc = irfs.LTCube.create_from_obs_time(3.1536E8)
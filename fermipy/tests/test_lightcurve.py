@@ -0,0 +1,90 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import os
+import copy
+import numpy as np
+from astropy.coordinates import SkyCoord
+from fermipy.tests.utils import requires_dependency
+from fermipy.roi_model import ROIModel
+
+try:
+    from fermipy import lightcurve
+except ImportError:
+    pass
+
+# Skip tests in this file if Fermi ST aren't available
+pytestmark = requires_dependency('Fermi ST')
+
+
+def test_lightcurve_checkpoint(tmpdir, monkeypatch):
+
+    processed = []
+
+    def process_lc_bin(itime, name, **kwargs):
+        processed.append(itime[0])
+        return {'fit_success': True, 'flux': float(itime[0])}
+
+    monkeypatch.setattr(lightcurve, '_process_lc_bin', process_lc_bin)
+
+    skydir = SkyCoord(0.0, 0.0, unit='deg')
+    roi = ROIModel(catalogs=[], skydir=skydir, src_radius=1.0)
+    roi.create_source('src', {'ra': 0.0, 'dec': 0.0,
+                              'SpectrumType': 'PowerLaw', 'Index': 2.0,
+                              'SpatialModel': 'PointSource'})
+    bin_args = dict(name='src', config={'selection': {'zmax': 90.0}},
+                    diff_sources=[], roi=roi,
+                    const_spectrum=('PowerLaw', {'Index': 2.0}))
+    kwargs = {'nbins': 3, 'free_sources': [], 'nthread': 1}
+
+    times = np.array([0.0, 10.0, 20.0, 30.0])
+    itimes = list(enumerate(zip(times[:-1], times[1:])))
+
+    def run_bins(kwargs, bin_args):
+        checkpoint_dir = str(tmpdir.join(
+            lightcurve._lc_checkpoint_hash(kwargs, bin_args)))
+        if not os.path.isdir(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+        mapo = [{} for t in itimes]
+        todo = lightcurve.LightCurve._load_lc_checkpoints(
+            'src', itimes, checkpoint_dir, mapo)
+        for itime in todo:
+            i, o = lightcurve._process_lc_bin_checkpoint(
+                itime, checkpoint_dir=checkpoint_dir, **bin_args)
+            mapo[i] = o
+        return mapo
+
+    # Interrupted run that only completed the first bin
+    checkpoint_dir = str(tmpdir.join(
+        lightcurve._lc_checkpoint_hash(kwargs, bin_args)))
+    os.makedirs(checkpoint_dir)
+    lightcurve._process_lc_bin_checkpoint(itimes[0],
+                                          checkpoint_dir=checkpoint_dir,
+                                          **bin_args)
+    assert processed == [0]
+
+    # Resume skips the completed bin
+    mapo = run_bins(kwargs, bin_args)
+    assert processed == [0, 1, 2]
+    assert [m['flux'] for m in mapo] == [0.0, 1.0, 2.0]
+
+    # Options that do not change the result of a bin reuse checkpoints
+    run_bins(dict(kwargs, nthread=4), bin_args)
+    assert processed == [0, 1, 2]
+
+    # Changing the bin options, configuration, spectrum, or model
+    # rebuilds all bins
+    run_bins(dict(kwargs, free_sources=['src']), bin_args)
+    assert processed[3:] == [0, 1, 2]
+
+    config = copy.deepcopy(bin_args['config'])
+    config['selection']['zmax'] = 100.0
+    run_bins(kwargs, dict(bin_args, config=config))
+    assert processed[6:] == [0, 1, 2]
+
+    run_bins(kwargs, dict(bin_args,
+                          const_spectrum=('PowerLaw', {'Index': 2.5})))
+    assert processed[9:] == [0, 1, 2]
+
+    roi['src'].set_spatial_model('RadialGaussian', {'SpatialWidth': 0.5})
+    run_bins(kwargs, bin_args)
+    assert processed[12:] == [0, 1, 2]
@@ -0,0 +1,93 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from astropy.io import fits
+from astropy.tests.helper import pytest
+from fermipy.hpx_utils import HPX
+from fermipy.skymap import HpxMap, SparseHpxMap
+from fermipy import merge_utils
+
+
+def make_gti_hdu(tstart, ngti):
+
+    cols = [fits.Column('START', 'D', array=np.arange(ngti) + tstart),
+            fits.Column('STOP', 'D', array=np.arange(ngti) + tstart + 0.5)]
+    hdu = fits.BinTableHDU.from_columns(cols, name='GTI')
+    hdu.header['EXPOSURE'] = ngti * 0.5
+    hdu.header['TSTOP'] = tstart + ngti
+    return hdu
+
+
+@pytest.fixture(scope='module')
+def counts_cubes(tmpdir_factory):
+
+    path = tmpdir_factory.mktemp('merge')
+    rng = np.random.RandomState(2)
+    hpx = HPX(8, False, 'GAL', ebins=np.logspace(3, 5, 5))
+
+    o = dict(hpx_files=[], wcs_files=[], hpx_counts=0.0, wcs_counts=0.0,
+             gti_start=[])
+    for i in range(5):
+
+        ngti = 3 + i
+        tstart = 100. * i
+        o['gti_start'] += list(np.arange(ngti) + tstart)
+
+        data = np.zeros((4, hpx.npix), dtype=np.float32)
+        np.add.at(data, (rng.randint(0, 4, 50), rng.randint(0, hpx.npix, 50)),
+                  1.0)
+        o['hpx_counts'] = o['hpx_counts'] + data
+        prim = fits.PrimaryHDU()
+        prim.header['DATE-END'] = 'date%i' % i
+        filename = str(path.join('hpx_%i.fits' % i))
+        fits.HDUList([prim, HpxMap(data, hpx).create_image_hdu('SKYMAP'),
+                      hpx.make_energy_bounds_hdu(),
+                      make_gti_hdu(tstart, ngti)]).writeto(filename)
+        o['hpx_files'] += [filename]
+
+        data = rng.poisson(1.0, (4, 10, 12)).astype(np.float32)
+        o['wcs_counts'] = o['wcs_counts'] + data
+        prim = fits.PrimaryHDU(data)
+        prim.header['DATE-END'] = 'date%i' % i
+        filename = str(path.join('wcs_%i.fits' % i))
+        fits.HDUList([prim, hpx.make_energy_bounds_hdu(),
+                      make_gti_hdu(tstart, ngti)]).writeto(filename)
+        o['wcs_files'] += [filename]
+
+    o['exposure'] = 0.5 * len(o['gti_start'])
+    o['tstop'] = 400. + 7
+    return o
+
+
+def check_merged_gti(hdulist, cubes):
+
+    assert_allclose(hdulist['GTI'].data['START'], cubes['gti_start'])
+    assert_allclose(hdulist['GTI'].header['EXPOSURE'], cubes['exposure'])
+    assert_allclose(hdulist['GTI'].header['TSTOP'], cubes['tstop'])
+    for hdu in hdulist:
+        assert hdu.header['DATE-END'] == 'date4'
+
+
+def test_merge_wcs_counts_cubes(counts_cubes):
+
+    for nthread in [1, 3]:
+        hdulist = merge_utils.merge_wcs_counts_cubes(counts_cubes['wcs_files'],
+                                                     nthread=nthread)
+        assert_allclose(hdulist[0].data, counts_cubes['wcs_counts'])
+        check_merged_gti(hdulist, counts_cubes)
+
+
+def test_merge_hpx_counts_cubes(counts_cubes):
+
+    for nthread in [1, 3]:
+        for sparse in [False, True]:
+            hdulist = merge_utils.merge_hpx_counts_cubes(
+                counts_cubes['hpx_files'], sparse=sparse, nthread=nthread)
+            if sparse:
+                assert hdulist['SKYMAP'].header['INDXSCHM'] == 'SPARSE'
+                m = SparseHpxMap.create_from_hdulist(hdulist).to_dense()
+            else:
+                m = HpxMap.create_from_hdulist(hdulist)
+            assert_allclose(m.counts, counts_cubes['hpx_counts'])
+            check_merged_gti(hdulist, counts_cubes)
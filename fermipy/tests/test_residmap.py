@@ -0,0 +1,84 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy.tests.utils import requires_dependency
+
+try:
+    from fermipy import residmap
+except ImportError:
+    pass
+
+# Skip tests in this file if gammapy isn't available
+pytestmark = requires_dependency('gammapy')
+
+
+def make_gauss_kernels(sigmas, npix):
+
+    x = np.arange(npix) - npix // 2
+    k = np.array([np.exp(-(x[:, np.newaxis]**2 + x[np.newaxis, :]**2) /
+                         (2.0 * s**2)) for s in sigmas])
+    return k / np.sum(k, axis=(1, 2), keepdims=True)
+
+
+def convolve_map_loop(m, k, cpix, threshold=0.001):
+    """Reference per-plane convolution with the kernel truncation of
+    the original implementation of convolve_map."""
+
+    from scipy.signal import fftconvolve
+
+    o = np.zeros(m.shape)
+    ix = int(cpix[0])
+    iy = int(cpix[1])
+    for i in range(m.shape[0]):
+
+        ks = k[i]
+        mx = ks[ix, :] > ks[ix, iy] * threshold
+        my = ks[:, iy] > ks[ix, iy] * threshold
+        nx = int(max(3, np.round(np.sum(mx) / 2.)))
+        ny = int(max(3, np.round(np.sum(my) / 2.)))
+        if ix + nx + 1 >= m.shape[1] or ix - nx < 0:
+            nx -= 1
+            ny -= 1
+
+        ks = ks[ix - nx:ix + nx + 1, iy - ny:iy + ny + 1]
+        o[i] = fftconvolve(m[i], ks, mode='same')
+
+    return o
+
+
+def test_convolve_maps():
+
+    # Mixed kernel widths such that planes are split across several
+    # transform sizes
+    sigmas = [12.0, 8.0, 5.0, 3.0, 2.0, 1.0, 0.5, 12.0]
+    npix = 101
+    cpix = [npix // 2, npix // 2]
+    k = make_gauss_kernels(sigmas, npix)
+    rng = np.random.RandomState(1)
+
+    residmap.clear_kernel_fft_cache()
+
+    # Maps smaller and larger than the kernel
+    for shape in [(60, 50), (130, 120)]:
+
+        maps = rng.poisson(2.0, size=(3, len(sigmas)) + shape).astype(float)
+        groups = residmap.make_kernel_fft(k, cpix, shape)
+        assert len(groups) > 1
+        assert_allclose(np.sort(np.concatenate([g[0] for g in groups])),
+                        np.arange(len(sigmas)))
+
+        o = residmap.convolve_maps(maps, k, cpix)
+        for j, m in enumerate(maps):
+            assert_allclose(o[j], convolve_map_loop(m, k, cpix),
+                            rtol=1E-8, atol=1E-10)
+
+        # Kernel transforms are reused across calls
+        stats = residmap.get_kernel_fft_cache_stats()
+        o1 = residmap.convolve_map(maps[0], k, cpix)
+        assert_allclose(o1, o[0])
+        stats1 = residmap.get_kernel_fft_cache_stats()
+        assert stats1['hits'] == stats['hits'] + 1
+        assert stats1['size'] == stats['size']
+
+    assert residmap.get_kernel_fft_cache_stats()['size'] == 2
@@ -2,9 +2,11 @@
 from __future__ import absolute_import, division, print_function
 import numpy as np
 from numpy.testing import assert_allclose
-from fermipy.hpx_utils import HPX
+from astropy.io import fits
+from fermipy import hpx_utils
+from fermipy.hpx_utils import HPX, HpxToWcsMapping
 from fermipy.fits_utils import write_fits_image
-from fermipy.skymap import HpxMap
+from fermipy.skymap import HpxMap, SparseHpxMap
 
 
 def test_hpxmap(tmpdir):
@@ -43,3 +45,61 @@ def test_hpx():
     ebins = np.logspace(2, 5, 8)
     hpx1 = HPX(2**3, False, 'GAL', region='DISK(110.,75.,10.)', ebins=ebins)
     assert_allclose(hpx1[hpx1._ipix], np.arange(len(hpx1._ipix)))
+
+
+def test_hpx_to_wcs_mapping(tmpdir):
+
+    hpx = HPX(2**6, False, 'GAL', region='DISK(110.,75.,10.)')
+    wcs = hpx.make_wcs(2)
+
+    cachedir = str(tmpdir)
+    m0 = HpxToWcsMapping(hpx, wcs)
+    m1 = HpxToWcsMapping.create(hpx, wcs, cachedir=cachedir)
+    assert len(tmpdir.listdir()) == 1
+
+    hpx_utils._hpx2wcs_cache.clear()
+    m2 = HpxToWcsMapping.create(hpx, wcs, cachedir=cachedir)
+
+    for m in [m1, m2]:
+        assert_allclose(m.ipixs, m0.ipixs)
+        assert_allclose(m.mult_val, m0.mult_val)
+        assert_allclose(m.lmap, m0.lmap)
+        assert m.npix == m0.npix
+
+    # Each HEALPix pixel is split evenly between its WCS pixels
+    ipix = m0.ipixs[m0.valid]
+    wsum = np.bincount(ipix, weights=m0.mult_val[m0.valid])
+    assert_allclose(wsum[np.unique(ipix)], 1.0)
+
+
+def test_sparse_hpxmap(tmpdir):
+
+    ebins = np.logspace(2, 5, 4)
+    hpx = HPX(2**4, True, 'GAL', ebins=ebins)
+    data = np.zeros((3, hpx.npix))
+    data[0, 10] = 1.0
+    data[1, [20, 1000]] = [2.0, 3.0]
+    data[2, 2000] = 4.0
+    hpx_map = HpxMap(data, hpx)
+
+    m = SparseHpxMap.create_from_hpxmap(hpx_map)
+    assert m.nnz == 4
+    assert_allclose(m.to_dense().counts, data)
+    assert_allclose(m.sum_over_energy().to_dense().counts,
+                    hpx_map.sum_over_energy().counts)
+
+    for order in [2, 6]:
+        for preserve_counts in [False, True]:
+            assert_allclose(m.ud_grade(order, preserve_counts).to_dense().counts,
+                            hpx_map.ud_grade(order, preserve_counts).counts)
+
+    m2 = m + m.ud_grade(3, True)
+    assert_allclose(m2.to_dense().counts.sum(), 2 * data.sum())
+
+    filename = str(tmpdir / 'test_sparse.fits')
+    hdulist = fits.HDUList([fits.PrimaryHDU(), m.create_image_hdu('SKYMAP'),
+                            hpx.make_energy_bounds_hdu()])
+    hdulist.writeto(filename)
+    m3 = SparseHpxMap.create_from_fits(filename)
+    assert m3.hpx.nest
+    assert_allclose(m3.to_dense().counts, data)
@@ -0,0 +1,89 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+from __future__ import absolute_import, division, print_function
+import numpy as np
+from numpy.testing import assert_allclose
+from fermipy.tests.utils import requires_dependency
+
+try:
+    from fermipy import tsmap
+except ImportError:
+    pass
+
+# Skip tests in this file if Fermi ST aren't available
+pytestmark = requires_dependency('Fermi ST')
+
+
+def make_tsmap_data(shape, kernel_shapes, seed=1):
+    """Create counts, background, and test source model maps for a set
+    of analysis components."""
+
+    rng = np.random.RandomState(seed)
+    counts, bkg, model, c0_map = [], [], [], []
+    for nebin, npix in kernel_shapes:
+
+        x = np.arange(npix) - npix // 2
+        k = np.exp(-(x[:, np.newaxis]**2 + x[np.newaxis, :]**2) / 4.0)
+        m = np.array([k / np.sum(k)] * nebin) * 20.0
+        b = 0.2 + rng.uniform(0.0, 0.5, size=(nebin,) + shape)
+
+        # Test sources on top of the background
+        mu = b.copy()
+        mu[:, 5:5 + npix, 6:6 + npix] += m
+        mu[:, 12:12 + npix, 3:3 + npix] += 2.0 * m
+        c = rng.poisson(mu).astype(float)
+
+        counts += [c]
+        bkg += [b]
+        model += [m]
+        c0_map += [tsmap.cash(c, b)]
+
+    return counts, bkg, model, c0_map
+
+
+def test_ts_value_newton_batch(tmpdir):
+
+    shape = (20, 22)
+    counts, bkg, model, c0_map = make_tsmap_data(shape, [(3, 7), (2, 5)])
+    xyrange = [range(shape[0]), range(shape[1])]
+
+    ts_ref = np.zeros(shape)
+    amp_ref = np.zeros(shape)
+    for ix in xyrange[0]:
+        for iy in xyrange[1]:
+            p = [[c.shape[0] // 2, ix, iy] for c in counts]
+            ts_ref[ix, iy], amp_ref[ix, iy], _ = tsmap._ts_value_newton(
+                p, counts, bkg, model, c0_map)
+
+    assert np.any(amp_ref > 0)
+    assert np.any(amp_ref == 0)
+
+    # Vectorized evaluation split across several batches
+    ts = np.zeros(shape)
+    amp = np.zeros(shape)
+    batches = tsmap._make_pixel_batches(xyrange, model, max_elements=5000)
+    assert len(batches) > 1
+    for pixels in batches:
+        r = tsmap._ts_value_newton_batch(pixels, counts, bkg, model, c0_map)
+        ts[pixels] = r[0]
+        amp[pixels] = r[1]
+
+    # TS is the difference of two sums over the kernel window so the
+    # absolute tolerance is set by the rounding error of those sums
+    assert_allclose(ts, ts_ref, rtol=1E-13, atol=1E-10)
+    assert_allclose(amp, amp_ref, rtol=1E-13, atol=1E-13)
+
+    # Evaluation of spatial tiles from memory-mapped files
+    datadir = str(tmpdir)
+    tsmap._write_tsmap_data(datadir, counts=counts, bkg=bkg,
+                            model=model, C_0_map=c0_map)
+    tiles = tsmap._make_pixel_tiles(xyrange, 7)
+    assert len(tiles) > 1
+    ts = np.zeros(shape)
+    amp = np.zeros(shape)
+    for tile in tiles:
+        ts[tile], amp[tile] = tsmap._ts_value_newton_tile(tile, datadir)
+
+    assert_allclose(ts, ts_ref, rtol=1E-13, atol=1E-10)
+    assert_allclose(amp, amp_ref, rtol=1E-13, atol=1E-13)
+
+    assert tsmap._make_pixel_tiles([range(0), range(5)], 4) == []
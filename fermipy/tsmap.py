@@ -1,12 +1,14 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 from __future__ import absolute_import, division, print_function
 import os
+import shutil
+import tempfile
 import copy
 import logging
 import itertools
 import functools
 import json
-from multiprocessing import Pool
+from multiprocessing import Pool, cpu_count
 import numpy as np
 import warnings
 import pyLikelihood as pyLike
@@ -30,6 +32,7 @@ from fermipy.timing import Timer
 from LikelihoodState import LikelihoodState
 
 MAX_NITER = 100
+BATCH_MAX_ELEMENTS = 2**22
 
 
 def extract_images_from_tscube(infile, outfile):
@@ -643,10 +646,329 @@ def _ts_value_newton(position, counts, bkg, model, C_0_map):
     return (C_0 - C_1) * np.sign(amplitude), amplitude, niter
 
 
+def _extract_windows(array, window_shape, ix, iy):
+    """Extract windows of the spatial dimensions of an array centered
+    on a set of pixel positions.  Windows are aligned in the same way
+    as `~fermipy.utils.overlap_slices` and elements of a window
+    falling outside the array are set to zero.
+
+    Parameters
+    ----------
+    array : `~numpy.ndarray`
+        Array with shape (nebin, nx, ny).
+
+    window_shape : tuple
+        Spatial shape (wx, wy) of the window.
+
+    ix : `~numpy.ndarray`
+        Pixel indices along the first spatial dimension.
+
+    iy : `~numpy.ndarray`
+        Pixel indices along the second spatial dimension.
+
+    Returns
+    -------
+    windows : `~numpy.ndarray`
+        Array with shape (npix, nebin, wx, wy).
+    """
+    wx, wy = window_shape
+    pad = [(0, 0), (wx // 2, wx - wx // 2 - 1), (wy // 2, wy - wy // 2 - 1)]
+    array = np.pad(array, pad, mode='constant')
+    xidx = np.asarray(ix)[:, None, None] + np.arange(wx)[None, :, None]
+    yidx = np.asarray(iy)[:, None, None] + np.arange(wy)[None, None, :]
+    return np.moveaxis(array[:, xidx, yidx], 0, 1)
+
+
+def _fit_amplitude_newton_batch(counts, bkg, model, tol=1E-4):
+    """Vectorized version of `_fit_amplitude_newton` that fits the
+    amplitude of the test source simultaneously for a batch of pixels.
+    Each row of the input arrays contains the flattened data for one
+    pixel.  Pixels with zero counts contribute to the gradient but
+    not to the hessian so no explicit masking is required.
+
+    Parameters
+    ----------
+    counts : `~numpy.ndarray`
+        Count map slices with shape (npix, nbin).
+
+    bkg : `~numpy.ndarray`
+        Background map slices with shape (npix, nbin).
+
+    model : `~numpy.ndarray`
+        Source template slices with shape (npix, nbin).
+
+    Returns
+    -------
+    norm : `~numpy.ndarray`
+        Best-fit amplitude for each pixel.
+
+    niter : `~numpy.ndarray`
+        Number of fit iterations for each pixel.
+    """
+    npix = counts.shape[0]
+    norm = np.zeros(npix)
+    niter = np.zeros(npix, dtype=int)
+    active = np.ones(npix, dtype=bool)
+
+    for iiter in range(1, MAX_NITER):
+
+        if not np.any(active):
+            break
+
+        c = counts[active]
+        b = bkg[active]
+        m = model[active]
+        n = norm[active]
+
+        mu = b + n[:, None] * m
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r = np.where(c > 0, c / mu, 0.0)
+            w2 = np.where(c > 0, r / mu, 0.0)
+        grad = np.sum((1.0 - r) * m, axis=1)
+        hess = np.sum(w2 * m**2, axis=1)
+        niter[active] = iiter
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = grad / hess
+            edm = delta * grad
+
+        stop = np.zeros(len(n), dtype=bool)
+        if iiter == 1:
+            stop = grad > 0
+
+        n_new = n - delta
+        n_new = np.where(n_new > 0, n_new, 0.0)
+        n[~stop] = n_new[~stop]
+        norm[active] = n
+        stop |= edm < tol
+        active[active] = ~stop
+
+    return norm, niter
+
+
+def _ts_value_newton_batch(pixels, counts, bkg, model, C_0_map):
+    """
+    Compute TS values for a batch of pixel positions using a
+    vectorized implementation of the newton method.  The result is
+    equivalent to calling `_ts_value_newton` separately for each
+    pixel.
+
+    Parameters
+    ----------
+    pixels : tuple
+        Tuple of index arrays (ix, iy) for the pixels in the batch.
+
+    counts : list
+        List of count maps for each analysis component.
+
+    bkg : list
+        List of background maps for each analysis component.
+
+    model : list
+        List of source model maps for each analysis component.
+
+    C_0_map : list
+        List of cash statistic maps of the null hypothesis.
+
+    Returns
+    -------
+    TS : `~numpy.ndarray`
+        TS values at the given pixel positions.
+
+    amp : `~numpy.ndarray`
+        Best-fit amplitudes of the test source.
+
+    niter : `~numpy.ndarray`
+        Number of fit iterations.
+    """
+    ix, iy = pixels
+    npix = len(ix)
+
+    counts_ = []
+    bkg_ = []
+    model_ = []
+    C_0 = np.zeros(npix)
+    for c, b, m, c0 in zip(counts, bkg, model, C_0_map):
+
+        wshape = m.shape[1:]
+        valid = _extract_windows(np.ones((1,) + c.shape[1:]), wshape, ix, iy)
+        counts_ += [_extract_windows(c, wshape, ix, iy).reshape(npix, -1)]
+        bkg_ += [_extract_windows(b, wshape, ix, iy).reshape(npix, -1)]
+        model_ += [(m[None, ...] * valid).reshape(npix, -1)]
+        C_0 += np.sum(_extract_windows(c0, wshape, ix, iy).reshape(npix, -1),
+                      axis=1)
+
+    counts_ = np.concatenate(counts_, axis=1)
+    bkg_ = np.concatenate(bkg_, axis=1)
+    model_ = np.concatenate(model_, axis=1)
+
+    amplitude, niter = _fit_amplitude_newton_batch(counts_, bkg_, model_)
+
+    mu = bkg_ + amplitude[:, None] * model_
+    with np.errstate(invalid='ignore', divide='ignore'):
+        C_1 = 2.0 * np.sum(mu - np.where(counts_ > 0,
+                                         counts_ * np.log(mu), 0.0), axis=1)
+
+    return (C_0 - C_1) * np.sign(amplitude), amplitude, niter
+
+
+def _make_pixel_batches(xyrange, model, max_elements=BATCH_MAX_ELEMENTS):
+    """Split a rectangular range of pixels into batches such that
+    the number of data elements extracted per batch does not exceed
+    ``max_elements``."""
+
+    npix_elements = max(sum([m.size for m in model]), 1)
+    batch_size = max(int(max_elements // npix_elements), 1)
+
+    ix, iy = np.meshgrid(np.array(xyrange[0], dtype=int),
+                         np.array(xyrange[1], dtype=int), indexing='ij')
+    ix = ix.ravel()
+    iy = iy.ravel()
+
+    return [(ix[i:i + batch_size], iy[i:i + batch_size])
+            for i in range(0, len(ix), batch_size)]
+
+
+def _make_pixel_tiles(xyrange, ntile):
+    """Split a rectangular range of pixels into approximately
+    ``ntile`` square tiles.  Each tile is returned as a pair of slices
+    along the two spatial dimensions."""
+
+    if len(xyrange[0]) == 0 or len(xyrange[1]) == 0:
+        return []
+
+    xmin, xmax = xyrange[0][0], xyrange[0][-1] + 1
+    ymin, ymax = xyrange[1][0], xyrange[1][-1] + 1
+    npix = (xmax - xmin) * (ymax - ymin)
+    tile_size = max(int(np.ceil(np.sqrt(npix / max(ntile, 1)))), 1)
+
+    tiles = []
+    for x0, y0 in itertools.product(range(xmin, xmax, tile_size),
+                                    range(ymin, ymax, tile_size)):
+        tiles += [(slice(x0, min(x0 + tile_size, xmax)),
+                   slice(y0, min(y0 + tile_size, ymax)))]
+    return tiles
+
+
+def _write_tsmap_data(datadir, **kwargs):
+    """Write lists of arrays to numpy files in ``datadir`` such that
+    they can be memory-mapped by worker processes."""
+
+    for k, v in kwargs.items():
+        for i, t in enumerate(v):
+            np.save(os.path.join(datadir, '%s_%02i.npy' % (k, i)), t)
+
+
+_TSMAP_DATA = {}
+
+
+def _load_tsmap_data(datadir):
+    """Load the memory-mapped arrays written by `_write_tsmap_data`.
+    The arrays of the most recently used directory are kept open so
+    that tasks from the same TS map do not reopen them."""
+
+    if datadir in _TSMAP_DATA:
+        return _TSMAP_DATA[datadir]
+
+    _TSMAP_DATA.clear()
+    data = {}
+    for k in ['counts', 'bkg', 'model', 'C_0_map']:
+        data[k] = []
+        i = 0
+        while os.path.isfile(os.path.join(datadir, '%s_%02i.npy' % (k, i))):
+            data[k] += [np.load(os.path.join(datadir, '%s_%02i.npy' % (k, i)),
+                                mmap_mode='r')]
+            i += 1
+
+    _TSMAP_DATA[datadir] = data
+    return data
+
+
+def _ts_value_newton_tile(tile, datadir):
+    """
+    Compute TS values for a spatial tile of pixels.  Input data are
+    read from memory-mapped files and only the region of each map
+    overlapping with the tile and the test source kernel is loaded.
+
+    Parameters
+    ----------
+    tile : tuple
+        Pair of slices defining the tile.
+
+    datadir : str
+        Directory containing the files written by `_write_tsmap_data`.
+
+    Returns
+    -------
+    TS : `~numpy.ndarray`
+        TS values of the pixels in the tile.
+
+    amp : `~numpy.ndarray`
+        Best-fit amplitudes of the test source.
+    """
+    data = _load_tsmap_data(datadir)
+    xslice, yslice = tile
+
+    # Cutout of the maps covering the tile and the test source kernel
+    wx = [m.shape[1] for m in data['model']]
+    wy = [m.shape[2] for m in data['model']]
+    nx, ny = data['counts'][0].shape[1:]
+    xmin = max(xslice.start - max([w // 2 for w in wx]), 0)
+    xmax = min(xslice.stop + max([w - w // 2 - 1 for w in wx]), nx)
+    ymin = max(yslice.start - max([w // 2 for w in wy]), 0)
+    ymax = min(yslice.stop + max([w - w // 2 - 1 for w in wy]), ny)
+    cutout = (slice(None), slice(xmin, xmax), slice(ymin, ymax))
+
+    counts = [np.array(t[cutout]) for t in data['counts']]
+    bkg = [np.array(t[cutout]) for t in data['bkg']]
+    c0_map = [np.array(t[cutout]) for t in data['C_0_map']]
+    model = [np.array(t) for t in data['model']]
+
+    shape = (xslice.stop - xslice.start, yslice.stop - yslice.start)
+    ts_values = np.zeros(shape)
+    amp_values = np.zeros(shape)
+    xyrange = [range(xslice.start - xmin, xslice.stop - xmin),
+               range(yslice.start - ymin, yslice.stop - ymin)]
+
+    for ix, iy in _make_pixel_batches(xyrange, model):
+        r = _ts_value_newton_batch((ix, iy), counts, bkg, model, c0_map)
+        ts_values[ix - xslice.start + xmin, iy - yslice.start + ymin] = r[0]
+        amp_values[ix - xslice.start + xmin, iy - yslice.start + ymin] = r[1]
+
+    return ts_values, amp_values
+
+
 class TSMapGenerator(object):
     """Mixin class for `~fermipy.gtanalysis.GTAnalysis` that
     generates TS maps."""
 
+    def _get_tsmap_pool(self, nthread=None):
+        """Return the pool of worker processes used for TS map
+        calculations.  The pool is created on the first call and
+        reused by subsequent calls with the same number of
+        processes."""
+
+        pool = getattr(self, '_tsmap_pool', None)
+        if pool is not None and self._tsmap_pool_nthread == nthread:
+            return pool
+
+        self._close_tsmap_pool()
+        self._tsmap_pool = Pool(processes=nthread)
+        self._tsmap_pool_nthread = nthread
+        return self._tsmap_pool
+
+    def _close_tsmap_pool(self):
+        """Shut down the pool of worker processes used for TS map
+        calculations."""
+
+        pool = getattr(self, '_tsmap_pool', None)
+        if pool is None:
+            return
+
+        pool.close()
+        pool.join()
+        self._tsmap_pool = None
+
     def tsmap(self, prefix='', **kwargs):
         """Generate a spatial TS map for a source component with
         properties defined by the `model` argument.  The TS map will
@@ -771,6 +1093,8 @@ class TSMapGenerator(object):
         src_dict = {} if src_dict is None else src_dict
 
         multithread = kwargs.setdefault('multithread', False)
+        nthread = kwargs.setdefault('nthread', None)
+        vectorize = kwargs.setdefault('vectorize', True)
         threshold = kwargs.setdefault('threshold', 1E-2)
         max_kernel_radius = kwargs.get('max_kernel_radius')
         loge_bounds = kwargs.setdefault('loge_bounds', None)
@@ -898,25 +1222,57 @@ class TSMapGenerator(object):
             xslice = slice(0, self.npix)
             yslice = slice(0, self.npix)
 
-        positions = []
-        for i, j in itertools.product(xyrange[0], xyrange[1]):
-            p = [[k // 2, i, j] for k in enumbins]
-            positions += [p]
-
         self.logger.log(loglevel, 'Fitting test source.')
-        if multithread:
-            pool = Pool()
-            results = pool.map(wrap, positions)
-            pool.close()
-            pool.join()
+        if vectorize:
+
+            if multithread:
+
+                pool = self._get_tsmap_pool(nthread)
+                datadir = tempfile.mkdtemp(prefix='tsmap_', dir=self.workdir)
+                try:
+                    _write_tsmap_data(datadir, counts=counts, bkg=bkg,
+                                      model=model, C_0_map=c0_map)
+                    wrap = functools.partial(_ts_value_newton_tile,
+                                             datadir=datadir)
+                    tiles = _make_pixel_tiles(xyrange,
+                                              4 * (nthread or cpu_count()))
+                    results = pool.map(wrap, tiles)
+                finally:
+                    shutil.rmtree(datadir)
+
+                for tile, r in zip(tiles, results):
+                    ts_values[tile] = r[0]
+                    amp_values[tile] = r[1]
+
+            else:
+
+                wrap = functools.partial(_ts_value_newton_batch,
+                                         counts=counts, bkg=bkg,
+                                         model=model, C_0_map=c0_map)
+                batches = _make_pixel_batches(xyrange, model)
+                for pixels in batches:
+                    r = wrap(pixels)
+                    ts_values[pixels] = r[0]
+                    amp_values[pixels] = r[1]
+
         else:
-            results = map(wrap, positions)
 
-        for i, r in enumerate(results):
-            ix = positions[i][0][1]
-            iy = positions[i][0][2]
-            ts_values[ix, iy] = r[0]
-            amp_values[ix, iy] = r[1]
+            positions = []
+            for i, j in itertools.product(xyrange[0], xyrange[1]):
+                p = [[k // 2, i, j] for k in enumbins]
+                positions += [p]
+
+            if multithread:
+                pool = self._get_tsmap_pool(nthread)
+                results = pool.map(wrap, positions)
+            else:
+                results = map(wrap, positions)
+
+            for i, r in enumerate(results):
+                ix = positions[i][0][1]
+                iy = positions[i][0][2]
+                ts_values[ix, iy] = r[0]
+                amp_values[ix, iy] = r[1]
 
         ts_values = ts_values[xslice, yslice]
         amp_values = amp_values[xslice, yslice]
@@ -3,6 +3,7 @@ from __future__ import absolute_import, division, print_function
 import os
 import re
 import copy
+import inspect
 import tempfile
 import functools
 from collections import OrderedDict
@@ -57,7 +58,7 @@ def write_yaml(o, outfile, **kwargs):
 
 
 def load_npy(infile):
-    return np.load(infile).flat[0]
+    return np.load(infile, allow_pickle=True).flat[0]
 
 
 def load_data(infile, workdir=None):
@@ -1573,6 +1574,203 @@ def make_disk_kernel(radius, npix=501, cdelt=0.01, xpix=None, ypix=None):
     return k
 
 
+def make_radial_window(dtheta, vals, lmax):
+    """Compute the spherical harmonic window function (beam transfer
+    function) of one or more radially symmetric kernels,
+
+    b_l = 2 pi int P(theta) P_l(cos theta) sin theta dtheta
+
+    normalized such that b_0 = 1.  The integral is evaluated with the
+    trapezoidal rule on the grid of angular offsets.
+
+    Parameters
+    ----------
+    dtheta : `~numpy.ndarray`
+      Array of angular offsets in degrees.
+
+    vals : `~numpy.ndarray`
+      Kernel values evaluated at ``dtheta``.  A 2D array of shape
+      (ndtheta, N) defines N kernels.
+
+    lmax : int
+      Maximum multipole.
+
+    Returns
+    -------
+    bl : `~numpy.ndarray`
+      Window function with shape (lmax+1,) or (N, lmax+1).
+    """
+    theta = np.radians(np.asarray(dtheta, dtype=float))
+    vals = np.asarray(vals, dtype=float)
+    ndim = vals.ndim
+    if ndim == 1:
+        vals = vals[:, np.newaxis]
+
+    delta = theta[1:] - theta[:-1]
+    wts = np.zeros(theta.shape)
+    wts[1:] += 0.5 * delta
+    wts[:-1] += 0.5 * delta
+    f = vals * (np.sin(theta) * wts)[:, np.newaxis]
+
+    # Evaluate the Legendre polynomials with the upward recurrence
+    x = np.cos(theta)
+    bl = np.zeros((lmax + 1, vals.shape[1]))
+    p0 = np.ones(theta.shape)
+    p1 = x
+    bl[0] = np.dot(p0, f)
+    if lmax > 0:
+        bl[1] = np.dot(p1, f)
+    for l in range(1, lmax):
+        p0, p1 = p1, ((2 * l + 1) * x * p1 - l * p0) / (l + 1)
+        bl[l + 1] = np.dot(p1, f)
+
+    bl /= bl[0]
+    bl = bl.T
+    return bl[0] if ndim == 1 else bl
+
+
+class LRUCache(object):
+    """Bounded least-recently-used cache.  The least recently used
+    entries are evicted when the number of entries exceeds
+    ``maxsize`` or the total size of the cached arrays (or
+    sequences of arrays) exceeds ``maxbytes``.  Counts of cache hits and misses are kept for
+    diagnostics."""
+
+    def __init__(self, maxsize=128, maxbytes=None):
+        self._data = OrderedDict()
+        self._maxsize = maxsize
+        self._maxbytes = maxbytes
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def get(self, key, default=None):
+        if key not in self._data:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        val = self._data.pop(key)
+        self._data[key] = val
+        return val
+
+    @staticmethod
+    def _get_nbytes(val):
+        if isinstance(val, (tuple, list)):
+            return sum([LRUCache._get_nbytes(v) for v in val])
+        return getattr(val, 'nbytes', 0)
+
+    def put(self, key, val):
+
+        nbytes = self._get_nbytes(val)
+        if self._maxbytes is not None and nbytes > self._maxbytes:
+            return
+
+        if key in self._data:
+            self._nbytes -= self._get_nbytes(self._data.pop(key))
+
+        self._data[key] = val
+        self._nbytes += nbytes
+
+        while (len(self._data) > self._maxsize or
+               (self._maxbytes is not None and
+                self._nbytes > self._maxbytes)):
+            k, v = self._data.popitem(last=False)
+            self._nbytes -= self._get_nbytes(v)
+
+    def clear(self):
+        self._data.clear()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    size=len(self._data), nbytes=self._nbytes)
+
+
+_radial_profile_cache = LRUCache(maxsize=4096)
+_kernel_cache = LRUCache(maxsize=256, maxbytes=2**28)
+
+
+def get_kernel_cache_stats():
+    """Return the hit/miss statistics of the caches of radial
+    profiles and 2D kernels."""
+    return {'profile': _radial_profile_cache.stats(),
+            'kernel': _kernel_cache.stats()}
+
+
+def clear_kernel_cache():
+    """Drop all cached radial profiles and 2D kernels."""
+    _radial_profile_cache.clear()
+    _kernel_cache.clear()
+
+
+def _make_kernel_cache_key(name, args):
+    """Build a cache key from the call arguments of a kernel function.
+    Returns None if the PSF model cannot be identified or a PSF
+    scaling function is in use, in which case the kernel is not
+    cached."""
+
+    psf = args.get('psf')
+    psf_hash = getattr(psf, 'hash', None)
+    if psf_hash is None:
+        return None
+
+    if (args.get('psf_scale_fn') is not None or
+            getattr(psf, 'scale_fn', None) is not None):
+        return None
+
+    key = [name, psf_hash]
+    for k in sorted(args.keys()):
+        if k in ['psf', 'psf_scale_fn']:
+            continue
+        v = args[k]
+        if isinstance(v, np.ndarray):
+            v = (v.shape, v.tobytes())
+        elif not callable(v):
+            v = repr(v)
+        key += [(k, v)]
+    return tuple(key)
+
+
+def cache_kernel(cache):
+    """Decorator that caches the output array of a kernel function in
+    ``cache``.  The PSF model is identified by its hash, and all other
+    arguments by value.  A copy of the cached array is returned so
+    that callers can modify it in place."""
+
+    def decorator(fn):
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+
+            key = _make_kernel_cache_key(fn.__name__,
+                                         inspect.getcallargs(fn, *args,
+                                                             **kwargs))
+            if key is None:
+                return fn(*args, **kwargs)
+
+            val = cache.get(key)
+            if val is None:
+                val = fn(*args, **kwargs)
+                cache.put(key, val)
+            return val.copy()
+        return wrapper
+    return decorator
+
+
+@cache_kernel(_kernel_cache)
 def make_cdisk_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
                       normalize=False):
     """Make a kernel for a PSF-convolved 2D disk.
@@ -1606,6 +1804,7 @@ def make_cdisk_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
     return k
 
 
+@cache_kernel(_kernel_cache)
 def make_cgauss_kernel(psf, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
                        normalize=False):
     """Make a kernel for a PSF-convolved 2D gaussian.
@@ -1652,6 +1851,7 @@ def memoize(obj):
     return memoizer
 
 
+@cache_kernel(_kernel_cache)
 def make_radial_kernel(psf, fn, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=None,
                        normalize=False, klims=None, sparse=False):
     """Make a kernel for a general radially symmetric 2D function.
@@ -1730,6 +1930,7 @@ def make_radial_kernel(psf, fn, sigma, npix, cdelt, xpix, ypix, psf_scale_fn=Non
     return k
 
 
+@cache_kernel(_radial_profile_cache)
 def eval_radial_kernel(psf, fn, sigma, idx, dtheta, psf_scale_fn):
 
     if fn is None:
@@ -1766,6 +1967,7 @@ def create_radial_spline(psf, fn, sigma, egy, dtheta, psf_scale_fn):
     return sp
 
 
+@cache_kernel(_kernel_cache)
 def make_psf_kernel(psf, npix, cdelt, xpix, ypix, psf_scale_fn=None, normalize=False):
     """
     Generate a kernel for a point-source.
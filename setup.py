@@ -43,6 +43,8 @@ setup(
         'fermipy-quick-analysis = fermipy.scripts.quickanalysis:main',
         'fermipy-coadd = fermipy.scripts.coadd:main',
         'fermipy-coadd-sg = fermipy.diffuse.job_library:invoke_sg_fermipy_coadd',
+        'fermipy-lightcurve-bin = fermipy.lightcurve:main_single',
+        'fermipy-lightcurve-bin-sg = fermipy.lightcurve:main_batch',
         'fermipy-vstack = fermipy.scripts.vstack_images:main',
         'fermipy-gather-srcmaps = fermipy.scripts.gather_srcmaps:main',
         'fermipy-gtexcube2-sg = fermipy.diffuse.job_library:invoke_sg_gtexpcube2',